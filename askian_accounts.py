@@ -0,0 +1,210 @@
+"""
+AskIan Accounts - Several mailboxes served by one daemon
+========================================================
+Each Account is one login: its own IMAP session, SMTP pool, reply budget
+(rate limiter) and sync cursor. Personas are assigned to the account
+whose address they reply from; any persona not assigned elsewhere goes
+through the default account. Replies are sent from the account's own
+address unless the persona's address is one of its `aliases` (the
+providers reject a From address that doesn't belong to the login).
+
+serve() runs every account from a single thread. Each IMAP session is
+parked in IDLE and one selector waits on all their sockets at once, so
+an idle account costs a socket and nothing else. Accounts whose server
+has no IDLE support (or all of them, in poll mode) are checked on a
+timer from the same loop. A dropped connection only affects its own
+account, which is reconnected after a delay.
+
+Accounts can also be listed in a JSON file, one object per account with
+the Account constructor's arguments. Use "password_env" to name an
+environment variable rather than putting the password in the file.
+"""
+
+import imaplib
+import json
+import logging
+import os
+import selectors
+import time
+
+from askian_imap import IMAPSession, CONNECTION_ERRORS
+from askian_ratelimit import RateLimiter
+from askian_smtp import SMTPPool
+
+
+class Account:
+    """One mailbox login and everything that is per-login."""
+
+    def __init__(self, name, address, password, imap_host, smtp_host, personas=(),
+                 mailbox="inbox", imap_port=None, smtp_port=465, use_ssl=True,
+                 smtp_pool_size=2, max_per_hour=10, max_per_sender_per_hour=10,
+                 max_per_persona_per_hour=None, sync_key=None, aliases=()):
+        self.name = name
+        self.address = address
+        self.password = password
+        self.personas = list(personas)
+        self.aliases = {alias.lower() for alias in aliases}
+        self.mailbox = mailbox
+        self.imap_host = imap_host
+        self.imap_port = imap_port
+        self.use_ssl = use_ssl
+        # Cursor and claims are stored under this name in the state store
+        self.sync_key = sync_key or f"{name}/{mailbox}"
+        self.session = IMAPSession(imap_host, address, password, mailbox, port=imap_port, use_ssl=use_ssl)
+        self.smtp_pool = SMTPPool(smtp_host, address, password, port=smtp_port,
+                                  use_ssl=use_ssl, size=smtp_pool_size)
+        self.rate_limiter = RateLimiter(max_per_hour, max_per_sender_per_hour, max_per_persona_per_hour)
+
+    def sender_for(self, address):
+        """The From address to use for a reply meant to come from `address`."""
+        if address.lower() == self.address.lower() or address.lower() in self.aliases:
+            return address
+        return self.address
+
+    def open_imap(self):
+        """A fresh logged-in connection, mailbox not yet selected (poll mode)."""
+        if self.use_ssl:
+            conn = imaplib.IMAP4_SSL(self.imap_host, self.imap_port or imaplib.IMAP4_SSL_PORT,
+                                     timeout=self.session.timeout)
+        else:
+            conn = imaplib.IMAP4(self.imap_host, self.imap_port or imaplib.IMAP4_PORT,
+                                 timeout=self.session.timeout)
+        conn.login(self.address, self.password)
+        return conn
+
+    def __repr__(self):
+        return f"<Account {self.name} {self.address}>"
+
+
+class AccountRegistry:
+    """All accounts, and which one each persona replies through."""
+
+    def __init__(self, accounts):
+        if not accounts:
+            raise ValueError("at least one account is needed")
+        self.accounts = list(accounts)
+        self.default = self.accounts[0]
+        self._by_persona = {}
+        for account in self.accounts:
+            for persona_key in account.personas:
+                self._by_persona[persona_key] = account
+
+    def __iter__(self):
+        return iter(self.accounts)
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def add(self, account):
+        if any(a.name == account.name for a in self.accounts):
+            raise ValueError(f"duplicate account name {account.name!r}")
+        self.accounts.append(account)
+        for persona_key in account.personas:
+            self._by_persona[persona_key] = account
+
+    def for_persona(self, persona_key):
+        return self._by_persona.get(persona_key, self.default)
+
+    def addresses(self):
+        return {account.address.lower() for account in self.accounts}
+
+    def add_entries(self, entries, defaults=None):
+        """Add accounts from dicts of Account arguments (plus "password_env")."""
+        for entry in entries:
+            entry = {**(defaults or {}), **entry}
+            password_env = entry.pop("password_env", None)
+            if password_env:
+                entry["password"] = os.environ.get(password_env, "")
+            self.add(Account(**entry))
+
+    def load(self, path, defaults=None):
+        """Add the accounts listed in a JSON file. Returns how many were added."""
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path, "r") as f:
+            entries = json.load(f)
+        self.add_entries(entries, defaults)
+        logging.info(f"Loaded {len(entries)} account(s) from {path}")
+        return len(entries)
+
+
+def serve(accounts, on_mail, idle_timeout, poll_interval, reconnect_delay, use_idle=True):
+    """
+    Call on_mail(account, conn) whenever an account may have new mail, for
+    every account, from this one thread. `conn` is the account's live,
+    selected IMAP connection, or None in poll mode (on_mail opens its own).
+    Never returns.
+    """
+    selector = selectors.DefaultSelector()
+    idling = set()
+    no_idle = set()
+    due = {account: 0.0 for account in accounts}  # monotonic time of next check
+
+    def check(account):
+        session = account.session
+        try:
+            if account in idling:
+                selector.unregister(session.conn.sock)
+                idling.discard(account)
+                session.stop_idle()
+            if not use_idle or account in no_idle:
+                on_mail(account, None)
+                return poll_interval
+            conn = session.ensure()
+            if not session.supports_idle:
+                logging.warning(f"IMAP server for {account.name} does not support IDLE — polling it")
+                no_idle.add(account)
+                session.close()
+                on_mail(account, None)
+                return poll_interval
+            session.pending_mail()  # this check covers whatever SELECT/NOOP announced
+            on_mail(account, conn)
+            # Mail that arrived meanwhile was announced to our commands, not to IDLE
+            while session.pending_mail():
+                logging.info(f"New mail arrived during the check ({account.name}) — checking again")
+                on_mail(account, conn)
+            new_mail = session.start_idle()
+            selector.register(conn.sock, selectors.EVENT_READ, account)
+            idling.add(account)
+            if new_mail:
+                # Reported before the server confirmed IDLE: check again now
+                logging.info(f"IDLE: new mail notification ({account.name})")
+                return 0.0
+            return idle_timeout
+        except CONNECTION_ERRORS as e:
+            logging.error(f"IMAP session error ({account.name}): {e} — reconnecting in {reconnect_delay}s")
+            session.close()
+            return reconnect_delay
+
+    def dropped(account, error):
+        logging.error(f"IMAP session error ({account.name}): {error}")
+        selector.unregister(account.session.conn.sock)
+        idling.discard(account)
+        account.session.close()
+        due[account] = time.monotonic() + reconnect_delay
+
+    while True:
+        # Lines already buffered above the socket won't wake select()
+        readable = set()
+        for account in list(idling):
+            try:
+                if account.session.buffered():
+                    readable.add(account)
+            except CONNECTION_ERRORS as e:
+                dropped(account, e)
+        timeout = 0.0 if readable else max(0.0, min(due.values()) - time.monotonic())
+        readable.update(key.data for key, _ in selector.select(timeout))
+        ready = set()
+        for account in readable:
+            if account not in idling:
+                continue
+            try:
+                if account.session.poll_idle():
+                    logging.info(f"IDLE: new mail notification ({account.name})")
+                    ready.add(account)
+            except CONNECTION_ERRORS as e:
+                dropped(account, e)
+        now = time.monotonic()
+        ready.update(account for account, when in due.items() if when <= now)
+        for account in ready:
+            due[account] = time.monotonic() + check(account)
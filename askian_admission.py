@@ -0,0 +1,67 @@
+"""
+AskIan Admission - Backlog-aware load shedding
+==============================================
+A burst of mail used to be triaged against the rate limits one letter at
+a time. Whatever didn't fit was logged as "rate limit reached", marked
+read and dropped, so those senders never heard back. Meanwhile the
+letters that did fit queued for the LLM however long that queue had
+grown.
+
+AdmissionControl estimates how long a new letter would wait and picks
+the cheapest way to still answer it:
+
+  - The reply budget (the rate limits) is full: the letter is deferred.
+    It is queued with a due time, the moment the limiter's windows will
+    have room for it after the letters already deferred, and it is not
+    looked at again until then. Letters that would wait longer than
+    `max_defer` are dropped, as before.
+  - The LLM queue would take longer than `ack_after` to drain: the
+    letter gets a templated acknowledgment, with no LLM call.
+  - It would take longer than `short_after`: replies are generated with
+    `short_factor` of the usual max_tokens until the queue comes down.
+
+Drain time is the generate backlog times the recent time per generated
+reply (an exponentially weighted average), divided by the worker count.
+"""
+
+import threading
+
+
+class AdmissionControl:
+    """Drain-time estimates for the generate queue, and what to do about them."""
+
+    def __init__(self, workers, short_after=120, ack_after=900, max_defer=24 * 3600,
+                 short_factor=0.6, initial_seconds=10.0, smoothing=0.2):
+        self.workers = max(1, workers)
+        self.short_after = short_after
+        self.ack_after = ack_after
+        self.max_defer = max_defer
+        self.short_factor = short_factor
+        self.smoothing = smoothing
+        self.seconds_per_reply = initial_seconds
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        """Time one generate-stage job took."""
+        with self._lock:
+            self.seconds_per_reply += self.smoothing * (seconds - self.seconds_per_reply)
+
+    def drain_time(self, backlog):
+        """Seconds for the workers to get through `backlog` queued replies."""
+        return backlog * self.seconds_per_reply / self.workers
+
+    def should_ack(self, backlog):
+        """True if a letter queued behind `backlog` others should get the templated reply."""
+        return self.drain_time(backlog + 1) > self.ack_after
+
+    def max_tokens(self, max_tokens, backlog):
+        """The token limit for a reply generated while `backlog` more are queued."""
+        if self.drain_time(backlog) > self.short_after:
+            return max(1, int(max_tokens * self.short_factor))
+        return max_tokens
+
+    def defer_until(self, free_at, now):
+        """The due time for a letter the budget has room for at `free_at`, or None to drop it."""
+        if free_at - now > self.max_defer:
+            return None
+        return free_at
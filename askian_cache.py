@@ -0,0 +1,156 @@
+"""
+AskIan Reply Cache - Reuse replies to repeated letters
+======================================================
+The same chain letters, test emails and "are you real?" questions reach
+the same personas over and over. This cache keys a generated reply on the
+persona plus a hash of the normalised body, so a repeat costs nothing.
+
+Callers pass the letter as the model is shown it (see askian_text), so
+quoted history and signatures are already gone. Normalisation caps it at
+2000 characters, drops any remaining quoted lines and folds whitespace
+and case, so trivial differences still hit.
+
+Entries expire after a TTL and the cache is LRU-bounded. It is saved to a
+JSON file (atomically) so it survives restarts. Several daemon processes
+may share the file: each save merges in what the others saved, through a
+temp file of its own. Hit/miss counters and the generation time saved
+are available from stats().
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+_QUOTE_LINE_RE = re.compile(r"^\s*>.*$", re.MULTILINE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_body(text, limit=2000):
+    """Canonical form of an email body for cache keying."""
+    text = _QUOTE_LINE_RE.sub("", text[:limit])
+    return _WHITESPACE_RE.sub(" ", text).strip().lower()
+
+
+def cache_key(persona_key, body, limit=2000):
+    digest = hashlib.sha256(normalize_body(body, limit).encode("utf-8")).hexdigest()
+    return f"{persona_key}:{digest}"
+
+
+class ResponseCache:
+    """TTL + LRU cache of generated replies, persisted to a JSON file."""
+
+    def __init__(self, path=None, max_entries=500, ttl=7 * 24 * 3600, body_limit=2000):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.body_limit = body_limit
+        # key -> {"reply", "created", "latency"}; least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        if path:
+            self.load()
+
+    def get(self, persona_key, body):
+        """Return a cached reply, or None."""
+        key = cache_key(persona_key, body, self.body_limit)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry["created"] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                    self._dirty = True
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += entry.get("latency") or 0.0
+            return entry["reply"]
+
+    def put(self, persona_key, body, reply, latency=None):
+        """Store a freshly generated reply (latency = seconds it took)."""
+        key = cache_key(persona_key, body, self.body_limit)
+        with self._lock:
+            self._entries[key] = {"reply": reply, "created": time.time(), "latency": latency}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 1),
+            }
+
+    def load(self):
+        """Read the cache file, dropping anything already expired."""
+        self._merge(self._read())
+
+    def save(self):
+        """
+        Write the cache file if anything changed (atomic replace), first
+        merging in entries other processes saved since we last looked.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+        self._merge(self._read())
+        with self._lock:
+            # A list keeps the LRU order on reload
+            snapshot = list(self._entries.items())
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".",
+                                            suffix=".tmp", dir=os.path.dirname(self.path) or ".")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logging.warning(f"Reply cache not saved: {e}")
+            self._dirty = True
+
+    def _read(self):
+        """[(key, entry)] from the cache file, oldest use first ([] if none)."""
+        if not self.path or not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Reply cache file unreadable, ignoring it: {e}")
+            return []
+
+    def _merge(self, entries):
+        """Add unexpired entries we don't have, as less recently used than ours."""
+        now = time.time()
+        with self._lock:
+            ours = self._entries
+            self._entries = OrderedDict(
+                (key, entry) for key, entry in entries
+                if key not in ours and now - entry["created"] <= self.ttl
+            )
+            self._entries.update(ours)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,153 @@
+"""
+AskIan Dedup - Long-horizon, memory-bounded replied-ID archive
+==============================================================
+Recent replied Message-IDs live exactly in the state store. Once they age
+past the exact window they are folded into time-bucketed Bloom filters
+(one per week by default) and dropped from the exact table, so the
+dedup horizon can be a year or more while memory stays fixed.
+
+Each filter is sized so the whole archive stays inside a false-positive
+budget: with B buckets, each filter targets budget / B. A false positive
+means a genuinely new email is treated as already answered, so the
+budget should be small. estimated_fp_rate() measures the real rate from
+how full the filters are.
+
+Several workers may share the store. Archiving merges into the stored
+filters inside a write transaction, and a lookup first re-reads them if
+the stored version has moved on, so every worker sees every archived ID.
+
+IDs only ever enter a filter after the reply was sent and aged out of the
+exact table. A reservation that is released after a failed send therefore
+never leaves a trace, since Bloom filters can't forget.
+"""
+
+import hashlib
+import logging
+import math
+
+DAY = 24 * 3600
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter with double hashing over one blake2b digest."""
+
+    def __init__(self, capacity, fp_rate, bits=None, k=None, count=0):
+        if bits is None:
+            m = -capacity * math.log(fp_rate) / math.log(2) ** 2
+            bits = bytearray(max(1, math.ceil(m / 8)))
+        self.bits = bytearray(bits)
+        self.m = len(self.bits) * 8
+        self.k = k or max(1, round(self.m / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = count
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8", "surrogateescape"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.m for i in range(self.k))
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def fill_ratio(self):
+        return sum(bin(b).count("1") for b in self.bits) / self.m
+
+    def fp_rate(self):
+        """Current false-positive probability, measured from the set bits."""
+        return self.fill_ratio() ** self.k
+
+
+class ReplyArchive:
+    """
+    Time-bucketed Bloom filters for replied Message-IDs older than the
+    exact window. Filters are persisted through the state store.
+    """
+
+    def __init__(self, store, retention_days=365, bucket_days=7,
+                 expected_per_bucket=5000, fp_budget=1e-4):
+        self.store = store
+        self.retention = retention_days * DAY
+        self.bucket_span = bucket_days * DAY
+        self.expected_per_bucket = expected_per_bucket
+        buckets = max(1, math.ceil(retention_days / bucket_days))
+        self.fp_per_filter = fp_budget / buckets
+        self.fp_budget = fp_budget
+        # (bucket, seq) -> BloomFilter
+        self.filters = {}
+        self.version = None
+        self.load(*store.load_archive())
+
+    def load(self, rows, version):
+        """Replace the filters with stored (bucket, seq, count, k, bits) rows."""
+        self.filters = {
+            (bucket, seq): BloomFilter(self.expected_per_bucket, self.fp_per_filter,
+                                       bits=bits, k=k, count=count)
+            for bucket, seq, count, k, bits in rows
+        }
+        self.version = version
+
+    def refresh(self):
+        """Re-read the filters if another worker has changed them."""
+        if self.store.archive_version() != self.version:
+            self.load(*self.store.load_archive())
+
+    def __contains__(self, message_id):
+        self.refresh()
+        return any(message_id in f for f in list(self.filters.values()))
+
+    def archive(self, entries, now):
+        """
+        Fold (message_id, replied_at) pairs into their buckets' filters and
+        drop buckets older than the retention period. Returns the changed
+        filters as rows ready for the store.
+        """
+        changed = {}
+        for message_id, replied_at in entries:
+            key = self._open_filter(int(replied_at // self.bucket_span))
+            self.filters[key].add(message_id)
+            changed[key] = self.filters[key]
+
+        oldest = int((now - self.retention) // self.bucket_span)
+        expired = [key for key in self.filters if key[0] < oldest]
+        for key in expired:
+            del self.filters[key]
+
+        rows = [(b, s, f.count, f.k, bytes(f.bits)) for (b, s), f in changed.items()
+                if (b, s) in self.filters]
+        return rows, oldest
+
+    def _open_filter(self, bucket):
+        """The filter to add to for this bucket — a new one once it's full."""
+        seqs = [s for b, s in self.filters if b == bucket]
+        seq = max(seqs) if seqs else 0
+        key = (bucket, seq)
+        if key in self.filters and self.filters[key].count >= self.expected_per_bucket:
+            key = (bucket, seq + 1)
+        if key not in self.filters:
+            self.filters[key] = BloomFilter(self.expected_per_bucket, self.fp_per_filter)
+        return key
+
+    def estimated_fp_rate(self):
+        """Chance an unseen Message-ID matches any filter in the archive."""
+        miss = 1.0
+        for f in self.filters.values():
+            miss *= 1.0 - f.fp_rate()
+        return 1.0 - miss
+
+    def size_bytes(self):
+        return sum(len(f.bits) for f in self.filters.values())
+
+    def check_budget(self):
+        rate = self.estimated_fp_rate()
+        if rate > self.fp_budget:
+            logging.warning(
+                f"Dedup archive false-positive estimate {rate:.2e} is over budget "
+                f"{self.fp_budget:.0e} — raise expected_per_bucket"
+            )
+        return rate
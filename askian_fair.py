@@ -0,0 +1,70 @@
+"""
+AskIan Fair Scheduler - Weighted fair ordering of pending replies
+=================================================================
+Orders pending work so that one sender dumping 200 emails, or a spike on
+one persona, can't push everyone else to the back of the queue or use up
+the global reply budget by itself.
+
+It is weighted fair queuing with two levels, persona then sender. Within
+a persona, the k-th pending item from a sender gets the virtual finish tag
+
+    (recent + k) / sender_weight
+
+where `recent` counts that sender's replies inside the rate-limit window,
+so someone who has just been answered starts behind someone who hasn't.
+A first-time correspondent's first letter is weighted first_timer_weight
+instead, so it moves ahead; their later letters queue like anyone else's,
+so a brand-new address can't jump a flood past everybody. The persona
+queues are then merged the same way using persona weights: the j-th item
+of a persona gets j / persona_weight. Ties keep arrival order.
+
+With unit weights this interleaves senders round-robin, the same order
+deficit round-robin gives for equal-cost jobs. There is no per-flow state
+to keep: each call orders a fresh snapshot of what is pending.
+"""
+
+
+class FairScheduler:
+    """Weighted fair ordering by persona, then by sender."""
+
+    def __init__(self, persona_weights=None, sender_weights=None,
+                 first_timer_weight=4.0, default_weight=1.0):
+        self.persona_weights = persona_weights or {}
+        self.sender_weights = sender_weights or {}
+        self.first_timer_weight = first_timer_weight
+        self.default_weight = default_weight
+
+    def sender_weight(self, sender, first_time=False):
+        if first_time:
+            return self.first_timer_weight
+        return self.sender_weights.get(sender, self.default_weight)
+
+    def persona_weight(self, persona):
+        return self.persona_weights.get(persona, self.default_weight)
+
+    def order(self, items, sender_of, persona_of, new_senders=(), recent=None):
+        """
+        Return `items` (in arrival order) in fair service order.
+        new_senders: senders never replied to before.
+        recent(sender): replies that sender already got in the current window.
+        """
+        by_persona = {}
+        served = {}
+        for index, item in enumerate(items):
+            sender, persona = sender_of(item), persona_of(item)
+            key = (persona, sender)
+            if key not in served:
+                served[key] = recent(sender) if recent else 0
+            served[key] += 1
+            first_time = served[key] == 1 and sender in new_senders
+            tag = served[key] / self.sender_weight(sender, first_time)
+            by_persona.setdefault(persona, []).append((tag, index, item))
+
+        merged = []
+        for persona, queue in by_persona.items():
+            queue.sort(key=lambda entry: entry[:2])
+            weight = self.persona_weight(persona)
+            for position, (_, index, item) in enumerate(queue, 1):
+                merged.append((position / weight, index, item))
+        merged.sort(key=lambda entry: entry[:2])
+        return [item for _, _, item in merged]
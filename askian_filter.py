@@ -0,0 +1,181 @@
+"""
+AskIan Filter - Compiled keyword and phrase filter
+==================================================
+Replaces one substring search per banned word. Terms are compiled once
+into a single regex per rule set, so checking a letter is one pass over
+the text however long the list grows. The alternation is built from a
+character trie of the terms (shared prefixes factored out), which keeps
+the regex engine from retrying every term at every position.
+
+Terms longer than MAX_TERM_CHARS are skipped with a warning, and a rules
+file that fails to compile leaves the previous rules in place.
+
+Matching is on whole words: "offensive" does not hit "inoffensive".
+Text and terms are both normalised first (NFKC, case-folded, accents
+removed), so "OFFÉNSIVE" and full-width letters match as well. Inside a
+phrase, any run of whitespace matches a space.
+
+The list lives in a plain text file, re-read automatically when it
+changes (checked at most every `reload_interval` seconds):
+
+    # one term or phrase per line; lines before any [section] apply to everyone
+    offensive
+    kill yourself
+    [henry]
+    anne boleyn's ghost
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+
+GLOBAL_RULES = "*"
+
+# Longer "terms" are almost certainly a pasted paragraph, not a phrase
+MAX_TERM_CHARS = 200
+
+_SECTION_RE = re.compile(r"^\[([^\]]+)\]$")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize(text):
+    """Case-folded, accent-free NFKC text with runs of whitespace collapsed."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _SPACE_RE.sub(" ", unicodedata.normalize("NFKC", stripped))
+
+
+def _trie_pattern(root):
+    """
+    Regex source for a trie of {char: subtrie}, "" marking a term end.
+    Built bottom-up with an explicit stack rather than recursion, which
+    would need a stack frame per character of the longest term.
+    """
+    sources = {}  # id(node) -> regex source
+    stack = [(root, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if not children_done:
+            stack.append((node, True))
+            stack.extend((child, False) for char, child in node.items() if char)
+            continue
+        branches = []
+        for char in sorted(c for c in node if c):
+            char_re = r"\s+" if char == " " else re.escape(char)
+            branches.append(char_re + sources.pop(id(node[char])))
+        if not branches:
+            sources[id(node)] = ""
+            continue
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            body = f"(?:{body})?" if len(branches) > 1 or len(body) > 1 else f"{body}?"
+        sources[id(node)] = body
+    return sources[id(root)]
+
+
+def compile_terms(terms):
+    """One word-bounded regex matching any of `terms` (None if empty)."""
+    trie = {}
+    for term in terms:
+        term = normalize(term).strip()
+        if not term:
+            continue
+        if len(term) > MAX_TERM_CHARS:
+            logging.warning(f"Content filter term over {MAX_TERM_CHARS} characters skipped: {term[:40]!r}…")
+            continue
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    if not trie:
+        return None
+    return re.compile(r"(?<!\w)" + _trie_pattern(trie) + r"(?!\w)")
+
+
+def parse_rules(lines):
+    """{persona_key or GLOBAL_RULES: [terms]} from the filter file format."""
+    rules = {GLOBAL_RULES: []}
+    section = GLOBAL_RULES
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        header = _SECTION_RE.match(line)
+        if header:
+            section = header.group(1).strip().lower()
+            rules.setdefault(section, [])
+        else:
+            rules[section].append(line)
+    return rules
+
+
+class ContentFilter:
+    """Banned terms, global and per persona, with hot reload from a file."""
+
+    def __init__(self, terms=(), path=None, reload_interval=30):
+        self.default_terms = list(terms)
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = 0.0
+        self._patterns = {}
+        self.compile({GLOBAL_RULES: self.default_terms})
+        self.reload()
+
+    def compile(self, rules):
+        """Swap in a new rule set ({persona_key or GLOBAL_RULES: [terms]})."""
+        patterns = {key: compile_terms(terms) for key, terms in rules.items()}
+        self._patterns = {key: p for key, p in patterns.items() if p is not None}
+
+    def reload(self):
+        """Re-read the rules file if it changed. Returns True if reloaded."""
+        if not self.path:
+            return False
+        with self._lock:
+            self._checked = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                return False
+            if mtime == self._mtime:
+                return False
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    rules = parse_rules(f)
+            except (OSError, UnicodeDecodeError) as e:
+                logging.warning(f"Content filter file unreadable, keeping old rules: {e}")
+                return False
+            rules[GLOBAL_RULES] = self.default_terms + rules[GLOBAL_RULES]
+            try:
+                self.compile(rules)
+            except (re.error, RecursionError) as e:
+                logging.error(f"Content filter file {self.path} doesn't compile, keeping old rules: {e}")
+                self._mtime = mtime  # don't retry until the file changes again
+                return False
+            self._mtime = mtime
+        logging.info(
+            f"Content filter loaded from {self.path}: "
+            f"{sum(len(t) for t in rules.values())} terms, {len(rules) - 1} persona sections"
+        )
+        return True
+
+    def match(self, text, persona_key=None):
+        """The first banned term found in `text` (normalised), or None."""
+        if self.path and time.monotonic() - self._checked >= self.reload_interval:
+            self.reload()
+        patterns = self._patterns
+        normalized = None
+        for key in (GLOBAL_RULES, persona_key):
+            pattern = patterns.get(key)
+            if pattern is None:
+                continue
+            if normalized is None:
+                normalized = normalize(text)
+            found = pattern.search(normalized)
+            if found:
+                return found.group(0)
+        return None
@@ -0,0 +1,504 @@
+"""
+AskIan IMAP - Long-lived IMAP sessions with IDLE push
+=====================================================
+Keeps one authenticated IMAP connection open and parks it in IDLE
+(RFC 2177) until the server reports new mail, instead of opening a fresh
+TLS connection and logging in every poll cycle.
+
+If the server doesn't advertise IDLE, callers fall back to polling.
+Host, port and TLS are all parameters so the session can be pointed at a
+local plain-text IMAP stand-in.
+
+Also has batched FETCH helpers for header-first triage: pull just the
+headers and BODYSTRUCTURE for every unseen message in one command, then
+download only the text/plain section of the ones worth replying to.
+"""
+
+import base64
+import binascii
+import email
+import imaplib
+import logging
+import quopri
+import re
+import select
+import ssl
+import time
+
+# ============================================================
+# SESSION & IDLE
+# ============================================================
+
+# RFC 2177: servers may drop an idle client after 30 minutes, so re-issue
+# IDLE comfortably before that.
+IDLE_TIMEOUT = 25 * 60
+
+# How long poll_idle() waits for more of a burst of untagged responses
+IDLE_POLL_TIMEOUT = 0.05
+
+# Read timeout on every IMAP socket, so a server that stops answering
+# mid-command raises (and gets reconnected) instead of blocking the loop
+# that serves every account
+SOCKET_TIMEOUT = 60
+
+# Errors that mean the connection is gone and needs rebuilding
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError)
+
+
+class IMAPSession:
+    """One authenticated IMAP connection, reconnected on demand."""
+
+    def __init__(self, host, user, password, mailbox="inbox", port=None, use_ssl=True,
+                 timeout=SOCKET_TIMEOUT):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.mailbox = mailbox
+        self.use_ssl = use_ssl
+        self.port = port or (imaplib.IMAP4_SSL_PORT if use_ssl else imaplib.IMAP4_PORT)
+        self.timeout = timeout
+        self.conn = None
+        self._idle_tag = None
+        self._partial = b""  # start of a response line _readline() gave up waiting for
+
+    def connect(self):
+        """Open, log in and select the mailbox. Returns the imaplib connection."""
+        self.close()
+        if self.use_ssl:
+            conn = imaplib.IMAP4_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = imaplib.IMAP4(self.host, self.port, timeout=self.timeout)
+        self._partial = b""
+        conn.login(self.user, self.password)
+        conn.select(self.mailbox)
+        self.conn = conn
+        logging.info(f"IMAP session opened to {self.host}:{self.port} ({self.mailbox})")
+        return conn
+
+    def ensure(self):
+        """Return a live connection, reconnecting if the old one has dropped."""
+        if self.conn is not None:
+            try:
+                if self.conn.noop()[0] == "OK":
+                    return self.conn
+            except CONNECTION_ERRORS:
+                pass
+            logging.warning("IMAP session dropped — reconnecting")
+        return self.connect()
+
+    def close(self):
+        """Log out (best effort) and forget the connection."""
+        if self.conn is None:
+            return
+        try:
+            self.conn.logout()
+        except CONNECTION_ERRORS:
+            pass
+        self.conn = None
+
+    @property
+    def supports_idle(self):
+        return self.conn is not None and "IDLE" in self.conn.capabilities
+
+    def pending_mail(self):
+        """
+        True if the server reported new mail (EXISTS/RECENT) in reply to
+        an earlier command. imaplib files those away in untagged_responses
+        and IDLE won't report them again, so check (this clears them)
+        before idling.
+        """
+        found = False
+        for kind in ("EXISTS", "RECENT"):
+            found = self.conn.untagged_responses.pop(kind, None) is not None or found
+        return found
+
+    def start_idle(self):
+        """
+        Enter IDLE and return without waiting for mail, so the caller can
+        wait on the socket itself (several sessions at once). Returns True
+        if new mail was reported before the server confirmed.
+        """
+        conn = self.conn
+        self._idle_tag = conn._new_tag()
+        conn.send(self._idle_tag + b" IDLE\r\n")
+
+        # Wait for the "+ idling" continuation (untagged data may come first)
+        new_mail = False
+        while True:
+            line = self._readline()
+            if line.startswith(b"+"):
+                return new_mail
+            if line.startswith(self._idle_tag):
+                self._idle_tag = None
+                raise imaplib.IMAP4.error(f"IDLE rejected: {line.decode(errors='replace').strip()}")
+            new_mail = new_mail or _is_new_mail(line)
+
+    def poll_idle(self):
+        """
+        After the socket has become readable: consume what the server sent
+        while idling. Returns True if it reported new mail.
+        """
+        new_mail = False
+        line = self._readline(timeout=IDLE_POLL_TIMEOUT)
+        while line is not None:
+            new_mail = self._idle_line(line) or new_mail
+            line = self._readline(timeout=IDLE_POLL_TIMEOUT)
+        return new_mail
+
+    def buffered(self):
+        """
+        True if response data has already been read off the socket (into
+        imaplib's file buffer or the TLS layer), where select() can't see it.
+        """
+        conn = self.conn
+        conn.sock.settimeout(0)
+        try:
+            return bool(conn.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            conn.sock.settimeout(self.timeout)
+
+    def stop_idle(self):
+        """Leave IDLE. Returns True if new mail was reported meanwhile."""
+        conn = self.conn
+        tag, self._idle_tag = self._idle_tag, None
+        conn.send(b"DONE\r\n")
+        new_mail = False
+        while True:
+            line = self._readline()
+            if line.startswith(tag):
+                return new_mail
+            new_mail = new_mail or _is_new_mail(line)
+
+    def _idle_line(self, line):
+        if line.startswith(b"* BYE"):
+            raise imaplib.IMAP4.abort("server closed connection during IDLE")
+        return _is_new_mail(line)
+
+    def _readline(self, timeout=None):
+        """
+        Read one response line. With a timeout, returns None if no complete
+        line arrived in time; whatever part of one did arrive is kept for
+        the next call. Raises imaplib.IMAP4.abort on EOF.
+        """
+        conn = self.conn
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not self._partial.endswith(b"\n"):
+            if deadline is not None and not self.buffered():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([conn.sock], [], [], remaining)[0]:
+                    return None
+            # Take at most up to the end of the line from imaplib's buffer,
+            # so the bytes after it are still there for imaplib's next read
+            data = conn.file.peek()
+            if not data:
+                raise imaplib.IMAP4.abort("connection closed by server")
+            end = data.find(b"\n")
+            self._partial += conn.file.read(end + 1 if end >= 0 else len(data))
+        line, self._partial = self._partial, b""
+        return line
+
+
+def _is_new_mail(line):
+    """True for untagged '* <n> EXISTS' / '* <n> RECENT' responses."""
+    parts = line.split()
+    return (
+        len(parts) >= 3 and parts[0] == b"*" and parts[1].isdigit()
+        and parts[2].upper() in (b"EXISTS", b"RECENT")
+    )
+
+
+# ============================================================
+# BATCHED FETCH HELPERS
+# ============================================================
+
+# Headers needed to triage a message without downloading it
+TRIAGE_HEADERS = (
+    "From", "Reply-To", "To", "Delivered-To", "X-Original-To", "Subject",
+    "Message-ID", "In-Reply-To", "References", "Auto-Submitted", "Precedence",
+    "X-Auto-Response-Suppress",
+)
+
+# Only the first part of a long text body is ever used, so cap the download
+BODY_FETCH_LIMIT = 64 * 1024
+
+_TOKEN_RE = re.compile(
+    rb'\(|\)|"(?:[^"\\]|\\.)*"|\{\d+\}$|[^\s()"\[\]]+(?:\[[^\]]*\](?:<\d+>)?)?'
+)
+
+
+def uid_set(uids):
+    """Compress UIDs into an IMAP sequence set, e.g. [1, 2, 3, 7] -> b'1:3,7'."""
+    nums = sorted({int(u) for u in uids})
+    ranges = []
+    for n in nums:
+        if ranges and n == ranges[-1][1] + 1:
+            ranges[-1][1] = n
+        else:
+            ranges.append([n, n])
+    return b",".join(
+        str(a).encode() if a == b else f"{a}:{b}".encode() for a, b in ranges
+    )
+
+
+def parse_fetch_response(data):
+    """
+    Turn imaplib's FETCH data into {uid: {item_name: value}}. Item names
+    are upper-cased bytes (b"BODYSTRUCTURE", b"BODY[1]<0>", ...); literals
+    come back as bytes and parenthesised lists as Python lists.
+    """
+    tokens = []
+    for item in data:
+        if isinstance(item, tuple):
+            head, literal = item
+            tokens.extend(_tokenize(head))
+            tokens[-1] = _Literal(literal)
+        elif item:
+            tokens.extend(_tokenize(item))
+
+    results = {}
+    pos = 0
+    while pos < len(tokens):
+        # "<seq> (KEY value KEY value ...)"
+        if pos + 1 < len(tokens) and _is_paren(tokens[pos + 1], b"("):
+            items, pos = _parse_list(tokens, pos + 2)
+            fields = {
+                _atom(items[i]).upper(): items[i + 1]
+                for i in range(0, len(items) - 1, 2)
+            }
+            if b"UID" in fields:
+                results[fields[b"UID"]] = fields
+        else:
+            pos += 1
+    return results
+
+
+class _Literal(bytes):
+    """A literal string from the server, never mistaken for a paren token."""
+
+
+def _tokenize(line):
+    return [
+        _Literal(t[1:-1].replace(b'\\"', b'"').replace(b"\\\\", b"\\")) if t.startswith(b'"')
+        else t
+        for t in _TOKEN_RE.findall(line)
+    ]
+
+
+def _is_paren(tok, paren):
+    return tok == paren and not isinstance(tok, _Literal)
+
+
+def _parse_list(tokens, pos):
+    """Parse tokens up to the matching ')' — returns (list, position after it)."""
+    items = []
+    while pos < len(tokens):
+        tok = tokens[pos]
+        if _is_paren(tok, b"("):
+            sub, pos = _parse_list(tokens, pos + 1)
+            items.append(sub)
+            continue
+        if _is_paren(tok, b")"):
+            return items, pos + 1
+        items.append(None if tok.upper() == b"NIL" and not isinstance(tok, _Literal) else bytes(tok))
+        pos += 1
+    return items, pos
+
+
+def _atom(value):
+    return value if isinstance(value, bytes) else b""
+
+
+def fetch_headers(conn, uids, fields=TRIAGE_HEADERS):
+    """
+    Fetch just the triage headers and BODYSTRUCTURE for many messages in
+    one command, without setting \\Seen. Returns {uid: (headers, bodystructure)}
+    where headers is an email.message.Message.
+    """
+    if not uids:
+        return {}
+    spec = " ".join(fields)
+    result, data = conn.uid(
+        "fetch", uid_set(uids), f"(BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({spec})])"
+    )
+    if result != "OK":
+        raise conn.error(f"header fetch failed: {data}")
+
+    # Unsolicited FETCH responses (flag changes by another client) may
+    # carry other UIDs; only the ones asked for count
+    wanted = set(uids)
+    messages = {}
+    for uid, items in parse_fetch_response(data).items():
+        if uid not in wanted:
+            continue
+        raw_headers = next(
+            (v for k, v in items.items() if k.startswith(b"BODY[HEADER")), b""
+        ) or b""
+        messages[uid] = (email.message_from_bytes(raw_headers), items.get(b"BODYSTRUCTURE"))
+    return messages
+
+
+def find_text_part(structure, section=""):
+    """
+    Find the first inline text/plain part in a BODYSTRUCTURE.
+    Returns (section, encoding, charset) or None.
+    """
+    if not isinstance(structure, list) or not structure:
+        return None
+
+    if isinstance(structure[0], list):
+        # Multipart: child parts, then the subtype
+        for i, child in enumerate(p for p in structure if isinstance(p, list)):
+            found = find_text_part(child, f"{section}.{i + 1}" if section else str(i + 1))
+            if found:
+                return found
+        return None
+
+    ctype = _atom(structure[0]).lower()
+    subtype = _atom(structure[1]).lower() if len(structure) > 1 else b""
+    if (ctype, subtype) != (b"text", b"plain"):
+        return None
+
+    # Text parts carry disposition at index 9: ("attachment" (...)) or NIL
+    disposition = structure[9] if len(structure) > 9 else None
+    if isinstance(disposition, list) and _atom(disposition[0]).lower() == b"attachment":
+        return None
+
+    params = structure[2] if isinstance(structure[2], list) else []
+    charset = None
+    for i in range(0, len(params) - 1, 2):
+        if _atom(params[i]).lower() == b"charset":
+            charset = _atom(params[i + 1]).decode("ascii", "replace")
+    encoding = _atom(structure[5]).decode("ascii", "replace").lower() if len(structure) > 5 else ""
+    return section or "1", encoding, charset
+
+
+def fetch_text_parts(conn, parts, limit=BODY_FETCH_LIMIT):
+    """
+    Download just the chosen text sections (capped at `limit` bytes) for
+    many messages, batching messages that share a section number.
+    `parts` maps uid -> (section, encoding, charset); returns {uid: raw bytes}.
+    """
+    by_section = {}
+    for uid, (section, _, _) in parts.items():
+        by_section.setdefault(section, []).append(uid)
+
+    bodies = {}
+    for section, uids in by_section.items():
+        result, data = conn.uid("fetch", uid_set(uids), f"(BODY.PEEK[{section}]<0.{limit}>)")
+        if result != "OK":
+            raise conn.error(f"body fetch failed: {data}")
+        for uid, items in parse_fetch_response(data).items():
+            payload = next((v for k, v in items.items() if k.startswith(b"BODY[")), None)
+            if uid in parts and isinstance(payload, bytes):
+                bodies[uid] = payload
+    return bodies
+
+
+def decode_part(payload, encoding):
+    """Undo a part's Content-Transfer-Encoding (tolerates a truncated download)."""
+    if encoding == "base64":
+        compact = re.sub(rb"[^A-Za-z0-9+/=]", b"", payload)
+        compact = compact[:len(compact) - len(compact) % 4]
+        try:
+            return base64.b64decode(compact)
+        except binascii.Error:
+            return b""
+    if encoding == "quoted-printable":
+        return quopri.decodestring(payload)
+    return payload
+
+
+def fetch_full(conn, uid, limit=None):
+    """Download a whole message (or its first `limit` bytes) without setting \\Seen."""
+    section = f"BODY.PEEK[]<0.{limit}>" if limit else "BODY.PEEK[]"
+    result, data = conn.uid("fetch", uid, f"({section})")
+    if result != "OK":
+        return None
+    for item in data:
+        if isinstance(item, tuple):
+            return item[1]
+    return None
+
+
+def mark_seen(conn, uids):
+    """Set \\Seen on many messages with one STORE."""
+    if uids:
+        conn.uid("store", uid_set(uids), "+FLAGS.SILENT", r"(\Seen)")
+
+
+# ============================================================
+# INCREMENTAL UID SYNC
+# ============================================================
+
+_STATUS_RE = re.compile(rb"(UIDNEXT|UIDVALIDITY)\s+(\d+)", re.IGNORECASE)
+
+
+class MailboxSync:
+    """
+    Tracks (UIDVALIDITY, last processed UID) for one mailbox in the state
+    store, so each cycle asks only for `UID n+1:*` instead of scanning the
+    whole mailbox for \\Seen flags that a human in webmail can change.
+    The cursor is stored under `key` (the mailbox name by default), so
+    same-named mailboxes of different accounts don't share one.
+    """
+
+    def __init__(self, store, mailbox="inbox", key=None):
+        self.store = store
+        self.mailbox = mailbox
+        self.key = key or mailbox
+        self.uidvalidity = None  # known after new_uids()
+
+    def unchanged(self, conn):
+        """
+        Cheap pre-check before SELECT: True if STATUS shows no UIDs past the
+        cursor. Costs one round trip, however large the mailbox.
+        """
+        cursor = self.store.get_sync_cursor(self.key)
+        if cursor is None:
+            return False
+        result, data = conn.status(self.mailbox, "(UIDNEXT UIDVALIDITY)")
+        if result != "OK":
+            return False
+        fields = {k.upper(): int(v) for k, v in _STATUS_RE.findall(data[0] or b"")}
+        uidvalidity, last_uid = cursor
+        return (
+            fields.get(b"UIDVALIDITY") == uidvalidity
+            and b"UIDNEXT" in fields and fields[b"UIDNEXT"] - 1 <= last_uid
+        )
+
+    def new_uids(self, conn):
+        """
+        UIDs that arrived since the last cycle, on a connection with the
+        mailbox selected. On first run or after a UIDVALIDITY change the
+        cursor is rebuilt and the current unseen messages are returned once.
+        """
+        uidvalidity = self.uidvalidity = int(conn.untagged_responses.get("UIDVALIDITY", [b"0"])[-1])
+        cursor = self.store.get_sync_cursor(self.key)
+
+        if cursor is None or cursor[0] != uidvalidity:
+            if cursor is not None:
+                logging.warning(f"UIDVALIDITY of {self.mailbox} changed — resyncing from unseen mail")
+            result, data = conn.uid("search", None, "UNSEEN")
+            unseen = data[0].split() if result == "OK" else []
+            result, data = conn.uid("search", None, "UID", "*")
+            highest = max((int(u) for u in data[0].split()), default=0) if result == "OK" else 0
+            self.store.set_sync_cursor(self.key, uidvalidity, highest)
+            return unseen
+
+        last_uid = cursor[1]
+        result, data = conn.uid("search", None, "UID", f"{last_uid + 1}:*")
+        if result != "OK":
+            raise conn.error(f"UID search failed: {data}")
+        # "n+1:*" always matches the newest message, even if it's old
+        return [u for u in data[0].split() if int(u) > last_uid]
+
+    def advance(self, uids):
+        """Move the cursor past UIDs that have been handled."""
+        if not uids:
+            return
+        cursor = self.store.get_sync_cursor(self.key)
+        highest = max(int(u) for u in uids)
+        if cursor and highest > cursor[1]:
+            self.store.set_sync_cursor(self.key, cursor[0], highest)
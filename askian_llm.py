@@ -0,0 +1,400 @@
+"""
+AskIan LLM - Reusable chat-completions client
+=============================================
+One pooled keep-alive HTTP session shared by every reply worker, with:
+
+  - jittered exponential backoff on 429/5xx and connection errors,
+    honouring the server's Retry-After header
+  - a circuit breaker, so a DeepSeek outage fails fast instead of every
+    message burning the full request timeout
+  - per-call latency recording and token usage reporting, including
+    how much of each prompt the provider served from its context cache
+  - streamed (SSE) generation with a hard wall-clock budget, so a slow
+    completion can be cut off cleanly instead of hitting the timeout
+
+Works against any OpenAI-compatible /chat/completions endpoint, so it can
+be pointed at a local mock HTTP server.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEEPSEEK_BASE_URL = "https://api.deepseek.com/v1"
+
+# Status codes worth retrying — everything else is our fault, not theirs
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+# What generate() returns. finished is False when the budget cut the reply
+# short; usage is the provider's token counts ({} if it sent none);
+# provider is set by the router to the name of the one that answered.
+Completion = namedtuple("Completion", "text finished usage provider", defaults=(None,))
+
+
+class LLMError(Exception):
+    """The completion could not be produced."""
+
+
+class CircuitOpenError(LLMError):
+    """The provider has failed repeatedly; calls are refused until it cools off."""
+
+
+class DeadlineExceeded(LLMError):
+    """A streamed completion ran past its wall-clock budget."""
+
+
+class CircuitBreaker:
+    """
+    Classic closed → open → half-open breaker. After `failure_threshold`
+    consecutive failures it opens for `reset_timeout` seconds, then lets a
+    single trial call through; success closes it, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """True if a call may go ahead now."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logging.warning(f"LLM circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+    def end_trial(self):
+        """Let another trial call through if this one ended without a verdict."""
+        with self._lock:
+            self._trial_running = False
+
+
+class LLMClient:
+    """Pooled, retrying, circuit-broken client for one chat-completions endpoint."""
+
+    def __init__(self, api_key, base_url=DEEPSEEK_BASE_URL, model="deepseek-chat",
+                 timeout=30, connect_timeout=5, max_retries=3,
+                 backoff_base=0.5, backoff_cap=10, pool_size=8, breaker=None):
+        self.api_key = api_key
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.model = model
+        self.timeout = (connect_timeout, timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        })
+
+        # Seconds per successful call, most recent last
+        self.latencies = deque(maxlen=1000)
+        self.calls = 0
+        self.errors = 0
+        self._stats_lock = threading.Lock()
+
+    def chat(self, messages, max_tokens, temperature=0.8, **extra):
+        """
+        POST one chat completion and return the decoded JSON response.
+        Raises CircuitOpenError when the breaker is open, LLMError otherwise.
+        """
+        started = time.monotonic()
+        response = self._post(self._payload(messages, max_tokens, temperature, **extra))
+        try:
+            data = response.json()
+        except ValueError as e:
+            self._record(None)
+            raise LLMError(f"Bad response body: {e}")
+        self._record(time.monotonic() - started)
+        return data
+
+    def complete(self, messages, max_tokens, temperature=0.8):
+        """Return just the reply text of a chat completion."""
+        return self.generate(messages, max_tokens, temperature).text
+
+    def stream(self, messages, max_tokens, temperature=0.8, budget=None, usage=None):
+        """
+        Yield reply text incrementally as the provider generates it (SSE).
+        With a `budget` in seconds, raises DeadlineExceeded as soon as the
+        wall-clock budget is spent — whatever was yielded so far stands.
+        Pass a dict as `usage` to have the final token counts filled in.
+        """
+        started = time.monotonic()
+        deadline = started + budget if budget else None
+        payload = self._payload(messages, max_tokens, temperature, stream=True,
+                                stream_options={"include_usage": True})
+        response = self._post(payload, stream=True, deadline=deadline)
+
+        try:
+            for line in response.iter_lines():
+                if deadline:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise DeadlineExceeded(f"generation cut off after {budget}s")
+                    # The next read may only wait out what is left of the budget
+                    _set_read_timeout(response, remaining)
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    # Keep reading to the end of the body so the connection
+                    # goes back to the pool instead of being dropped
+                    continue
+                try:
+                    chunk = json.loads(data)
+                    if usage is not None and chunk.get("usage"):
+                        usage.update(chunk["usage"])
+                    delta = chunk["choices"][0]["delta"].get("content")
+                except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+                    continue
+                if delta:
+                    yield delta
+        except requests.RequestException as e:
+            self._record(None)
+            if deadline and time.monotonic() > deadline:
+                raise DeadlineExceeded(f"generation cut off after {budget}s")
+            raise LLMError(f"Stream interrupted: {e}")
+        except DeadlineExceeded:
+            self._record(None)
+            raise
+        finally:
+            response.close()
+        self._record(time.monotonic() - started)
+
+    def generate(self, messages, max_tokens, temperature=0.8, budget=None):
+        """
+        Produce a Completion. With a `budget` (seconds) the reply is
+        streamed and cut off when the budget runs out; without one it is a
+        plain request.
+        """
+        if not budget:
+            data = self.chat(messages, max_tokens, temperature)
+            try:
+                text = data["choices"][0]["message"]["content"].strip()
+            except (KeyError, IndexError, TypeError, AttributeError):
+                raise LLMError(f"Unexpected response shape: {str(data)[:200]}")
+            return Completion(text, True, data.get("usage") or {})
+
+        parts = []
+        usage = {}
+        try:
+            for delta in self.stream(messages, max_tokens, temperature, budget=budget, usage=usage):
+                parts.append(delta)
+        except DeadlineExceeded:
+            return Completion("".join(parts).strip(), False, usage)
+        return Completion("".join(parts).strip(), True, usage)
+
+    def _payload(self, messages, max_tokens, temperature, **extra):
+        return {
+            "model": self.model,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "messages": messages,
+            **extra,
+        }
+
+    def _post(self, payload, stream=False, deadline=None):
+        """
+        POST the payload, retrying 429/5xx and connection errors with
+        backoff. Returns the 200 response (body unread when streaming).
+        With a `deadline` (monotonic time) no try waits past it and no
+        retry starts after it.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit open — skipping call")
+        try:
+            return self._post_with_retries(payload, stream, deadline)
+        finally:
+            # A half-open trial that died some unexpected way must not wedge the breaker
+            self.breaker.end_trial()
+
+    def _post_with_retries(self, payload, stream, deadline):
+        timeout = self.timeout
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if deadline:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    last_error = last_error or LLMError("no response within the time budget")
+                    break
+                timeout = (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+            retry_after = None
+            try:
+                response = self.session.post(self.url, json=payload, timeout=timeout, stream=stream)
+                if response.status_code == 200:
+                    self.breaker.record_success()
+                    return response
+                last_error = LLMError(f"HTTP {response.status_code}: {response.text[:200]}")
+                response.close()
+                if response.status_code not in RETRY_STATUSES:
+                    # The provider is up, it just refused this request
+                    self._record(None)
+                    self.breaker.record_success()
+                    raise last_error
+                retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            except requests.RequestException as e:
+                # Connection errors, timeouts, a body cut off mid-chunk, ...
+                last_error = LLMError(f"{type(e).__name__}: {e}")
+
+            self._record(None)
+            if attempt == self.max_retries:
+                break
+            delay = self._backoff(attempt, retry_after)
+            if deadline and time.monotonic() + delay >= deadline:
+                break
+            logging.warning(f"LLM call failed ({last_error}) — retry {attempt + 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+        self.breaker.record_failure()
+        raise last_error
+
+    def _backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, never shorter than Retry-After."""
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_cap))
+        return delay
+
+    def _record(self, latency):
+        with self._stats_lock:
+            self.calls += 1
+            if latency is None:
+                self.errors += 1
+            else:
+                self.latencies.append(latency)
+
+    def stats(self):
+        """Call counts and latency percentiles (seconds) over recent calls."""
+        with self._stats_lock:
+            samples = sorted(self.latencies)
+            calls, errors = self.calls, self.errors
+
+        def pct(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))] if samples else None
+
+        return {
+            "calls": calls,
+            "errors": errors,
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "circuit": self.breaker.state,
+        }
+
+
+def cached_tokens(usage):
+    """Prompt tokens the provider served from its prefix cache."""
+    if "prompt_cache_hit_tokens" in usage:           # DeepSeek
+        return usage["prompt_cache_hit_tokens"] or 0
+    details = usage.get("prompt_tokens_details") or {}  # OpenAI
+    return details.get("cached_tokens") or 0
+
+
+class TokenUsage:
+    """
+    Running token totals and cost per key (a persona). `prices` are USD per
+    million tokens for "cached" prompt tokens, the rest of the "prompt",
+    and the "completion".
+    """
+
+    def __init__(self, prices):
+        self.prices = prices
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, usage, prices=None):
+        """
+        Count one response's usage, priced with `prices` if given (the
+        provider's) or the default ones. Returns (prompt, cached, completion, cost).
+        """
+        prices = self.prices if prices is None else prices
+        prompt = usage.get("prompt_tokens") or 0
+        cached = min(prompt, cached_tokens(usage))
+        completion = usage.get("completion_tokens") or 0
+        cost = (
+            cached * prices.get("cached", 0)
+            + (prompt - cached) * prices.get("prompt", 0)
+            + completion * prices.get("completion", 0)
+        ) / 1e6
+        with self._lock:
+            totals = self._totals.setdefault(
+                key, {"calls": 0, "prompt": 0, "cached": 0, "completion": 0, "cost": 0.0}
+            )
+            totals["calls"] += 1
+            totals["prompt"] += prompt
+            totals["cached"] += cached
+            totals["completion"] += completion
+            totals["cost"] += cost
+        return prompt, cached, completion, cost
+
+    def report(self):
+        """{key: totals plus cache_hit_ratio (cached share of prompt tokens)}"""
+        with self._lock:
+            report = {key: dict(totals) for key, totals in self._totals.items()}
+        for totals in report.values():
+            totals["cache_hit_ratio"] = totals["cached"] / totals["prompt"] if totals["prompt"] else 0.0
+        return report
+
+
+def _set_read_timeout(response, seconds):
+    """Change the socket timeout of a streaming response, where urllib3 exposes it."""
+    sock = getattr(getattr(response.raw, "connection", None), "sock", None)
+    if sock is not None:
+        sock.settimeout(max(0.01, seconds))
+
+
+def _parse_retry_after(value):
+    """Retry-After is either delta-seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
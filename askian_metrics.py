@@ -0,0 +1,164 @@
+"""
+AskIan Metrics - Counters and latency histograms
+================================================
+A tiny dependency-free take on Prometheus client metrics: labelled
+counters and fixed-bucket histograms, rendered in the Prometheus text
+exposition format and served from a local HTTP endpoint
+(http://127.0.0.1:<port>/metrics).
+
+Updates are a dict lookup and an add under a lock, so instrumenting the
+hot path costs well under a microsecond per event.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+class Registry:
+    """Holds every metric so they can be rendered together."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "".join(m.render() for m in self.metrics)
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(l, "") for l in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(l, "") for l in self.labels), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}\n", f"# TYPE {self.name} {self.kind}\n"]
+        for key, value in items:
+            lines.append(f"{self.name}{_labels(self.labels, key)} {_num(value)}\n")
+        return "".join(lines)
+
+
+class Histogram:
+    """Fixed-bucket histogram (cumulative on render, like Prometheus)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(l, "") for l in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the with-block takes."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}\n", f"# TYPE {self.name} {self.kind}\n"]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = bound if bound == "+Inf" else _num(bound)
+                lines.append(
+                    f"{self.name}_bucket{_labels(self.labels + ('le',), key + (le,))} {cumulative}\n"
+                )
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_num(series[-1])}\n")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}\n")
+        return "".join(lines)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for n, v in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _num(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ============================================================
+# HTTP ENDPOINT
+# ============================================================
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes would flood the log
+
+
+def start_http_server(port, host="127.0.0.1", registry=REGISTRY):
+    """Serve /metrics on a daemon thread. Returns the server."""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info(f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,146 @@
+"""
+AskIan MIME - Bounded, streaming extraction of a letter's text
+==============================================================
+Pulls the readable text out of a raw message without building and
+decoding the whole thing. The bytes are fed to email's BytesFeedParser
+in chunks, and feeding stops as soon as the first inline text/plain part
+is complete — a 25 MB attachment after the letter is never parsed. Input
+is hard-capped at a byte limit as well, so peak memory per message is
+bounded whatever arrives.
+
+If a message has no plain-text part, the first text/html part is
+converted to text instead (tags dropped, block elements turned into line
+breaks, entities unescaped). Payloads are decoded with their declared
+charset, falling back to UTF-8 when it is missing or unknown.
+"""
+
+import codecs
+import re
+from email.message import Message
+from email.parser import BytesFeedParser
+from html.parser import HTMLParser
+
+# Never parse more than this much of a message
+MAX_MESSAGE_BYTES = 1024 * 1024
+FEED_CHUNK = 64 * 1024
+
+
+def decode_text(payload, charset):
+    """Decode bytes with the declared charset (UTF-8 if missing or unknown)."""
+    try:
+        codec = codecs.lookup(charset or "utf-8").name
+    except LookupError:
+        codec = "utf-8"
+    # us-ascii is routinely mislabelled 8-bit text; UTF-8 is a superset
+    if codec == "ascii":
+        codec = "utf-8"
+    return payload.decode(codec, errors="replace")
+
+
+# ============================================================
+# HTML TO TEXT
+# ============================================================
+
+_BLOCK_TAGS = {
+    "p", "div", "br", "tr", "li", "ul", "ol", "table", "blockquote", "pre",
+    "h1", "h2", "h3", "h4", "h5", "h6", "hr",
+}
+_SKIP_TAGS = {"script", "style", "head", "title"}
+_SPACES_RE = re.compile(r"[ \t\r\f\v]+")
+_NEWLINES_RE = re.compile(r"\n\s*\n\s*")
+
+
+class _TextExtractor(HTMLParser):
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n" if tag == "br" else "\n\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    """Readable plain text from an HTML body."""
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    lines = (_SPACES_RE.sub(" ", line).strip() for line in "".join(extractor.parts).split("\n"))
+    return _NEWLINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+# ============================================================
+# PART SELECTION
+# ============================================================
+
+def is_inline_text(part, subtype):
+    """True for a text/<subtype> part that isn't an attachment."""
+    return (
+        part.get_content_type() == f"text/{subtype}"
+        and part.get_content_disposition() != "attachment"
+    )
+
+
+def part_text(part):
+    """Decoded text of one leaf part (HTML converted)."""
+    payload = part.get_payload(decode=True)
+    if not isinstance(payload, bytes):
+        return ""
+    text = decode_text(payload, part.get_content_charset())
+    return html_to_text(text) if part.get_content_subtype() == "html" else text
+
+
+def text_from_message(msg):
+    """The first inline text/plain part of a parsed message, else its first text/html."""
+    html = None
+    for part in msg.walk():
+        if part.is_multipart():
+            continue
+        if is_inline_text(part, "plain"):
+            return part_text(part)
+        if html is None and is_inline_text(part, "html"):
+            html = part
+    return part_text(html) if html is not None else ""
+
+
+class _WatchedPart(Message):
+    """
+    Message class handed to the parser. The parser sets a leaf part's
+    payload once the part is complete, which is when we can stop feeding.
+    Subclassed per message with `found` set to a fresh list.
+    """
+    found = []
+
+    def set_payload(self, payload, charset=None):
+        super().set_payload(payload, charset)
+        if not self.found and is_inline_text(self, "plain"):
+            self.found.append(self)
+
+
+def extract_text(raw, limit=MAX_MESSAGE_BYTES):
+    """
+    Text of a raw RFC 822 message, parsing at most `limit` bytes and
+    stopping at the end of the first inline text/plain part.
+    """
+    found = []
+    parser = BytesFeedParser(_factory=type("Part", (_WatchedPart,), {"found": found}))
+    view = memoryview(raw)[:limit]
+    for start in range(0, len(view), FEED_CHUNK):
+        parser.feed(view[start:start + FEED_CHUNK].tobytes())
+        if found:
+            return part_text(found[0])
+    return text_from_message(parser.close())
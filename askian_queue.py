@@ -0,0 +1,165 @@
+"""
+AskIan Queue - Durable reply pipeline stages
+============================================
+Every accepted email becomes a row in the state store's jobs table and
+moves through
+
+    generate  →  outbox  →  sent
+        ↘           ↘
+          failed      failed
+
+Each stage is drained by its own StageWorker with its own thread pool, so
+generation and sending run at independent rates. A job only leaves a
+stage when its handler succeeds; a handler that raises is retried with
+exponential backoff (persisted as attempts + next_attempt), and after
+max_attempts the job is marked failed. Generated text is stored with the
+job, so a send that fails is retried without another LLM call, and a
+process restart simply picks up whatever is still due.
+
+Delivery is at-least-once: a crash after SMTP accepted a reply but before
+the job was marked sent will send it again on restart.
+
+When several processes share the store, give each worker an `owner` and
+a `lease`: a job is leased before its handler runs, so only one process
+works on it, and a job whose worker died becomes due again once the
+lease runs out.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RetryLater(Exception):
+    """
+    A stage handler could not finish the job this time; try again after a
+    backoff, or after `delay` seconds if given.
+    """
+
+    def __init__(self, message="", delay=None):
+        super().__init__(message)
+        self.delay = delay
+
+
+class StageWorker:
+    """
+    Runs handler(job) for every due job in one status, `workers` at a time.
+    The handler returns the reply text (or None) on success and raises on
+    failure. Successful jobs advance to `next_status` and wake `then`,
+    the worker for the next stage.
+
+    Due jobs are taken oldest first, or in the order `order(jobs)` returns
+    for up to `window` of them (e.g. askian_fair.FairScheduler).
+
+    With a `lease` (seconds), each job is claimed for `owner` before it is
+    handled; the lease should comfortably outlast one handler call.
+    """
+
+    def __init__(self, store, status, next_status, handler, workers=1,
+                 max_attempts=5, retry_base=60, retry_cap=3600,
+                 poll_interval=30, on_give_up=None, then=None, order=None, window=500,
+                 owner=None, lease=None):
+        self.store = store
+        self.status = status
+        self.next_status = next_status
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.poll_interval = poll_interval
+        self.on_give_up = on_give_up
+        self.then = then
+        self.order = order
+        self.window = window
+        self.owner = owner
+        self.lease = lease
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=status)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"{self.status}-stage", daemon=True)
+            self._thread.start()
+        return self
+
+    def wake(self):
+        """New work may be due — check now rather than at the next poll."""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._until_next_due())
+            self._wake.clear()
+            try:
+                self._dispatch()
+            except Exception as e:
+                logging.error(f"{self.status} stage: could not dispatch jobs: {e}")
+
+    def _until_next_due(self):
+        """
+        Seconds to sleep: until the next scheduled retry, at most
+        poll_interval. Jobs already due are waiting for a free worker,
+        and a finishing job wakes the loop anyway.
+        """
+        now = time.time()
+        try:
+            due = self.store.next_due(self.status, now)
+        except Exception:
+            return self.poll_interval
+        if due is None:
+            return self.poll_interval
+        return min(self.poll_interval, due - now + 0.01)
+
+    def _dispatch(self):
+        with self._lock:
+            free = self.workers - len(self._in_flight)
+            if free <= 0:
+                return
+            exclude = set(self._in_flight)
+        limit = self.window if self.order else free + len(exclude)
+        jobs = [j for j in self.store.due_jobs(self.status, time.time(), limit)
+                if j["id"] not in exclude]
+        if self.order and len(jobs) > free:
+            jobs = self.order(jobs)
+        for job in jobs[:free]:
+            with self._lock:
+                self._in_flight.add(job["id"])
+            self._pool.submit(self._process, job)
+
+    def _process(self, job):
+        try:
+            if self.lease and not self.store.lease_job(job["id"], self.status, self.owner, self.lease):
+                return  # another worker got there first
+            job = self.store.get_job(job["id"])
+            reply = self.handler(job)
+        except Exception as e:
+            self._failed(job, e)
+        else:
+            self.store.advance_job(job["id"], self.next_status, reply=reply)
+            if self.then:
+                self.then.wake()
+        finally:
+            with self._lock:
+                self._in_flight.discard(job["id"])
+            self.wake()
+
+    def _failed(self, job, error):
+        attempts = job["attempts"] + 1
+        if not isinstance(error, RetryLater):
+            logging.error(f"{self.status} stage: job {job['id']} raised {type(error).__name__}: {error}")
+        if attempts >= self.max_attempts:
+            logging.error(f"{self.status} stage: giving up on job {job['id']} after {attempts} attempts")
+            self.store.fail_job(job["id"], str(error))
+            if self.on_give_up:
+                self.on_give_up(job)
+            return
+        delay = getattr(error, "delay", None)
+        if delay is None:
+            delay = min(self.retry_cap, self.retry_base * 2 ** (attempts - 1))
+        logging.warning(f"{self.status} stage: job {job['id']} failed ({error}) — retry {attempts} in {delay}s")
+        self.store.retry_job(job["id"], delay, str(error))
@@ -0,0 +1,174 @@
+"""
+AskIan Rate Limiter - Sliding-window reply limits
+=================================================
+Replaces rebuilding a filtered copy of the whole reply log for every
+message. Each key (the global budget, a sender, a persona) keeps at most
+`limit` timestamps in a deque, so a check is amortised O(1) and memory is
+bounded by limit x active keys. Senders that have been quiet for a whole
+window are expired automatically.
+
+The windows are exact, not approximate: a key is limited iff it has
+`limit` hits inside the last `window` seconds.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+GLOBAL_KEY = "*"
+
+
+class SlidingWindow:
+    """Exact sliding-window hit counter per key. Not thread-safe on its own."""
+
+    def __init__(self, limit, window=3600):
+        self.limit = limit
+        self.window = window
+        # key -> deque of hit times; least recently hit key first
+        self._hits = OrderedDict()
+
+    def count(self, key, now):
+        hits = self._hits.get(key)
+        if not hits:
+            return 0
+        cutoff = now - self.window
+        while hits and hits[0] <= cutoff:
+            hits.popleft()
+        return len(hits)
+
+    def allowed(self, key, now):
+        return self.count(key, now) < self.limit
+
+    def add(self, key, now):
+        hits = self._hits.get(key)
+        if hits is None:
+            hits = self._hits[key] = deque(maxlen=max(self.limit, 1))
+        else:
+            self._hits.move_to_end(key)
+        hits.append(now)
+        self._expire_idle(now)
+
+    def remove(self, key, when):
+        hits = self._hits.get(key)
+        if hits and when in hits:
+            hits.remove(when)
+
+    def clear(self):
+        self._hits.clear()
+
+    def free_at(self, key, now, ahead=0):
+        """
+        When a hit for `key` would be allowed if `ahead` other hits are
+        booked before it, each taking the next slot as it frees up.
+        """
+        if self.limit <= 0:
+            return float("inf")
+        self.count(key, now)
+        hits = self._hits.get(key, ())
+        # Unused slots are free now and used ones a window after their hit;
+        # a booked slot frees again a window after its booking
+        unused = self.limit - len(hits)
+        rounds, slot = divmod(ahead, self.limit)
+        free = now if slot < unused else hits[slot - unused] + self.window
+        return free + rounds * self.window
+
+    def _expire_idle(self, now):
+        """Drop keys whose newest hit is outside the window (oldest first)."""
+        cutoff = now - self.window
+        while self._hits:
+            key, hits = next(iter(self._hits.items()))
+            if hits and hits[-1] > cutoff:
+                break
+            del self._hits[key]
+
+    def __len__(self):
+        return len(self._hits)
+
+
+class RateLimiter:
+    """Global, per-sender and per-persona windows, checked and updated together."""
+
+    def __init__(self, global_limit, sender_limit, persona_limits=None, window=3600):
+        self.window = window
+        self.global_hits = SlidingWindow(global_limit, window)
+        self.sender_hits = SlidingWindow(sender_limit, window)
+        self.persona_hits = {
+            persona: SlidingWindow(limit, window)
+            for persona, limit in (persona_limits or {}).items()
+        }
+        self._lock = threading.Lock()
+
+    def check(self, sender, persona=None, now=None):
+        """Returns None if a reply is allowed, else a short reason string."""
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._check(sender, persona, now)
+
+    def record(self, sender, persona=None, now=None):
+        """Count a reply. Returns a token that release() accepts."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._record(sender, persona, now)
+        return (now, sender, persona)
+
+    def reload(self, events):
+        """
+        Replace every window's contents with (time, sender, persona) events,
+        e.g. the reply log shared with other worker processes.
+        """
+        with self._lock:
+            for windows in [self.global_hits, self.sender_hits, *self.persona_hits.values()]:
+                windows.clear()
+            for when, sender, persona in events:
+                self._record(sender, persona, when)
+
+    def free_at(self, sender, persona=None, booked=(), now=None):
+        """
+        Earliest time a reply to `sender` fits every window, if the replies
+        in `booked` ((sender, persona) pairs) take the free slots first.
+        """
+        now = time.time() if now is None else now
+        booked = list(booked)
+        with self._lock:
+            times = [
+                self.global_hits.free_at(GLOBAL_KEY, now, len(booked)),
+                self.sender_hits.free_at(sender, now, sum(1 for s, _ in booked if s == sender)),
+            ]
+            persona_hits = self.persona_hits.get(persona)
+            if persona_hits:
+                times.append(persona_hits.free_at(persona, now, sum(1 for _, p in booked if p == persona)))
+        return max(times)
+
+    def sender_count(self, sender, now=None):
+        """Replies counted against a sender inside the current window."""
+        now = time.time() if now is None else now
+        with self._lock:
+            return self.sender_hits.count(sender, now)
+
+    def release(self, token):
+        """Give back a reply that was counted but never sent."""
+        when, sender, persona = token
+        with self._lock:
+            self.global_hits.remove(GLOBAL_KEY, when)
+            self.sender_hits.remove(sender, when)
+            if persona in self.persona_hits:
+                self.persona_hits[persona].remove(persona, when)
+
+    def _check(self, sender, persona, now):
+        if not self.global_hits.allowed(GLOBAL_KEY, now):
+            return f"global limit ({self.global_hits.limit}/{self._per()})"
+        if not self.sender_hits.allowed(sender, now):
+            return f"per-sender limit for {sender} ({self.sender_hits.limit}/{self._per()})"
+        persona_hits = self.persona_hits.get(persona)
+        if persona_hits and not persona_hits.allowed(persona, now):
+            return f"per-persona limit for {persona} ({persona_hits.limit}/{self._per()})"
+        return None
+
+    def _record(self, sender, persona, now):
+        self.global_hits.add(GLOBAL_KEY, now)
+        self.sender_hits.add(sender, now)
+        if persona in self.persona_hits:
+            self.persona_hits[persona].add(persona, now)
+
+    def _per(self):
+        return "hr" if self.window == 3600 else f"{self.window}s"
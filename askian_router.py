@@ -0,0 +1,297 @@
+"""
+AskIan Router - Latency-aware routing over several LLM providers
+================================================================
+Every reply used to go to DeepSeek. When DeepSeek was slow, each one
+waited out the request timeout and went out as the "temporarily
+indisposed" apology. The router spreads calls over any number of
+OpenAI-compatible endpoints: DeepSeek, another hosted provider, or a
+local model server. Each endpoint is wrapped in a Provider with its own
+LLMClient, so each keeps its own connection pool, retries and circuit
+breaker.
+
+Each provider keeps a rolling estimate of its response time (time to the
+first token when streaming, the whole call otherwise) and its recent
+error rate. A call goes to the fastest healthy provider. A provider is
+healthy if its circuit is not open and under `error_threshold` of its
+calls failed in the last `error_window` seconds. Providers with no
+samples yet are tried first, and a small `explore` share of calls goes
+to a random healthy provider. That keeps the estimates fresh for a
+provider that has recovered. If a call fails, the next provider is
+tried straight away.
+
+With hedging on, a call that has not produced its first token by the
+provider's p95 response time gets a second request, sent to the
+next-best provider (or the same one if there is only one). Whichever
+starts answering first wins and the other stream is closed. By
+construction that doubles at most about 5% of calls, and it cuts the
+slow tail. The losing request is still billed, so its tokens are handed
+to the caller's `on_usage` rather than dropped. A stream closed early
+never gets the provider's counts; those tokens are estimated.
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+from askian_llm import Completion, DeadlineExceeded, LLMError
+from askian_text import estimate_tokens
+
+
+class Provider:
+    """One endpoint (an LLMClient) plus its rolling latency and error estimates."""
+
+    def __init__(self, name, client, prices=None, samples=200, error_window=300):
+        self.name = name
+        self.client = client
+        self.prices = prices  # USD per million tokens, as for TokenUsage; None = default
+        self.error_window = error_window
+        self._latencies = deque(maxlen=samples)
+        self._outcomes = deque(maxlen=samples)  # (monotonic time, ok)
+        self._lock = threading.Lock()
+
+    def observe(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            self._outcomes.append((time.monotonic(), True))
+
+    def observe_error(self):
+        with self._lock:
+            self._outcomes.append((time.monotonic(), False))
+
+    def latency(self, quantile=0.5):
+        """Response time at `quantile` over recent calls, or None with no samples."""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(quantile * len(samples)))]
+
+    def error_rate(self):
+        """Share of calls in the last error_window seconds that failed."""
+        cutoff = time.monotonic() - self.error_window
+        with self._lock:
+            recent = [ok for when, ok in self._outcomes if when >= cutoff]
+        return recent.count(False) / len(recent) if recent else 0.0
+
+    def samples(self):
+        with self._lock:
+            return len(self._latencies)
+
+    def __repr__(self):
+        return f"<Provider {self.name}>"
+
+
+class _Race:
+    """Shared by the attempts of one call: the first to start answering wins."""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.winner = None
+        self.result = None
+        self.errors = []
+        self.running = 0
+
+    def claim(self, attempt):
+        """True if `attempt` is (now) the winner."""
+        with self.cond:
+            if self.winner is None:
+                self.winner = attempt
+                self.cond.notify_all()
+            return self.winner is attempt
+
+    def finish(self, attempt, completion):
+        with self.cond:
+            self.running -= 1
+            if self.winner is attempt:
+                self.result = completion
+            self.cond.notify_all()
+
+    def fail(self, attempt, error):
+        with self.cond:
+            self.running -= 1
+            self.errors.append(error)
+            if self.winner is attempt:
+                # It had started answering; nothing else to wait for
+                self.result = error
+            self.cond.notify_all()
+
+
+class LLMRouter:
+    """
+    Drop-in for LLMClient.generate() across several providers. The
+    Completion returned names the provider that produced it.
+    """
+
+    def __init__(self, providers, hedge=True, hedge_quantile=0.95, min_samples=20,
+                 error_threshold=0.5, explore=0.05):
+        if not providers:
+            raise ValueError("at least one provider is needed")
+        self.providers = list(providers)
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples
+        self.error_threshold = error_threshold
+        self.explore = explore
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()  # guards hedged and hedge_wins
+
+    def healthy(self, provider):
+        return (
+            provider.client.breaker.state != "open"
+            and provider.error_rate() < self.error_threshold
+        )
+
+    def ranked(self):
+        """Providers in the order to try them: healthy ones fastest first."""
+        def speed(provider):
+            latency = provider.latency()
+            return -1.0 if latency is None else latency
+
+        healthy = sorted((p for p in self.providers if self.healthy(p)), key=speed)
+        if len(healthy) > 1 and random.random() < self.explore:
+            healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+        # If nothing looks healthy, still try everything rather than nothing
+        rest = sorted((p for p in self.providers if p not in healthy), key=speed)
+        return healthy + rest
+
+    def provider(self, name):
+        return next((p for p in self.providers if p.name == name), None)
+
+    def hedge_delay(self, provider):
+        """Seconds to wait for a first token before hedging, or None."""
+        if not self.hedge or provider.samples() < self.min_samples:
+            return None
+        return provider.latency(self.hedge_quantile)
+
+    def generate(self, messages, max_tokens, temperature=0.8, budget=None, on_usage=None):
+        """
+        Like LLMClient.generate(), routed and hedged. Raises LLMError only
+        if every provider tried failed. `on_usage(provider_name, usage)` is
+        called, possibly after this returns, for each attempt that lost a
+        hedge; the returned Completion only carries the winner's usage.
+        """
+        started = time.monotonic()
+        candidates = self.ranked()
+        race = _Race()
+        tried = []
+        hedges = set()
+
+        def launch(provider):
+            remaining = budget - (time.monotonic() - started) if budget else None
+            attempt = (provider, len(tried))
+            tried.append(provider)
+            race.running += 1
+            threading.Thread(
+                target=self._attempt,
+                args=(attempt, race, messages, max_tokens, temperature, remaining, on_usage),
+                daemon=True,
+            ).start()
+
+        with race.cond:
+            launch(candidates[0])
+            hedge_at = self.hedge_delay(candidates[0])
+            hedge_at = started + hedge_at if hedge_at is not None else None
+            while race.result is None:
+                if race.winner is None and race.running == 0:
+                    # Everything so far failed before answering: fail over
+                    if len(tried) >= len(candidates) or (budget and time.monotonic() - started >= budget):
+                        raise race.errors[-1]
+                    logging.warning(f"LLM provider {tried[-1].name} failed ({race.errors[-1]}) — "
+                                    f"trying {candidates[len(tried)].name}")
+                    launch(candidates[len(tried)])
+                    hedge_at = None
+                    continue
+                timeout = None
+                if race.winner is None and hedge_at is not None:
+                    timeout = hedge_at - time.monotonic()
+                    if timeout <= 0:
+                        target = candidates[len(tried)] if len(tried) < len(candidates) else candidates[0]
+                        logging.info(f"LLM call slower than p95 on {tried[0].name} — hedging on {target.name}")
+                        with self._lock:
+                            self.hedged += 1
+                        hedges.add(len(tried))
+                        launch(target)
+                        hedge_at = None
+                        continue
+                race.cond.wait(timeout)
+
+        if isinstance(race.result, Exception):
+            raise race.result
+        if race.winner[1] in hedges:
+            with self._lock:
+                self.hedge_wins += 1
+        return race.result._replace(provider=race.winner[0].name)
+
+    def _attempt(self, attempt, race, messages, max_tokens, temperature, budget, on_usage):
+        """One request to one provider, run on its own thread."""
+        provider = attempt[0]
+        client = provider.client
+        started = time.monotonic()
+        try:
+            if not budget:
+                completion = client.generate(messages, max_tokens, temperature)
+                provider.observe(time.monotonic() - started)
+                if race.claim(attempt):
+                    race.finish(attempt, completion)
+                else:
+                    race.finish(attempt, None)
+                    self._lost_usage(on_usage, provider, completion.usage)
+                return
+
+            parts = []
+            usage = {}
+            finished = True
+            stream = client.stream(messages, max_tokens, temperature, budget=budget, usage=usage)
+            try:
+                for delta in stream:
+                    if not parts:
+                        provider.observe(time.monotonic() - started)
+                        if not race.claim(attempt):
+                            parts.append(delta)  # billed all the same
+                            break  # the other request answered first
+                    parts.append(delta)
+            except DeadlineExceeded:
+                finished = False
+            finally:
+                stream.close()
+            # An empty reply still counts as an answer, as in LLMClient.generate()
+            if race.claim(attempt):
+                race.finish(attempt, Completion("".join(parts).strip(), finished, usage))
+            else:
+                race.finish(attempt, None)
+                if not usage:
+                    # Closed before the final chunk, which carries the counts
+                    usage = {
+                        "prompt_tokens": sum(estimate_tokens(m["content"]) for m in messages),
+                        "completion_tokens": estimate_tokens("".join(parts)),
+                    }
+                self._lost_usage(on_usage, provider, usage)
+        except Exception as e:
+            # Whatever happens, the caller must hear about it
+            provider.observe_error()
+            race.fail(attempt, e if isinstance(e, LLMError) else LLMError(f"{type(e).__name__}: {e}"))
+
+    @staticmethod
+    def _lost_usage(on_usage, provider, usage):
+        if on_usage is None or not usage:
+            return
+        try:
+            on_usage(provider.name, usage)
+        except Exception as e:
+            logging.warning(f"Could not record usage of a hedged call on {provider.name}: {e}")
+
+    def stats(self):
+        """Per-provider estimates, for logging. Hedge counts are in hedged/hedge_wins."""
+        return {
+            p.name: {
+                "p50": p.latency(0.5),
+                "p95": p.latency(0.95),
+                "error_rate": p.error_rate(),
+                "circuit": p.client.breaker.state,
+                "samples": p.samples(),
+            }
+            for p in self.providers
+        }
@@ -0,0 +1,120 @@
+"""
+AskIan SMTP - Pooled, persistent SMTP sessions
+==============================================
+Keeps a few authenticated SMTP sessions alive between sends instead of
+doing a TLS handshake and login for every reply. Zoho throttles repeated
+logins, and during bursts the handshake was most of the send latency.
+
+Sessions that have been idle for a while are checked with NOOP before
+use; dead ones are dropped and replaced. A send that fails because a
+reused session had silently gone away is retried once on a fresh one.
+"""
+
+import logging
+import queue
+import smtplib
+import threading
+import time
+
+# Idle sessions older than this get a NOOP health check before reuse
+NOOP_AFTER = 15
+# Idle sessions older than this are closed rather than reused (servers
+# drop quiet clients after a few minutes anyway)
+MAX_IDLE = 240
+
+
+class SMTPPool:
+    """A bounded pool of authenticated SMTP sessions, safe to share between threads."""
+
+    def __init__(self, host, user, password, port=465, use_ssl=True, size=2, timeout=30):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.size = size
+        self._idle = queue.LifoQueue()      # (conn, last_used) — newest first
+        self._slots = threading.BoundedSemaphore(size)
+        self.logins = 0
+
+    def _connect(self):
+        if self.use_ssl:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.user:
+            conn.login(self.user, self.password)
+        self.logins += 1
+        logging.info(f"SMTP session opened to {self.host}:{self.port}")
+        return conn
+
+    def _take_idle(self):
+        """Return a healthy idle session, or None if there isn't one."""
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            idle_for = time.monotonic() - last_used
+            if idle_for > MAX_IDLE:
+                _quit(conn)
+                continue
+            if idle_for > NOOP_AFTER:
+                try:
+                    if conn.noop()[0] != 250:
+                        raise smtplib.SMTPException("NOOP refused")
+                except (smtplib.SMTPException, OSError):
+                    logging.info("SMTP session went stale — discarding")
+                    _quit(conn)
+                    continue
+            return conn
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        """Send one message over a pooled session (blocks while all are busy)."""
+        with self._slots:
+            conn = self._take_idle()
+            reused = conn is not None
+            if conn is None:
+                conn = self._connect()
+            try:
+                conn.sendmail(from_addr, to_addrs, msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                _quit(conn)
+                if not reused:
+                    raise
+                # The server had dropped a session we thought was alive, so
+                # the send failed at the first command — retry on a fresh login.
+                logging.info(f"SMTP session dropped mid-send ({e}) — reconnecting")
+                conn = self._connect()
+                try:
+                    conn.sendmail(from_addr, to_addrs, msg)
+                except Exception:
+                    _quit(conn)
+                    raise
+            except Exception:
+                # Refused sender/recipient etc. — don't trust the session's
+                # state after an error, start clean next time.
+                _quit(conn)
+                raise
+            self._idle.put((conn, time.monotonic()))
+
+    def close(self):
+        """Close every idle session."""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            _quit(conn)
+
+
+def _quit(conn):
+    """Close a session politely, ignoring errors from already-dead ones."""
+    try:
+        conn.quit()
+    except (smtplib.SMTPException, OSError):
+        try:
+            conn.close()
+        except OSError:
+            pass
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+AskIan Spam - Local junk pre-classifier
+=======================================
+Marketing mail and phishing that arrive without Precedence: bulk used to
+cost a DeepSeek call each. This is a multinomial naive Bayes model over
+hashed word unigrams and bigrams, scored before a letter is queued, so
+obvious junk can be skipped (or sent a fixed reply) without the LLM.
+
+Features are hashed into a fixed number of buckets (CRC32, stable across
+runs), so the model size doesn't grow with the vocabulary. Training folds
+the per-class counts into one log-likelihood ratio per bucket; scoring a
+letter is then a dictionary lookup per feature and a sum — about 200
+microseconds for a typical letter.
+
+The model is a small JSON file trained from our own mail:
+
+    python askian_spam.py train model.json --spam Junk.mbox --ham Sent-to-us/
+    python askian_spam.py train model.json --spam junk/ --state-db /mnt/data/askian_state.db
+    python askian_spam.py score model.json letter.eml
+
+--ham and --spam take mbox files or directories of .eml files; --state-db
+adds the letters in the reply queue that we actually answered as ham.
+"""
+
+import argparse
+import json
+import logging
+import mailbox
+import math
+import os
+import re
+import sqlite3
+import sys
+import zlib
+from email import message_from_binary_file
+from email.utils import parseaddr
+
+N_FEATURES = 1 << 18
+
+_WORD_RE = re.compile(r"[^\W_]+(?:['’][^\W_]+)*|[$€£%!]")
+_URL_RE = re.compile(r"https?://([^/\s>\"']+)", re.IGNORECASE)
+
+
+def tokens(text, sender=""):
+    """Words, bigrams, link domains and the sender's domain of a letter."""
+    words = _WORD_RE.findall(text.lower())
+    yield from words
+    for a, b in zip(words, words[1:]):
+        yield f"{a} {b}"
+    for domain in _URL_RE.findall(text):
+        yield "link:" + domain.lower()
+    if "@" in sender:
+        yield "from:" + sender.rsplit("@", 1)[1].lower()
+
+
+def features(text, sender="", n_features=N_FEATURES):
+    """{bucket: count} of hashed tokens."""
+    counts = {}
+    for token in tokens(text, sender):
+        bucket = zlib.crc32(token.encode("utf-8")) % n_features
+        counts[bucket] = counts.get(bucket, 0) + 1
+    return counts
+
+
+class SpamClassifier:
+    """Naive Bayes over hashed features; spam_probability() in [0, 1]."""
+
+    def __init__(self, n_features=N_FEATURES, alpha=1.0):
+        self.n_features = n_features
+        self.alpha = alpha
+        self.docs = {"ham": 0, "spam": 0}
+        self.counts = {"ham": {}, "spam": {}}
+        self._compiled = None
+
+    def train(self, texts, label, senders=None):
+        """Add letters of one label ("ham" or "spam")."""
+        senders = senders or [""] * len(texts)
+        class_counts = self.counts[label]
+        for text, sender in zip(texts, senders):
+            self.docs[label] += 1
+            for bucket, n in features(text, sender, self.n_features).items():
+                class_counts[bucket] = class_counts.get(bucket, 0) + n
+        self._compiled = None
+
+    def _compile(self):
+        """Per-bucket log-likelihood ratios (spam over ham)."""
+        totals = {label: sum(c.values()) for label, c in self.counts.items()}
+        denom = {
+            label: math.log(totals[label] + self.alpha * self.n_features)
+            for label in totals
+        }
+        default = denom["ham"] - denom["spam"]
+        weights = {}
+        for bucket in set(self.counts["ham"]) | set(self.counts["spam"]):
+            weights[bucket] = (
+                math.log(self.counts["spam"].get(bucket, 0) + self.alpha) - denom["spam"]
+                - math.log(self.counts["ham"].get(bucket, 0) + self.alpha) + denom["ham"]
+            )
+        prior = math.log(self.docs["spam"] + 1) - math.log(self.docs["ham"] + 1)
+        self._compiled = (prior, default, weights)
+        return self._compiled
+
+    def spam_probability(self, text, sender=""):
+        prior, default, weights = self._compiled or self._compile()
+        score = prior
+        for bucket, n in features(text, sender, self.n_features).items():
+            score += n * weights.get(bucket, default)
+        # Clamp before exp() — long letters give very large scores
+        return 1 / (1 + math.exp(-max(-50.0, min(50.0, score))))
+
+    @property
+    def trained(self):
+        return self.docs["ham"] > 0 and self.docs["spam"] > 0
+
+    def save(self, path):
+        """Write the model as JSON (atomic replace)."""
+        data = {
+            "n_features": self.n_features,
+            "alpha": self.alpha,
+            "docs": self.docs,
+            "counts": {label: {str(b): n for b, n in c.items()} for label, c in self.counts.items()},
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        model = cls(data["n_features"], data["alpha"])
+        model.docs = data["docs"]
+        model.counts = {
+            label: {int(b): n for b, n in c.items()} for label, c in data["counts"].items()
+        }
+        return model
+
+
+def load_model(path):
+    """A trained SpamClassifier from `path`, or None if there isn't a usable one."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        model = SpamClassifier.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"Spam model unreadable, pre-classifier off: {e}")
+        return None
+    if not model.trained:
+        logging.warning(f"Spam model {path} has no ham or no spam examples — pre-classifier off")
+        return None
+    logging.info(f"Spam model loaded: {model.docs['ham']} ham / {model.docs['spam']} spam letters")
+    return model
+
+
+# ============================================================
+# TRAINING FROM OUR OWN MAIL
+# ============================================================
+
+def letter_from_message(msg):
+    """(text, sender) of a parsed message, as the daemon scores it."""
+    from askian_mime import text_from_message
+    text = f"{msg.get('Subject', '')}\n{text_from_message(msg)}"
+    return text, parseaddr(msg.get("Reply-To") or msg.get("From", ""))[1]
+
+
+def read_letters(path):
+    """(text, sender) for every message in an mbox file or a directory of .eml files."""
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".eml"):
+                with open(os.path.join(path, name), "rb") as f:
+                    yield letter_from_message(message_from_binary_file(f))
+    else:
+        for msg in mailbox.mbox(path):
+            yield letter_from_message(msg)
+
+
+def answered_letters(state_db):
+    """
+    (text, sender) for letters in the reply queue that we sent a generated
+    reply to. Templated replies (junk, or acknowledgments under load) are
+    left out: the junk ones went to letters the model already called spam.
+    """
+    db = sqlite3.connect(f"file:{state_db}?mode=ro", uri=True)
+    try:
+        query = "SELECT subject, body, sender FROM jobs WHERE status = 'sent'"
+        if "source" in {row[1] for row in db.execute("PRAGMA table_info(jobs)")}:
+            query += " AND source IS NULL"
+        yield from (
+            (f"{subject or ''}\n{body}", sender) for subject, body, sender in db.execute(query)
+        )
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Train or try the AskIan junk pre-classifier.")
+    sub = p.add_subparsers(dest="command", required=True)
+    train = sub.add_parser("train", help="build a model from labelled mail")
+    train.add_argument("model", help="model file to write (updated if it exists)")
+    train.add_argument("--ham", nargs="*", default=[], help="mbox files / .eml directories of real letters")
+    train.add_argument("--spam", nargs="*", default=[], help="mbox files / .eml directories of junk")
+    train.add_argument("--state-db", help="also use answered letters from this state database as ham")
+    score = sub.add_parser("score", help="print the spam probability of .eml files")
+    score.add_argument("model")
+    score.add_argument("emails", nargs="+")
+    args = p.parse_args(argv)
+
+    if args.command == "score":
+        model = SpamClassifier.load(args.model)
+        for path in args.emails:
+            with open(path, "rb") as f:
+                text, sender = letter_from_message(message_from_binary_file(f))
+            print(f"{model.spam_probability(text, sender):.4f}  {path}")
+        return 0
+
+    model = SpamClassifier.load(args.model) if os.path.exists(args.model) else SpamClassifier()
+    sources = [("ham", read_letters(path)) for path in args.ham]
+    sources += [("spam", read_letters(path)) for path in args.spam]
+    if args.state_db:
+        sources.append(("ham", answered_letters(args.state_db)))
+    for label, letters in sources:
+        letters = list(letters)
+        model.train([t for t, _ in letters], label, [s for _, s in letters])
+    model.save(args.model)
+    print(f"{args.model}: {model.docs['ham']} ham, {model.docs['spam']} spam letters")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
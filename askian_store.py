@@ -0,0 +1,663 @@
+"""
+AskIan Store - SQLite-backed reply state
+========================================
+Replaces the JSON state file that was re-read and rewritten in full every
+poll cycle. Replied Message-IDs and reply events live in indexed tables,
+so dedup lookups and rate-limit counts are O(log n), and every change is
+its own small transaction in WAL mode — a crash mid-write can no longer
+truncate or corrupt the dedup history.
+
+Accepted emails are queued in the jobs table and worked through the
+pipeline stages in askian_queue, so a reply survives a crash or an SMTP
+outage without being generated twice.
+
+Several daemon processes can share one database. New UIDs are recorded
+in the inbound table and each is claimed by one worker under a lease, as
+is each job while a stage works on it. A lease that runs out (its worker
+died) makes the message or job claimable again.
+
+The threads tables hold askian_threads' per-conversation memory, with
+every Message-ID in a conversation mapped to its thread, per correspondent.
+
+An existing askian_state.json is imported on first open and renamed to
+askian_state.json.migrated.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS replied (
+    message_id  TEXT PRIMARY KEY,
+    replied_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS replied_at_idx ON replied (replied_at);
+
+CREATE TABLE IF NOT EXISTS reply_log (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    time        REAL NOT NULL,
+    sender      TEXT NOT NULL,
+    message_id  TEXT,
+    persona     TEXT
+);
+CREATE INDEX IF NOT EXISTS reply_log_time_idx ON reply_log (time);
+CREATE INDEX IF NOT EXISTS reply_log_sender_idx ON reply_log (sender, time);
+
+-- Everyone we have ever replied to (reply_log only keeps a day)
+CREATE TABLE IF NOT EXISTS correspondents (
+    sender      TEXT PRIMARY KEY,
+    first_reply REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    mailbox     TEXT PRIMARY KEY,
+    uidvalidity INTEGER NOT NULL,
+    last_uid    INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS dedup_archive (
+    bucket      INTEGER NOT NULL,
+    seq         INTEGER NOT NULL,
+    count       INTEGER NOT NULL,
+    k           INTEGER NOT NULL,
+    bits        BLOB NOT NULL,
+    PRIMARY KEY (bucket, seq)
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    status       TEXT NOT NULL,      -- deferred, generate, outbox, sent or failed
+    sender       TEXT NOT NULL,
+    message_id   TEXT,
+    subject      TEXT,
+    persona      TEXT NOT NULL,
+    body         TEXT NOT NULL,
+    reply        TEXT,
+    reply_id     INTEGER,            -- the reply_log reservation
+    first_time   INTEGER NOT NULL DEFAULT 0,  -- sender had never been replied to
+    thread_id    TEXT,               -- conversation thread (see threads)
+    source       TEXT,               -- "template"/"ack" for fixed replies, NULL if generated
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error   TEXT,
+    owner        TEXT,               -- worker holding the job in its current stage
+    lease_until  REAL,
+    created      REAL NOT NULL,
+    updated      REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_due_idx ON jobs (status, next_attempt);
+
+-- New UIDs waiting to be triaged, and which worker holds each one
+CREATE TABLE IF NOT EXISTS inbound (
+    mailbox      TEXT NOT NULL,
+    uidvalidity  INTEGER NOT NULL,
+    uid          INTEGER NOT NULL,
+    persona      TEXT,
+    arrived      REAL NOT NULL,
+    owner        TEXT,
+    lease_until  REAL,
+    done         INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (mailbox, uidvalidity, uid)
+);
+CREATE INDEX IF NOT EXISTS inbound_open_idx ON inbound (mailbox, done, lease_until);
+
+-- Conversation memory: a rolling summary and the last few exchanges per thread
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id    TEXT PRIMARY KEY,
+    summary      TEXT NOT NULL,
+    turns        TEXT NOT NULL,      -- JSON [[letter, reply], ...], oldest first
+    last_used    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS threads_used_idx ON threads (last_used);
+
+-- Which thread each Message-ID (theirs and ours) belongs to, for each
+-- correspondent: someone answering a forwarded copy of our reply starts
+-- their own thread rather than reading the original correspondent's
+CREATE TABLE IF NOT EXISTS thread_messages (
+    message_id   TEXT NOT NULL,
+    sender       TEXT NOT NULL,
+    thread_id    TEXT NOT NULL,
+    linked       REAL NOT NULL,
+    PRIMARY KEY (message_id, sender)
+);
+CREATE INDEX IF NOT EXISTS thread_messages_thread_idx ON thread_messages (thread_id);
+"""
+
+
+class StateStore:
+    """Replied Message-IDs and reply events in one SQLite database (WAL mode)."""
+
+    def __init__(self, path, journal_mode="WAL"):
+        self.path = path
+        # Optional askian_dedup.ReplyArchive for IDs older than the exact table
+        self.archive = None
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL needs shared memory, so every process on one host; use
+        # DELETE for a database on a network volume shared between hosts
+        self.db.execute(f"PRAGMA journal_mode={journal_mode}")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute("PRAGMA busy_timeout=5000")
+        self.db.executescript(SCHEMA)
+        self._upgrade_schema()
+
+    def _upgrade_schema(self):
+        """Add columns introduced after a database was first created."""
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(reply_log)")}
+        if "persona" not in columns:
+            self.db.execute("ALTER TABLE reply_log ADD COLUMN persona TEXT")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        if "first_time" not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN first_time INTEGER NOT NULL DEFAULT 0")
+        if "lease_until" not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            self.db.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+        if "thread_id" not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN thread_id TEXT")
+        if "source" not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN source TEXT")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(thread_messages)")}
+        if "sender" not in columns:
+            # Links weren't recorded per correspondent; start them afresh
+            self.db.execute("DROP TABLE thread_messages")
+            self.db.executescript(SCHEMA)
+        if self.db.execute("SELECT 1 FROM correspondents LIMIT 1").fetchone() is None:
+            self.db.execute(
+                "INSERT OR IGNORE INTO correspondents (sender, first_reply) "
+                "SELECT sender, MIN(time) FROM reply_log GROUP BY sender"
+            )
+
+    # --- dedup ---
+
+    def has_replied(self, message_id):
+        with self._lock:
+            row = self.db.execute(
+                "SELECT 1 FROM replied WHERE message_id = ?", (message_id,)
+            ).fetchone()
+        if row is not None:
+            return True
+        # The archive re-reads the stored filters if another worker changed them
+        return self.archive is not None and message_id in self.archive
+
+    def archive_replied(self, before, now=None):
+        """
+        Move replied IDs older than `before` out of the exact table and into
+        the Bloom archive, dropping archive buckets past retention.
+        Returns how many IDs were archived.
+        """
+        now = time.time() if now is None else now
+        with self._lock, self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            entries = self.db.execute(
+                "SELECT message_id, replied_at FROM replied WHERE replied_at < ?", (before,)
+            ).fetchall()
+            # Start from the stored filters, not this process's copy, so IDs
+            # other workers archived into the same buckets are kept
+            self.archive.load(self._archive_rows(), self._archive_version())
+            rows, oldest_bucket = self.archive.archive(entries, now)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO dedup_archive (bucket, seq, count, k, bits) "
+                "VALUES (?, ?, ?, ?, ?)", rows,
+            )
+            self.db.execute("DELETE FROM dedup_archive WHERE bucket < ?", (oldest_bucket,))
+            self.db.execute("DELETE FROM replied WHERE replied_at < ?", (before,))
+            self.archive.version = self._archive_version()
+        return len(entries)
+
+    def load_archive(self):
+        """Persisted Bloom filters as (bucket, seq, count, k, bits) rows, and their version."""
+        with self._lock, self.db:
+            self.db.execute("BEGIN")  # rows and version from one snapshot
+            return self._archive_rows(), self._archive_version()
+
+    def archive_version(self):
+        """A value that changes whenever any worker changes the Bloom archive."""
+        with self._lock:
+            return self._archive_version()
+
+    def _archive_rows(self):
+        return self.db.execute("SELECT bucket, seq, count, k, bits FROM dedup_archive").fetchall()
+
+    def _archive_version(self):
+        # Archiving always raises the summed counts; expiry drops rows
+        return tuple(self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(count), 0), MIN(bucket) FROM dedup_archive"
+        ).fetchone())
+
+    # --- reply events ---
+
+    def record_reply(self, sender, message_id, persona=None, when=None):
+        """Log a reply (and its Message-ID) atomically. Returns the event id."""
+        when = time.time() if when is None else when
+        with self._lock, self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            cur = self.db.execute(
+                "INSERT INTO reply_log (time, sender, message_id, persona) VALUES (?, ?, ?, ?)",
+                (when, sender, message_id, persona),
+            )
+            if message_id:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO replied (message_id, replied_at) VALUES (?, ?)",
+                    (message_id, when),
+                )
+            self.db.execute(
+                "INSERT OR IGNORE INTO correspondents (sender, first_reply) VALUES (?, ?)",
+                (sender, when),
+            )
+            return cur.lastrowid
+
+    def known_senders(self, senders):
+        """The subset of `senders` that have been replied to before."""
+        senders = list(set(senders))
+        known = set()
+        with self._lock:
+            # Chunked to stay under SQLite's bound-parameter limit
+            for i in range(0, len(senders), 500):
+                chunk = senders[i:i + 500]
+                known.update(row[0] for row in self.db.execute(
+                    f"SELECT sender FROM correspondents WHERE sender IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ))
+        return known
+
+    def get_reply(self, event_id):
+        """(time, sender, persona) of a logged reply, or None."""
+        with self._lock:
+            row = self.db.execute(
+                "SELECT time, sender, persona FROM reply_log WHERE id = ?", (event_id,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def remove_reply(self, event_id):
+        """Undo record_reply() for a reply that was never sent."""
+        with self._lock, self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            row = self.db.execute(
+                "SELECT message_id FROM reply_log WHERE id = ?", (event_id,)
+            ).fetchone()
+            self.db.execute("DELETE FROM reply_log WHERE id = ?", (event_id,))
+            if row and row[0]:
+                self.db.execute("DELETE FROM replied WHERE message_id = ?", (row[0],))
+
+    def recent_replies(self, since):
+        """(time, sender, persona) for every reply since the epoch time, oldest first."""
+        with self._lock:
+            return self.db.execute(
+                "SELECT time, sender, persona FROM reply_log WHERE time > ? ORDER BY time",
+                (since,),
+            ).fetchall()
+
+    def prune_log(self, before):
+        """Drop reply events older than the given epoch time."""
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM reply_log WHERE time < ?", (before,))
+
+    # --- reply jobs ---
+
+    def add_job(self, sender, message_id, subject, persona, body, reply_id=None, first_time=False,
+                status="generate", due=None, thread_id=None):
+        """
+        Queue an accepted email for generation (or in another `status`,
+        first due at `due`). Returns the job id.
+        """
+        now = time.time()
+        with self._lock, self.db:
+            cur = self.db.execute(
+                "INSERT INTO jobs (status, sender, message_id, subject, persona, body, reply_id, "
+                "first_time, thread_id, next_attempt, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (status, sender, message_id, subject, persona, body, reply_id, int(first_time),
+                 thread_id, due or now, now, now),
+            )
+            return cur.lastrowid
+
+    def set_job_reply(self, job_id, reply_id):
+        """Attach a reply_log reservation to a job that was queued without one."""
+        with self._lock, self.db:
+            self.db.execute("UPDATE jobs SET reply_id = ? WHERE id = ?", (reply_id, job_id))
+
+    def has_job(self, message_id, status):
+        """True if a job for this Message-ID is waiting in `status`."""
+        with self._lock:
+            return self.db.execute(
+                "SELECT 1 FROM jobs WHERE status = ? AND message_id = ? LIMIT 1", (status, message_id)
+            ).fetchone() is not None
+
+    def job_keys(self, status, limit=10000):
+        """(sender, persona) of the jobs in `status`, soonest due first."""
+        with self._lock:
+            return self.db.execute(
+                "SELECT sender, persona FROM jobs WHERE status = ? ORDER BY next_attempt, id LIMIT ?",
+                (status, limit),
+            ).fetchall()
+
+    def due_jobs(self, status, now, limit):
+        """
+        Jobs in `status` whose next attempt is due and that no worker holds
+        a lease on, oldest first, as dicts without the body and reply text
+        (see get_job).
+        """
+        with self._lock:
+            cur = self.db.execute(
+                "SELECT id, status, sender, message_id, persona, reply_id, first_time, attempts, "
+                "next_attempt, created FROM jobs WHERE status = ? AND next_attempt <= ? "
+                "AND (lease_until IS NULL OR lease_until < ?) ORDER BY next_attempt, id LIMIT ?",
+                (status, now, now, limit),
+            )
+            return _dict_rows(cur)
+
+    def lease_job(self, job_id, status, owner, lease):
+        """
+        Claim a job in `status` for `lease` seconds. False if it has moved
+        on, or another worker's lease on it is still live.
+        """
+        now = time.time()
+        with self._lock, self.db:
+            cur = self.db.execute(
+                "UPDATE jobs SET owner = ?, lease_until = ? WHERE id = ? AND status = ? "
+                "AND (lease_until IS NULL OR lease_until < ? OR owner = ?)",
+                (owner, now + lease, job_id, status, now, owner),
+            )
+            return cur.rowcount == 1
+
+    def get_job(self, job_id):
+        """A whole job row as a dict, or None."""
+        with self._lock:
+            rows = _dict_rows(self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)))
+        return rows[0] if rows else None
+
+    def next_due(self, status, after):
+        """Earliest next_attempt in `status` later than `after`, or None."""
+        with self._lock:
+            return self.db.execute(
+                "SELECT MIN(next_attempt) FROM jobs WHERE status = ? AND next_attempt > ?",
+                (status, after),
+            ).fetchone()[0]
+
+    def advance_job(self, job_id, status, reply=None, source=None):
+        """
+        Move a job to its next stage, due immediately (keeps the reply if
+        None). `source` marks a fixed reply rather than a generated one.
+        """
+        now = time.time()
+        with self._lock, self.db:
+            self.db.execute(
+                "UPDATE jobs SET status = ?, reply = COALESCE(?, reply), source = COALESCE(?, source), "
+                "attempts = 0, next_attempt = ?, last_error = NULL, owner = NULL, lease_until = NULL, "
+                "updated = ? WHERE id = ?",
+                (status, reply, source, now, now, job_id),
+            )
+
+    def retry_job(self, job_id, delay, error):
+        """Count a failed attempt and schedule the next one `delay` seconds out."""
+        now = time.time()
+        with self._lock, self.db:
+            self.db.execute(
+                "UPDATE jobs SET attempts = attempts + 1, next_attempt = ?, last_error = ?, "
+                "owner = NULL, lease_until = NULL, updated = ? WHERE id = ?",
+                (now + delay, error, now, job_id),
+            )
+
+    def fail_job(self, job_id, error):
+        now = time.time()
+        with self._lock, self.db:
+            self.db.execute(
+                "UPDATE jobs SET status = 'failed', attempts = attempts + 1, last_error = ?, "
+                "owner = NULL, lease_until = NULL, updated = ? WHERE id = ?",
+                (error, now, job_id),
+            )
+
+    def count_jobs(self):
+        """{status: number of jobs}"""
+        with self._lock:
+            return dict(self.db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+
+    def count_status(self, status):
+        """Number of jobs in one status (uses the status index)."""
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def prune_jobs(self, before):
+        """Drop sent and failed jobs last touched before the given epoch time."""
+        with self._lock, self.db:
+            self.db.execute(
+                "DELETE FROM jobs WHERE status IN ('sent', 'failed') AND updated < ?", (before,)
+            )
+
+    # --- inbound claims ---
+
+    def add_inbound(self, mailbox, uidvalidity, rows):
+        """Record new UIDs as (uid, persona) rows, ignoring ones already known."""
+        now = time.time()
+        with self._lock, self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO inbound (mailbox, uidvalidity, uid, persona, arrived) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(mailbox, uidvalidity, int(uid), persona, now) for uid, persona in rows],
+            )
+
+    def claim_inbound(self, mailbox, uidvalidity, owner, lease, personas=None, grace=0, limit=500):
+        """
+        Lease up to `limit` untriaged UIDs to `owner`: unclaimed ones, and
+        ones whose lease ran out. With `personas`, only those personas'
+        mail, plus any left unclaimed for longer than `grace` seconds.
+        Returns [(uid, previous owner or None)].
+        """
+        now = time.time()
+        query = (
+            "SELECT uid, owner FROM inbound WHERE mailbox = ? AND uidvalidity = ? AND done = 0 "
+            "AND (lease_until IS NULL OR lease_until < ?)"
+        )
+        params = [mailbox, uidvalidity, now]
+        if personas:
+            query += f" AND (persona IN ({','.join('?' * len(personas))}) OR arrived < ?)"
+            params += list(personas) + [now - grace]
+        with self._lock, self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            rows = self.db.execute(query + " ORDER BY uid LIMIT ?", params + [limit]).fetchall()
+            self.db.executemany(
+                "UPDATE inbound SET owner = ?, lease_until = ? "
+                "WHERE mailbox = ? AND uidvalidity = ? AND uid = ?",
+                [(owner, now + lease, mailbox, uidvalidity, uid) for uid, _ in rows],
+            )
+        return [(uid, previous) for uid, previous in rows]
+
+    def renew_inbound(self, mailbox, uidvalidity, owner, uids, lease):
+        """
+        Extend `owner`'s lease on claimed UIDs. Returns the ones it still
+        holds; one whose lease ran out may have been taken over meanwhile.
+        """
+        now = time.time()
+        held = set()
+        with self._lock, self.db:
+            for uid in uids:
+                cur = self.db.execute(
+                    "UPDATE inbound SET lease_until = ? WHERE mailbox = ? AND uidvalidity = ? "
+                    "AND uid = ? AND owner = ? AND done = 0",
+                    (now + lease, mailbox, uidvalidity, int(uid), owner),
+                )
+                if cur.rowcount:
+                    held.add(uid)
+        return held
+
+    def finish_inbound(self, mailbox, uidvalidity, uids, owner):
+        """Mark UIDs `owner` claimed as triaged (queued or skipped), if it still holds them."""
+        with self._lock, self.db:
+            self.db.executemany(
+                "UPDATE inbound SET done = 1, lease_until = NULL "
+                "WHERE mailbox = ? AND uidvalidity = ? AND uid = ? AND owner = ?",
+                [(mailbox, uidvalidity, int(uid), owner) for uid in uids],
+            )
+
+    def open_inbound(self, mailbox):
+        """How many UIDs in a mailbox are still waiting to be triaged."""
+        with self._lock:
+            return self.db.execute(
+                "SELECT COUNT(*) FROM inbound WHERE mailbox = ? AND done = 0", (mailbox,)
+            ).fetchone()[0]
+
+    def prune_inbound(self, before):
+        """Drop triaged UIDs recorded before the given epoch time."""
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM inbound WHERE done = 1 AND arrived < ?", (before,))
+
+    def drop_unqueued_reply(self, message_id):
+        """
+        Undo a reply reservation that never got as far as a job (its worker
+        died in between), so the message isn't taken as already answered.
+        Returns True if one was dropped.
+        """
+        with self._lock, self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            if self.db.execute(
+                "SELECT 1 FROM jobs WHERE message_id = ? LIMIT 1", (message_id,)
+            ).fetchone():
+                return False
+            cur = self.db.execute("DELETE FROM reply_log WHERE message_id = ?", (message_id,))
+            self.db.execute("DELETE FROM replied WHERE message_id = ?", (message_id,))
+            return cur.rowcount > 0
+
+    # --- conversation threads ---
+
+    def find_thread(self, message_ids, sender):
+        """The thread of `sender`'s any of these Message-IDs was linked to, or None."""
+        message_ids = list(message_ids)
+        if not message_ids:
+            return None
+        with self._lock:
+            row = self.db.execute(
+                f"SELECT thread_id FROM thread_messages WHERE sender = ? AND message_id IN "
+                f"({','.join('?' * len(message_ids))}) LIMIT 1",
+                [sender.lower()] + message_ids,
+            ).fetchone()
+        return row[0] if row else None
+
+    def link_messages(self, thread_id, message_ids, sender):
+        """Record that these Message-IDs belong to `sender`'s thread (first link wins)."""
+        now = time.time()
+        with self._lock, self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO thread_messages (message_id, sender, thread_id, linked) "
+                "VALUES (?, ?, ?, ?)",
+                [(message_id, sender.lower(), thread_id, now) for message_id in message_ids if message_id],
+            )
+
+    def get_thread(self, thread_id):
+        """(summary, turns) of a thread, or None if nothing was remembered."""
+        with self._lock:
+            row = self.db.execute(
+                "SELECT summary, turns FROM threads WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def update_thread(self, thread_id, update):
+        """
+        Replace a thread's (summary, turns) with update(summary, turns), as
+        one transaction so concurrent workers don't lose each other's turns.
+        A thread not yet remembered starts as ("", []).
+        """
+        now = time.time()
+        with self._lock, self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            row = self.db.execute(
+                "SELECT summary, turns FROM threads WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+            summary, turns = update(*((row[0], json.loads(row[1])) if row else ("", [])))
+            self.db.execute(
+                "INSERT INTO threads (thread_id, summary, turns, last_used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (thread_id) DO UPDATE SET summary = excluded.summary, "
+                "turns = excluded.turns, last_used = excluded.last_used",
+                (thread_id, summary, json.dumps(turns), now),
+            )
+
+    def prune_threads(self, keep, before):
+        """
+        Forget all but the `keep` most recently used threads, and links
+        made before `before` to threads that were never remembered.
+        """
+        with self._lock, self.db:
+            cold = [row[0] for row in self.db.execute(
+                "SELECT thread_id FROM threads ORDER BY last_used DESC LIMIT -1 OFFSET ?", (keep,)
+            )]
+            self.db.executemany("DELETE FROM threads WHERE thread_id = ?", [(t,) for t in cold])
+            self.db.executemany("DELETE FROM thread_messages WHERE thread_id = ?", [(t,) for t in cold])
+            self.db.execute(
+                "DELETE FROM thread_messages WHERE linked < ? AND thread_id NOT IN "
+                "(SELECT thread_id FROM threads)",
+                (before,),
+            )
+        return len(cold)
+
+    # --- mailbox sync cursors ---
+
+    def get_sync_cursor(self, mailbox):
+        """(uidvalidity, last_uid) for a mailbox, or None if never synced."""
+        with self._lock:
+            row = self.db.execute(
+                "SELECT uidvalidity, last_uid FROM sync_state WHERE mailbox = ?", (mailbox,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def set_sync_cursor(self, mailbox, uidvalidity, last_uid):
+        with self._lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO sync_state (mailbox, uidvalidity, last_uid) VALUES (?, ?, ?)",
+                (mailbox, uidvalidity, last_uid),
+            )
+
+    # --- migration ---
+
+    def migrate_json(self, json_path):
+        """Import a v4 JSON state file once, then rename it out of the way."""
+        if not os.path.exists(json_path):
+            return False
+        with open(json_path, "r") as f:
+            state = json.load(f)
+
+        now = time.time()
+        with self._lock, self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            # Only the order of replied_ids is known, not their times
+            self.db.executemany(
+                "INSERT OR IGNORE INTO replied (message_id, replied_at) VALUES (?, ?)",
+                [(mid, now) for mid in state.get("replied_ids", []) if mid],
+            )
+            self.db.executemany(
+                "INSERT INTO reply_log (time, sender, message_id) VALUES (?, ?, ?)",
+                [
+                    (_iso_to_epoch(r["time"]), r["sender"], r.get("message_id"))
+                    for r in state.get("reply_log", [])
+                ],
+            )
+            # _upgrade_schema seeded correspondents before this log existed
+            self.db.execute(
+                "INSERT INTO correspondents (sender, first_reply) "
+                "SELECT sender, MIN(time) FROM reply_log WHERE true GROUP BY sender "
+                "ON CONFLICT(sender) DO UPDATE SET "
+                "first_reply = MIN(first_reply, excluded.first_reply)"
+            )
+        os.replace(json_path, json_path + ".migrated")
+        logging.info(
+            f"Migrated {len(state.get('replied_ids', []))} replied IDs and "
+            f"{len(state.get('reply_log', []))} log entries from {json_path}"
+        )
+        return True
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+
+def _dict_rows(cursor):
+    columns = [c[0] for c in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def _iso_to_epoch(value):
+    """The JSON store used naive datetime.utcnow().isoformat() strings."""
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
@@ -0,0 +1,123 @@
+"""
+AskIan Text - Letter clean-up and token budgeting
+=================================================
+What the model is shown of an incoming email. Quoted history (">" lines,
+"On ... wrote:" attributions, Outlook "Original Message" blocks),
+signatures, "Sent from my phone" footers and legal disclaimers are
+stripped, then what is left is fitted to a token budget. When a letter
+is too long, its opening and closing paragraphs are kept and the middle
+is elided, so a question at the bottom survives.
+
+Token counts are a local estimate (one token per word or symbol, plus
+one per six characters of long words). That is close enough to a BPE
+tokenizer for budgeting English prose, and needs no extra dependency.
+"""
+
+import re
+
+ELISION = "\n\n[…]\n\n"
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n(\s*\n)+")
+
+# Everything from one of these lines down is quoted history
+_HISTORY_START_RE = re.compile(
+    r"^\s*(-{2,}\s*Original Message\s*-{2,}"
+    r"|-{2,}\s*Forwarded message\s*-{2,}"
+    r"|_{10,}\s*\n\s*From:"
+    r"|From:\s.*\n\s*Sent:\s)",
+    re.IGNORECASE | re.MULTILINE,
+)
+# "On Mon, 3 Feb 2026 at 10:00, Jo <jo@example.com> wrote:" — often wrapped
+_ATTRIBUTION_RE = re.compile(
+    r"^\s*(On|Le|Am|El|Il)\s[^\n]*(\n[^\n]*){0,2}?"
+    r"(wrote|a écrit|schrieb|escribió|ha scritto)\s*:\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_QUOTE_LINE_RE = re.compile(r"^\s*>.*(\n|$)", re.MULTILINE)
+# RFC 3676 signature separator
+_SIGNATURE_RE = re.compile(r"^-- ?$", re.MULTILINE)
+_FOOTER_LINE_RE = re.compile(
+    r"^\s*(Sent from my \w[^\n]*|Sent from (Mail|Outlook|Yahoo Mail)[^\n]*"
+    r"|Get Outlook for \w+[^\n]*)\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+# Legal boilerplate, matched only on paragraphs at the end of a letter and
+# only on wording a letter writer wouldn't use ("If you are not too busy…")
+_DISCLAIMER_RE = re.compile(
+    r"^\s*(this (e-?mail|message|communication)( and any (files|attachments)[^.]*)? "
+    r"(is|are|may be|contains?) (strictly )?(confidential|privileged"
+    r"|intended (solely|only|exclusively) for)"
+    r"|confidentiality notice|(legal )?disclaimer\s*:"
+    r"|if you (are not the (intended|named) (recipient|addressee)"
+    r"|have received this (e-?mail|message|communication) in error)"
+    r"|please consider the environment before printing)",
+    re.IGNORECASE,
+)
+
+
+def estimate_tokens(text):
+    """Approximate BPE token count for English text."""
+    return sum(1 + (len(t) - 1) // 6 for t in _TOKEN_RE.findall(text))
+
+
+def strip_quoted(text):
+    """Remove quoted reply history, keeping the sender's own words."""
+    history = _HISTORY_START_RE.search(text)
+    if history:
+        text = text[:history.start()]
+    text = _ATTRIBUTION_RE.sub("", text)
+    return _QUOTE_LINE_RE.sub("", text)
+
+
+def strip_signature(text):
+    """Remove the signature block, phone footers and trailing legal disclaimers."""
+    signature = _SIGNATURE_RE.search(text)
+    if signature:
+        text = text[:signature.start()]
+    text = _FOOTER_LINE_RE.sub("", text)
+    paragraphs = [p for p in re.split(r"\n\s*\n", text) if p.strip()]
+    while paragraphs and _DISCLAIMER_RE.match(paragraphs[-1]):
+        paragraphs.pop()
+    return "\n\n".join(paragraphs)
+
+
+def fit_to_budget(text, max_tokens, head_share=0.6):
+    """
+    Cut text to about max_tokens, keeping whole paragraphs from the start
+    (head_share of the budget) and the end, with an elision mark between.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    paragraphs = [p for p in re.split(r"\n\s*\n", text) if p.strip()]
+    sizes = [estimate_tokens(p) for p in paragraphs]
+
+    head, used = [], 0
+    for paragraph, size in zip(paragraphs, sizes):
+        if used + size > max_tokens * head_share:
+            break
+        head.append(paragraph)
+        used += size
+    tail = []
+    for paragraph, size in zip(reversed(paragraphs[len(head):]), reversed(sizes[len(head):])):
+        if used + size > max_tokens:
+            break
+        tail.insert(0, paragraph)
+        used += size
+
+    if not head and not tail:
+        # One enormous paragraph: keep its start and end by characters
+        chars = len(text) * max_tokens // max(1, estimate_tokens(text))
+        cut = int(chars * head_share)
+        return text[:cut].rstrip() + ELISION + text[len(text) - (chars - cut):].lstrip()
+    return "\n\n".join(head) + ELISION + "\n\n".join(tail) if tail else "\n\n".join(head)
+
+
+def prepare_letter(text, max_tokens):
+    """The part of an email body worth showing the model, within max_tokens."""
+    cleaned = strip_signature(strip_quoted(text.replace("\r\n", "\n")))
+    cleaned = _BLANK_LINES_RE.sub("\n\n", cleaned).strip()
+    if not cleaned:
+        # Nothing but quotes or boilerplate — better the original than nothing
+        cleaned = text.strip()
+    return fit_to_budget(cleaned, max_tokens)
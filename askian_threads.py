@@ -0,0 +1,128 @@
+"""
+AskIan Threads - Bounded per-conversation memory
+================================================
+Replies carry In-Reply-To/References, but every letter used to be
+answered as a first contact. A follow-up either lost its context or, if
+the quoted chain survived, spent the letter budget on it.
+
+Letters are grouped into threads by Message-ID and sender. A new letter
+joins the thread of any message it references (their earlier letters
+and our replies) in that sender's correspondence, or else starts a
+thread of its own. So someone answering a forwarded copy of one of our
+replies never sees the original correspondent's letters. For each thread the store
+keeps the last `max_turns` exchanges, each cut to `turn_tokens`, plus a
+rolling summary of older ones. When an exchange falls out of the recent
+window it is reduced to a line giving the gist of each side and
+appended to the summary. The oldest lines drop off once the summary is
+over its share of the budget. So a reply's context costs at most
+`budget` tokens however long the correspondence runs.
+
+The summary is extractive (the opening sentences of each side), not
+written by the model, so remembering a thread costs no LLM call.
+
+Threads live in the state store, so every worker sees them. Only the
+`max_threads` most recently used are kept; colder ones are evicted.
+"""
+
+import re
+
+from askian_text import estimate_tokens, fit_to_budget
+
+_MESSAGE_ID_RE = re.compile(r"<[^<>\s]+>")
+
+CONTEXT_INTRO = "Earlier in your correspondence with this person:\n"
+
+
+def message_ids(header):
+    """The <...> Message-IDs in a References or In-Reply-To header, in order."""
+    return _MESSAGE_ID_RE.findall(header or "")
+
+
+def gist(text, max_tokens):
+    """The opening sentences of a letter, skipping a salutation line."""
+    lines = [line.strip() for line in text.strip().splitlines() if line.strip()]
+    if len(lines) > 1 and lines[0].endswith(","):
+        lines = lines[1:]
+    kept, used = [], 0
+    for word in " ".join(lines).split():
+        used += estimate_tokens(word)
+        if used > max_tokens:
+            # Cut at the last full sentence if there is one, else mid-sentence
+            text = " ".join(kept)
+            cut = max(text.rfind(". "), text.rfind("! "), text.rfind("? "))
+            return text[:cut + 1] if cut > 0 else text + " …"
+        kept.append(word)
+    return " ".join(kept)
+
+
+class ThreadMemory:
+    """Rolling summary plus recent exchanges per thread, within a token budget."""
+
+    def __init__(self, store, budget=600, max_turns=2, turn_tokens=90,
+                 summary_share=0.3, max_threads=5000):
+        self.store = store
+        self.budget = budget
+        self.max_turns = max_turns
+        self.turn_tokens = turn_tokens
+        self.summary_tokens = int(budget * summary_share)
+        self.max_threads = max_threads
+
+    def thread_for(self, sender, message_id, in_reply_to="", references=""):
+        """The thread a letter from `sender` belongs to, linking its Message-IDs to it."""
+        parents = message_ids(in_reply_to) + message_ids(references)[::-1]  # nearest ancestor first
+        thread_id = self.store.find_thread(parents, sender) or message_id
+        if thread_id:
+            self.store.link_messages(thread_id, [message_id, *parents], sender)
+        return thread_id or None
+
+    def link(self, sender, message_id, thread_id):
+        """Add our reply to `sender` to its thread, so answers to it find the thread."""
+        if message_id and thread_id:
+            self.store.link_messages(thread_id, [message_id], sender)
+
+    def context(self, thread_id):
+        """Chat messages recalling the thread, to go before the new letter ([] if none)."""
+        remembered = self.store.get_thread(thread_id) if thread_id else None
+        if not remembered:
+            return []
+        summary, turns = remembered
+        messages = []
+        if summary:
+            messages.append({"role": "system", "content": CONTEXT_INTRO + summary})
+        for letter, reply in turns:
+            messages.append({"role": "user", "content": letter})
+            messages.append({"role": "assistant", "content": reply})
+        return messages
+
+    def add_turn(self, thread_id, letter, reply):
+        """Remember one exchange, folding the oldest into the summary to stay in budget."""
+        if not thread_id:
+            return
+        turn = [fit_to_budget(letter, self.turn_tokens), fit_to_budget(reply, self.turn_tokens)]
+        turn_budget = self.budget - self.summary_tokens
+
+        def update(summary, turns):
+            turns.append(turn)
+            while len(turns) > 1 and (
+                len(turns) > self.max_turns
+                or sum(estimate_tokens(a) + estimate_tokens(b) for a, b in turns) > turn_budget
+            ):
+                summary = self._roll(summary, *turns.pop(0))
+            return summary, turns
+
+        # Read, fold and write in one transaction: other workers may be
+        # answering letters in the same thread
+        self.store.update_thread(thread_id, update)
+
+    def prune(self, before):
+        """Evict threads beyond max_threads, least recently used first."""
+        return self.store.prune_threads(self.max_threads, before)
+
+    def _roll(self, summary, letter, reply):
+        """Append one exchange's gist to the summary, dropping its oldest lines."""
+        side = self.summary_tokens // 6  # room for about three exchanges
+        line = f"- They wrote: {gist(letter, side)} You replied: {gist(reply, side)}"
+        lines = (summary.splitlines() if summary else []) + [line]
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
@@ -22,16 +22,34 @@ Author: Jon Stiles / Claude
 Date: February 2026
 """
 
-import imaplib
-import smtplib
-import email
 from email.mime.text import MIMEText
 from email.utils import make_msgid, formatdate, parseaddr
-import json
 import os
 import time
 import logging
-from datetime import datetime, timedelta
+import socket
+import threading
+
+from askian_imap import (
+    IDLE_TIMEOUT,
+    fetch_headers, find_text_part, fetch_text_parts, decode_part, fetch_full, mark_seen,
+    MailboxSync,
+)
+from askian_accounts import Account, AccountRegistry, serve
+from askian_llm import LLMClient, LLMError, TokenUsage
+from askian_router import LLMRouter, Provider
+from askian_store import StateStore
+from askian_dedup import ReplyArchive
+from askian_cache import ResponseCache
+from askian_queue import StageWorker, RetryLater
+from askian_admission import AdmissionControl
+from askian_threads import ThreadMemory
+from askian_fair import FairScheduler
+from askian_filter import ContentFilter
+from askian_spam import load_model
+from askian_text import prepare_letter, estimate_tokens
+from askian_mime import MAX_MESSAGE_BYTES, extract_text, text_from_message, decode_text
+from askian_metrics import Counter, Histogram, start_http_server
 
 # ============================================================
 # CONFIGURATION
@@ -45,14 +63,75 @@ DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY", "sk-44c5721e2b254942b2c208
 
 # Where to store state (replied message IDs, rate limit counters)
 # Use persistent disk so state survives redeploys
-STATE_FILE = "/mnt/data/askian_state.json"
-LOG_FILE = "/mnt/data/askian_log.txt"
+DATA_DIR = os.environ.get("ASKIAN_DATA_DIR", "/mnt/data")
+STATE_DB = os.path.join(DATA_DIR, "askian_state.db")
+STATE_FILE = os.path.join(DATA_DIR, "askian_state.json")   # pre-SQLite state, migrated on first run
+LOG_FILE = os.path.join(DATA_DIR, "askian_log.txt")
 
 # Safety limits
 MAX_REPLIES_PER_HOUR = 10          # Global rate limit
 MAX_REPLIES_PER_SENDER_PER_HOUR = 10  # Per-sender rate limit
 MAX_REPLY_TOKENS = 800              # Keep responses reasonable
 
+# Dedup horizon. Replied Message-IDs are kept exactly for DEDUP_EXACT_DAYS,
+# then folded into Bloom filters kept for DEDUP_RETENTION_DAYS. A false
+# positive means a new email is wrongly treated as already answered.
+DEDUP_EXACT_DAYS = 30
+DEDUP_RETENTION_DAYS = 365
+DEDUP_FP_BUDGET = 1e-4
+
+# Optional per-persona hourly caps, on top of the two limits above.
+# Personas not listed here are only bound by the global limit.
+# e.g. {"henry": 5, "dave": 3}
+MAX_REPLIES_PER_PERSONA_PER_HOUR = {}
+
+# Fair scheduling — pending replies are interleaved by persona, then by
+# sender, so a flood or a viral persona can't use up the budget alone.
+# Weights are relative shares (default 1); people we have never replied
+# to get FIRST_TIMER_WEIGHT.
+# e.g. {"askian": 2} / {"tim@example.com": 0.5}
+PERSONA_WEIGHTS = {}
+SENDER_WEIGHTS = {}
+FIRST_TIMER_WEIGHT = 4
+
+# Concurrency — how many replies may be generated/sent at once
+MAX_WORKERS = int(os.environ.get("ASKIAN_WORKERS", "4"))
+SMTP_POOL_SIZE = int(os.environ.get("ASKIAN_SMTP_POOL", "2"))  # Kept small — Zoho throttles logins
+
+# Several copies of the daemon can share DATA_DIR. Each new UID and each
+# queued job is leased to one worker at a time; if a worker dies, another
+# takes its mail over once the lease runs out. Across hosts, put DATA_DIR
+# on a shared volume and set ASKIAN_JOURNAL_MODE=DELETE (WAL is local-only).
+WORKER_ID = os.environ.get("ASKIAN_WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+STATE_JOURNAL_MODE = os.environ.get("ASKIAN_JOURNAL_MODE", "WAL")
+CLAIM_LEASE = 120      # seconds a worker may hold a new UID while triaging it (renewed as it goes)
+JOB_LEASE = 300        # seconds a worker may hold a job in one pipeline stage
+JOB_POLL_INTERVAL = 5  # how often each stage looks for jobs other workers queued
+# Sharding: the folder this worker watches, and the personas it answers
+# (comma-separated, empty = all). Mail for other personas is left to their
+# workers for SHARD_GRACE seconds, then any worker may take it.
+MAILBOX = os.environ.get("ASKIAN_MAILBOX", "inbox")
+SHARD_PERSONAS = [p for p in os.environ.get("ASKIAN_PERSONAS", "").replace(" ", "").split(",") if p]
+SHARD_GRACE = 120
+ORPHAN_SWEEP_INTERVAL = 300  # longest IDLE wait, so mail a dead worker left is picked up
+
+# More mail accounts served by this daemon, on top of the one above. Each
+# has its own IMAP session, SMTP pool and reply budget; its personas reply
+# through it. Entries take askian_accounts.Account's arguments, e.g.
+# {"name": "henry", "address": "henry@example.com", "password_env": "HENRY_PASSWORD",
+#  "imap_host": "imap.zoho.eu", "smtp_host": "smtp.zoho.eu", "personas": ["henry"]}
+# Its personas reply from the account's address, or from their own if it
+# is listed in "aliases". Mail to an address that isn't a persona's goes
+# to the account's first persona. The same list can be kept in
+# ACCOUNTS_FILE instead.
+EXTRA_ACCOUNTS = []
+ACCOUNTS_FILE = os.path.join(DATA_DIR, "askian_accounts.json")
+
+# Prometheus-format metrics on http://127.0.0.1:<port>/metrics (0 = off).
+# Give each worker on a host its own ASKIAN_METRICS_PORT; a worker whose
+# port is taken runs without metrics.
+METRICS_PORT = int(os.environ.get("ASKIAN_METRICS_PORT", "9108"))
+
 # ============================================================
 # LOGGING
 # ============================================================
@@ -67,6 +146,55 @@ console = logging.StreamHandler()
 console.setLevel(logging.INFO)
 logging.getLogger().addHandler(console)
 
+# ============================================================
+# METRICS
+# ============================================================
+
+EMAILS_SEEN = Counter("askian_emails_seen_total", "New emails found in the inbox")
+EMAILS_SKIPPED = Counter(
+    "askian_emails_skipped_total", "Emails skipped during triage", ["reason"]
+)
+RATE_LIMITED = Counter(
+    "askian_rate_limited_total", "Emails skipped by a rate limit", ["limit"]
+)
+REPLIES_GENERATED = Counter(
+    "askian_replies_generated_total", "Reply texts produced, by where they came from",
+    ["persona", "source"]
+)
+LETTERS_DEFERRED = Counter(
+    "askian_letters_deferred_total", "Letters deferred until the reply budget has room", ["persona"]
+)
+REPLIES_SENT = Counter("askian_replies_sent_total", "Replies sent", ["persona"])
+SEND_FAILURES = Counter("askian_send_failures_total", "Replies that failed to send", ["persona"])
+LLM_ERRORS = Counter("askian_llm_errors_total", "LLM calls that failed on every provider", ["persona"])
+LLM_REPLIES = Counter("askian_llm_replies_total", "LLM completions, by the provider that answered", ["provider"])
+LLM_TOKENS = Counter(
+    "askian_llm_tokens_total",
+    "LLM tokens used (kind: prompt = uncached prompt, cached, completion)",
+    ["persona", "kind"]
+)
+LLM_COST = Counter("askian_llm_cost_usd_total", "Estimated LLM spend", ["persona"])
+STAGE_SECONDS = Histogram(
+    "askian_stage_seconds", "Time spent in each pipeline stage", ["stage"]
+)
+
+# should_skip() reason prefix -> metric label
+SKIP_REASON_LABELS = {
+    "own email": "own_email",
+    "automated sender": "automated_sender",
+    "already replied": "already_replied",
+    "already deferred": "already_deferred",
+    "auto-submitted": "auto_submitted",
+    "precedence": "precedence",
+    "X-Auto-Response-Suppress": "auto_response_suppress",
+}
+
+def skip_reason_label(reason):
+    for prefix, label in SKIP_REASON_LABELS.items():
+        if reason.startswith(prefix):
+            return label
+    return "other"
+
 # ============================================================
 # PERSONAS
 # ============================================================
@@ -457,54 +585,133 @@ PERSONAS = {
     },
 }
 
+# ============================================================
+# ACCOUNTS
+# ============================================================
+
+# The main account keeps the plain mailbox name as its sync key, so its
+# cursor and claims carry over from single-account versions. Every
+# persona address is an alias of it.
+accounts = AccountRegistry([Account(
+    "askian", EMAIL_ACCOUNT, EMAIL_PASSWORD, IMAP_SERVER, SMTP_SERVER,
+    mailbox=MAILBOX, smtp_pool_size=SMTP_POOL_SIZE, sync_key=MAILBOX,
+    aliases=[p["email"] for p in PERSONAS.values()],
+    max_per_hour=MAX_REPLIES_PER_HOUR,
+    max_per_sender_per_hour=MAX_REPLIES_PER_SENDER_PER_HOUR,
+    max_per_persona_per_hour=MAX_REPLIES_PER_PERSONA_PER_HOUR,
+)])
+_account_defaults = {
+    "smtp_pool_size": SMTP_POOL_SIZE,
+    "max_per_hour": MAX_REPLIES_PER_HOUR,
+    "max_per_sender_per_hour": MAX_REPLIES_PER_SENDER_PER_HOUR,
+}
+accounts.add_entries(EXTRA_ACCOUNTS, _account_defaults)
+accounts.load(ACCOUNTS_FILE, defaults=_account_defaults)
+
+def limiter_for(persona_key):
+    """The rate limiter of the account a persona replies through."""
+    return accounts.for_persona(persona_key).rate_limiter
+
+def account_events(account, events):
+    """Reply-log events (when, sender, persona) that count against `account`."""
+    return [e for e in events if accounts.for_persona(e[2]) is account]
+
+def sender_count(sender):
+    """Replies to a sender inside the window, across all accounts."""
+    return sum(account.rate_limiter.sender_count(sender) for account in accounts)
+
 # ============================================================
 # STATE MANAGEMENT
 # ============================================================
 
+# Makes check-then-reserve atomic while reply workers are running
+state_lock = threading.Lock()
+
+_state_store = None
+
 def load_state():
-    """Load replied message IDs and rate limit state."""
-    if os.path.exists(STATE_FILE):
-        with open(STATE_FILE, "r") as f:
-            return json.load(f)
-    return {"replied_ids": [], "reply_log": []}
+    """Open the state store (once), importing the old JSON file if present."""
+    global _state_store
+    if _state_store is None:
+        _state_store = StateStore(STATE_DB, journal_mode=STATE_JOURNAL_MODE)
+        _state_store.archive = ReplyArchive(
+            _state_store, retention_days=DEDUP_RETENTION_DAYS, fp_budget=DEDUP_FP_BUDGET
+        )
+        _state_store.migrate_json(STATE_FILE)
+        _state_store.threads = ThreadMemory(
+            _state_store, budget=THREAD_CONTEXT_TOKENS, max_turns=THREAD_TURNS, max_threads=MAX_THREADS,
+        )
+        # Each account's in-memory sliding windows are seeded from the reply log
+        for when, sender, persona_key in _state_store.recent_replies(time.time() - 3600):
+            limiter_for(persona_key).record(sender, persona_key, now=when)
+    return _state_store
 
 def save_state(state):
-    """Save state to disk."""
-    # Keep only last 1000 replied IDs to prevent file growing forever
-    state["replied_ids"] = state["replied_ids"][-1000:]
+    """Tidy up the state store. Writes themselves are already durable."""
     # Keep only last 24h of reply log
-    cutoff = (datetime.utcnow() - timedelta(hours=24)).isoformat()
-    state["reply_log"] = [r for r in state["reply_log"] if r["time"] > cutoff]
-    with open(STATE_FILE, "w") as f:
-        json.dump(state, f, indent=2)
+    state.prune_log(time.time() - 24 * 3600)
+    state.prune_jobs(time.time() - FINISHED_JOB_RETENTION)
+    state.prune_inbound(time.time() - FINISHED_JOB_RETENTION)
+    state.threads.prune(time.time() - FINISHED_JOB_RETENTION)
+
+    if reply_cache:
+        reply_cache.save()
+        stats = reply_cache.stats()
+        if stats["hits"]:
+            logging.info(
+                f"Reply cache: {stats['hits']} hits / {stats['misses']} misses, "
+                f"~{stats['saved_seconds']}s of generation saved"
+            )
 
-def check_rate_limit(state, sender_addr):
+    # Age old replied IDs out of the exact table into the Bloom archive
+    archived = state.archive_replied(time.time() - DEDUP_EXACT_DAYS * 24 * 3600)
+    if archived:
+        fp_rate = state.archive.check_budget()
+        logging.info(f"Archived {archived} replied IDs (dedup false-positive estimate {fp_rate:.1e})")
+
+scheduler = FairScheduler(PERSONA_WEIGHTS, SENDER_WEIGHTS, FIRST_TIMER_WEIGHT)
+
+def fair_order(items, sender_of, persona_of, new_senders, recent=None):
+    """Order pending replies fairly across personas and senders."""
+    return scheduler.order(
+        items, sender_of, persona_of, new_senders=new_senders,
+        recent=recent or sender_count,
+    )
+
+def order_jobs(jobs):
+    """Service order for due jobs in a pipeline stage."""
+    # Queued jobs already hold rate-limit reservations; only count the rest
+    pending = {}
+    for job in jobs:
+        pending[job["sender"]] = pending.get(job["sender"], 0) + 1
+    return fair_order(
+        jobs, lambda job: job["sender"], lambda job: job["persona"],
+        {job["sender"] for job in jobs if job["first_time"]},
+        recent=lambda sender: max(0, sender_count(sender) - pending[sender]),
+    )
+
+def check_rate_limit(state, sender_addr, persona_key=None):
     """Check if we've hit rate limits. Returns True if OK to send."""
-    one_hour_ago = (datetime.utcnow() - timedelta(hours=1)).isoformat()
-    recent = [r for r in state["reply_log"] if r["time"] > one_hour_ago]
-
-    # Global limit
-    if len(recent) >= MAX_REPLIES_PER_HOUR:
-        logging.warning(f"Global rate limit hit ({MAX_REPLIES_PER_HOUR}/hr)")
+    reason = limiter_for(persona_key).check(sender_addr, persona_key)
+    if reason:
+        logging.warning(f"Rate limit hit: {reason}")
+        RATE_LIMITED.inc(limit=reason.split(" limit")[0])
         return False
-
-    # Per-sender limit
-    sender_recent = [r for r in recent if r["sender"] == sender_addr]
-    if len(sender_recent) >= MAX_REPLIES_PER_SENDER_PER_HOUR:
-        logging.warning(f"Per-sender rate limit hit for {sender_addr}")
-        return False
-
     return True
 
-def log_reply(state, sender_addr, message_id):
-    """Record that we sent a reply."""
-    state["reply_log"].append({
-        "time": datetime.utcnow().isoformat(),
-        "sender": sender_addr,
-        "message_id": message_id
-    })
-    if message_id:
-        state["replied_ids"].append(message_id)
+def log_reply(state, sender_addr, message_id, persona_key=None):
+    """Record that we sent (or are about to send) a reply. Returns a reservation."""
+    now = time.time()
+    return {
+        "id": state.record_reply(sender_addr, message_id, persona_key, when=now),
+        "limit": limiter_for(persona_key).record(sender_addr, persona_key, now=now),
+    }
+
+def release_reply(state, entry):
+    """Undo a log_reply() reservation for a reply that was never sent."""
+    state.remove_reply(entry["id"])
+    # The reservation is (when, sender, persona)
+    limiter_for(entry["limit"][2]).release(entry["limit"])
 
 # ============================================================
 # CONTENT FILTER
@@ -515,35 +722,66 @@ BANNED_KEYWORDS = [
     # Add more as needed — keep it sensible
 ]
 
-def is_appropriate(text):
+# Longer lists, and [persona] sections, go in this file. Edits are picked
+# up within CONTENT_FILTER_RELOAD seconds, no restart needed.
+CONTENT_FILTER_FILE = os.path.join(DATA_DIR, "askian_banned.txt")
+CONTENT_FILTER_RELOAD = 30
+
+content_filter = ContentFilter(
+    BANNED_KEYWORDS, path=CONTENT_FILTER_FILE, reload_interval=CONTENT_FILTER_RELOAD
+)
+
+def is_appropriate(text, persona_key=None):
     """Basic content check. Returns False if email contains banned content."""
-    text_lower = text.lower()
-    return not any(word in text_lower for word in BANNED_KEYWORDS)
+    term = content_filter.match(text, persona_key)
+    if term:
+        logging.info(f"Content filter matched {term!r}")
+    return term is None
+
+# ============================================================
+# JUNK PRE-CLASSIFIER
+# ============================================================
+# Letters the local model (askian_spam.py) scores at SPAM_THRESHOLD or
+# above never reach DeepSeek. SPAM_ACTION "skip" ignores them, "template"
+# sends JUNK_REPLY instead. No model file = every letter goes through.
+
+SPAM_MODEL_FILE = os.path.join(DATA_DIR, "askian_spam_model.json")
+SPAM_THRESHOLD = 0.99
+SPAM_ACTION = os.environ.get("ASKIAN_SPAM_ACTION", "skip")
+JUNK_REPLY = (
+    "Thank you for your email. It appears to be a circular rather than a letter, "
+    "so I shan't be composing a reply.\n\n{sign_off}"
+)
+
+spam_model = load_model(SPAM_MODEL_FILE)
+
+def junk_probability(subject, body, sender):
+    """Local spam score of a letter, or 0.0 without a model."""
+    if spam_model is None:
+        return 0.0
+    with STAGE_SECONDS.time(stage="classify"):
+        return spam_model.spam_probability(f"{subject}\n{body}", sender)
 
 # ============================================================
 # EMAIL HELPERS
 # ============================================================
 
 def get_email_body(msg):
-    """Extract plain text body from email message."""
-    if msg.is_multipart():
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            content_disposition = str(part.get("Content-Disposition"))
-            if "attachment" not in content_disposition and content_type == "text/plain":
-                try:
-                    return part.get_payload(decode=True).decode("utf-8", errors="replace")
-                except Exception:
-                    return ""
-    else:
-        try:
-            return msg.get_payload(decode=True).decode("utf-8", errors="replace")
-        except Exception:
-            return ""
-    return ""
-
-def get_persona_from_recipient(msg):
-    """Determine which persona to use based on the To address."""
+    """
+    Extract the text body from an email: a parsed message, or raw bytes
+    (parsed incrementally, at most MAX_MESSAGE_BYTES of them). Falls back
+    to the HTML part when there is no plain text.
+    """
+    try:
+        if isinstance(msg, bytes):
+            return extract_text(msg, MAX_MESSAGE_BYTES)
+        return text_from_message(msg)
+    except Exception:
+        return ""
+
+def get_persona_from_recipient(msg, account=None):
+    """Determine which persona to use based on the To address and the account it came to."""
+    account = account or accounts.default
     # Try multiple headers in order of preference
     headers_to_check = ["To", "Delivered-To", "X-Original-To"]
     
@@ -554,11 +792,16 @@ def get_persona_from_recipient(msg):
             _, email_addr = parseaddr(header_value)
             if email_addr and "@" in email_addr:
                 local_part = email_addr.split("@")[0].lower()
-                if local_part in PERSONAS:
+                # A persona of this account, or one addressed by its own address
+                if local_part in PERSONAS and (
+                    accounts.for_persona(local_part) is account
+                    or email_addr.lower() == PERSONAS[local_part]["email"].lower()
+                ):
                     return local_part, PERSONAS[local_part]
 
-    # Default to Ian
-    return "askian", PERSONAS["askian"]
+    # Default to the account's first persona (Ian on the main account)
+    persona_key = account.personas[0] if account.personas else "askian"
+    return persona_key, PERSONAS[persona_key]
 
 def should_skip(msg, state):
     """Determine if we should skip this email. Returns (skip: bool, reason: str)."""
@@ -568,7 +811,7 @@ def should_skip(msg, state):
 
     # Skip our own emails (check main account AND all aliases)
     # BUT: if Reply-To differs, it's from our compose form with a real sender
-    our_addresses = [EMAIL_ACCOUNT.lower()] + [p["email"].lower() for p in PERSONAS.values()]
+    our_addresses = list(accounts.addresses()) + [p["email"].lower() for p in PERSONAS.values()]
     if any(addr in from_addr for addr in our_addresses):
         if not reply_to or reply_to in our_addresses:
             return True, "own email"
@@ -578,8 +821,10 @@ def should_skip(msg, state):
         return True, f"automated sender: {from_addr}"
 
     # Skip if we already replied to this message
-    if message_id and message_id in state.get("replied_ids", []):
+    if message_id and state.has_replied(message_id):
         return True, f"already replied to {message_id}"
+    if message_id and state.has_job(message_id, "deferred"):
+        return True, f"already deferred {message_id}"
 
     # Skip auto-replies (check headers)
     auto_submitted = msg.get("Auto-Submitted", "").lower()
@@ -597,64 +842,228 @@ def should_skip(msg, state):
     return False, ""
 
 # ============================================================
-# DEEPSEEK API
+# LLM PROVIDERS
 # ============================================================
 
-def generate_reply(email_body, persona_key, persona):
-    """Generate a reply using DeepSeek API."""
-    import requests
+# USD per million tokens (deepseek-chat). "cached" prompt tokens are the
+# ones DeepSeek serves from its context cache.
+DEEPSEEK_PRICES = {"cached": 0.028, "prompt": 0.28, "completion": 0.42}
+USAGE_REPORT_INTERVAL = 3600  # seconds between per-persona usage log lines
+
+# More OpenAI-compatible endpoints besides DeepSeek. Each reply goes to
+# whichever healthy provider is answering fastest (see askian_router).
+# Entries take make_provider()'s arguments; prices default to DeepSeek's,
+# use {} for a local model. e.g.
+# {"name": "local", "base_url": "http://127.0.0.1:8080/v1", "model": "llama3", "prices": {}}
+EXTRA_LLM_PROVIDERS = []
+# Send a second request when the first hasn't started answering by its
+# provider's p95 response time; whichever answers first is used
+HEDGE_LLM_REQUESTS = True
+
+def make_provider(name, base_url, model, api_key="", api_key_env=None, prices=None):
+    """A router Provider for one OpenAI-compatible endpoint."""
+    if api_key_env:
+        api_key = os.environ.get(api_key_env, "")
+    # Hedged calls can briefly double the requests in flight
+    client = LLMClient(api_key, base_url=base_url, model=model, pool_size=2 * MAX_WORKERS)
+    return Provider(name, client, prices=prices)
+
+# Each provider has one pooled session for all reply workers, retries
+# 429/5xx with backoff and trips its own circuit breaker when it is down.
+llm_client = LLMRouter(
+    [Provider("deepseek", LLMClient(DEEPSEEK_API_KEY, pool_size=2 * MAX_WORKERS), prices=DEEPSEEK_PRICES)]
+    + [make_provider(**entry) for entry in EXTRA_LLM_PROVIDERS],
+    hedge=HEDGE_LLM_REQUESTS,
+)
+
+token_usage = TokenUsage(DEEPSEEK_PRICES)
+_last_usage_report = time.monotonic()
+
+# DeepSeek caches repeated prompt prefixes. Everything fixed for a persona
+# (character, instructions, sign-off) goes in the system message, built
+# once so it is byte-identical on every call; only the letter varies.
+REPLY_INSTRUCTIONS = (
+    "\n\n---\n"
+    "Each message you receive is a letter delivered to you. "
+    "Compose a reply in character.\n"
+    "Sign off as: {sign_off}"
+)
+
+_persona_prefixes = {}
+
+def persona_prefix(persona_key, persona):
+    """The cacheable leading messages for a persona."""
+    prefix = _persona_prefixes.get(persona_key)
+    if prefix is None:
+        prefix = _persona_prefixes[persona_key] = [{
+            "role": "system",
+            "content": persona["system_prompt"] + REPLY_INSTRUCTIONS.format(sign_off=persona["sign_off"]),
+        }]
+    return prefix
+
+def record_usage(persona_key, usage, provider=None):
+    """Count a response's tokens and cost; log per-persona totals hourly."""
+    global _last_usage_report
+    if not usage:
+        return
+    provider = llm_client.provider(provider) if provider else None
+    prices = provider.prices if provider else None
+    prompt, cached, completion, cost = token_usage.add(persona_key, usage, prices)
+    LLM_TOKENS.inc(prompt - cached, persona=persona_key, kind="prompt")
+    LLM_TOKENS.inc(cached, persona=persona_key, kind="cached")
+    LLM_TOKENS.inc(completion, persona=persona_key, kind="completion")
+    LLM_COST.inc(cost, persona=persona_key)
+
+    if time.monotonic() - _last_usage_report >= USAGE_REPORT_INTERVAL:
+        _last_usage_report = time.monotonic()
+        for key, totals in sorted(token_usage.report().items()):
+            logging.info(
+                f"LLM usage {key}: {totals['calls']} calls, "
+                f"{totals['cache_hit_ratio']:.0%} of {totals['prompt']} prompt tokens cached, "
+                f"{totals['completion']} completion tokens, ${totals['cost']:.4f}"
+            )
+        for name, stats in llm_client.stats().items():
+            p50, p95 = (f"{v:.2f}s" if v is not None else "-" for v in (stats["p50"], stats["p95"]))
+            logging.info(
+                f"LLM provider {name}: response p50 {p50}, p95 {p95}, "
+                f"{stats['error_rate']:.0%} errors, circuit {stats['circuit']}"
+            )
+        if llm_client.hedged:
+            logging.info(f"LLM hedged {llm_client.hedged} calls, hedge answered first {llm_client.hedge_wins} times")
+
+# Stream generation so a slow completion is cut off at REPLY_TIME_BUDGET
+# instead of waiting out the 30s request timeout.
+STREAM_REPLIES = True
+REPLY_TIME_BUDGET = 20   # seconds of wall-clock time per reply
+MIN_PARTIAL_REPLY = 300  # shortest cut-off draft (chars) worth sending
+
+# Repeated letters (chain mail, "are you real?") reuse an earlier reply
+REPLY_CACHE_ENABLED = os.environ.get("ASKIAN_REPLY_CACHE", "1") == "1"
+REPLY_CACHE_FILE = os.path.join(DATA_DIR, "askian_reply_cache.json")
+REPLY_CACHE_SIZE = 500                 # entries (LRU beyond that)
+REPLY_CACHE_TTL = 7 * 24 * 3600        # seconds
+
+reply_cache = (
+    ResponseCache(REPLY_CACHE_FILE, max_entries=REPLY_CACHE_SIZE, ttl=REPLY_CACHE_TTL)
+    if REPLY_CACHE_ENABLED else None
+)
 
-    if not is_appropriate(email_body):
+# What the model is shown of a letter: quoted history, signatures and
+# disclaimers are stripped and the rest fitted to LETTER_TOKEN_BUDGET
+# (opening and closing paragraphs kept, the middle elided).
+LETTER_TOKEN_BUDGET = 600
+
+# Follow-ups (In-Reply-To/References) are answered with what we remember
+# of the conversation: the last THREAD_TURNS exchanges plus a rolling
+# summary of older ones, in at most THREAD_CONTEXT_TOKENS. See askian_threads.
+THREAD_CONTEXT_TOKENS = 600
+THREAD_TURNS = 2
+MAX_THREADS = 5000   # least recently used threads beyond this are forgotten
+
+# Reply length cap per persona, in tokens (about 4 tokens to 3 words).
+# Personas told to keep to 100-300 words don't need MAX_REPLY_TOKENS.
+# Short letters get less room than long ones, but never under
+# MIN_REPLY_TOKENS.
+REPLY_TOKEN_LIMITS = {
+    "henry": 450,
+    "tesla": 520, "shakespeare": 520, "ada": 520, "davinci": 520,
+    "churchill": 520, "tarquin": 520, "dave": 520,
+}
+MIN_REPLY_TOKENS = 400
+
+def reply_max_tokens(persona_key, letter_tokens):
+    """max_tokens for a reply, by persona and length of the letter."""
+    limit = REPLY_TOKEN_LIMITS.get(persona_key, MAX_REPLY_TOKENS)
+    return min(limit, max(MIN_REPLY_TOKENS, MIN_REPLY_TOKENS // 2 + 2 * letter_tokens))
+
+def trim_partial_reply(text):
+    """Cut a truncated reply back to its last complete sentence."""
+    text = text.rstrip()
+    if text.endswith((".", "!", "?")):
+        return text
+    cut = max(text.rfind(p) for p in (". ", "! ", "? ", ".\n", "!\n", "?\n"))
+    return text[:cut + 1].rstrip() if cut > 0 else ""
+
+def generate_reply(email_body, persona_key, persona, backlog=0, thread_id=None):
+    """
+    Generate a reply with the fastest healthy LLM provider (DeepSeek by
+    default), recalling the rest of the conversation if it is a follow-up.
+    """
+    if not is_appropriate(email_body, persona_key):
         logging.warning("Email failed content filter — sending polite decline.")
+        REPLIES_GENERATED.inc(persona=persona_key, source="declined")
         return (
             f"Thank you for your email. Unfortunately, I'm unable to respond "
             f"to this particular message.\n\n{persona['sign_off']}"
         )
 
-    try:
-        response = requests.post(
-            "https://api.deepseek.com/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "deepseek-chat",
-                "max_tokens": MAX_REPLY_TOKENS,
-                "temperature": 0.8,
-                "messages": [
-                    {"role": "system", "content": persona["system_prompt"]},
-                    {"role": "user", "content": (
-                        f"You have received the following letter. "
-                        f"Compose a reply in character.\n\n"
-                        f"---\n{email_body[:2000]}\n---\n\n"
-                        f"Sign off as: {persona['sign_off']}"
-                    )}
-                ]
-            },
-            timeout=30
-        )
+    letter = prepare_letter(email_body, LETTER_TOKEN_BUDGET)
+    threads = load_state().threads
+    # A cached reply to the same words would ignore what came before them
+    context = threads.context(thread_id)
+
+    if reply_cache and not context:
+        cached = reply_cache.get(persona_key, letter)
+        if cached:
+            logging.info(f"Reply cache hit for {persona_key} — no LLM call needed")
+            REPLIES_GENERATED.inc(persona=persona_key, source="cache")
+            threads.add_turn(thread_id, letter, cached)
+            return cached
+
+    if context:
+        logging.info(f"Follow-up in thread {thread_id} — recalling {len(context)} earlier messages")
+    messages = persona_prefix(persona_key, persona) + context + [
+        {"role": "user", "content": letter},
+    ]
+    max_tokens = reply_max_tokens(persona_key, estimate_tokens(letter))
+    # Shorter replies while the generate queue is long, so it drains sooner
+    shed_tokens = admission.max_tokens(max_tokens, backlog)
+    if shed_tokens < max_tokens:
+        logging.info(f"{backlog} replies queued — limiting this one to {shed_tokens} tokens")
+        max_tokens = shed_tokens
 
-        if response.status_code == 200:
-            reply_text = response.json()["choices"][0]["message"]["content"].strip()
-            logging.info(f"DeepSeek reply generated ({len(reply_text)} chars)")
-            return reply_text
-        else:
-            logging.error(f"DeepSeek API error: {response.status_code} - {response.text[:200]}")
-            return (
-                f"My apologies — I am temporarily indisposed and unable to "
-                f"compose a proper reply. Please try again shortly.\n\n{persona['sign_off']}"
+    try:
+        started = time.monotonic()
+        with STAGE_SECONDS.time(stage="llm"):
+            result = llm_client.generate(
+                messages, max_tokens=max_tokens, temperature=0.8,
+                budget=REPLY_TIME_BUDGET if STREAM_REPLIES else None,
+                on_usage=lambda provider, usage: record_usage(persona_key, usage, provider),
             )
-
-    except Exception as e:
-        logging.error(f"DeepSeek request failed: {e}")
+        reply_text, finished = result.text, result.finished
+        LLM_REPLIES.inc(provider=result.provider)
+        record_usage(persona_key, result.usage, result.provider)
+
+        if not finished:
+            # Partial-draft mode: send what we have, cut at a sentence
+            draft = trim_partial_reply(reply_text)
+            if len(draft) < MIN_PARTIAL_REPLY:
+                raise LLMError(f"generation cut off after {REPLY_TIME_BUDGET}s with too little text")
+            logging.warning(f"{result.provider} generation hit the {REPLY_TIME_BUDGET}s budget — sending partial draft")
+            reply_text = f"{draft}\n\n{persona['sign_off']}"
+
+        logging.info(f"Reply generated by {result.provider} ({len(reply_text)} chars)")
+        REPLIES_GENERATED.inc(persona=persona_key, source="llm" if finished else "partial")
+        # Only complete replies are worth repeating
+        if finished and reply_cache and not context:
+            reply_cache.put(persona_key, letter, reply_text, latency=time.monotonic() - started)
+        threads.add_turn(thread_id, letter, reply_text)
+        return reply_text
+
+    except LLMError as e:
+        logging.error(f"LLM request failed on every provider: {e}")
+        LLM_ERRORS.inc(persona=persona_key)
         return (
             f"My apologies — I am temporarily indisposed and unable to "
             f"compose a proper reply. Please try again shortly.\n\n{persona['sign_off']}"
         )
 
-def send_reply(to_address, subject, body, original_msg, persona):
-    """Send reply with proper headers to prevent loops."""
+def send_reply(to_address, subject, body, original_message_id, persona, account=None):
+    """
+    Send reply with proper headers to prevent loops. Returns its
+    Message-ID, or None if it could not be sent.
+    """
+    account = account or accounts.default
     try:
         msg = MIMEText(body)
 
@@ -664,13 +1073,13 @@ def send_reply(to_address, subject, body, original_msg, persona):
         msg["Subject"] = subject
 
         # Send FROM the persona's alias address (not the main account)
-        msg["From"] = f"{persona['name']} <{persona['email']}>"
+        from_address = account.sender_for(persona["email"])
+        msg["From"] = f"{persona['name']} <{from_address}>"
         msg["To"] = to_address
         msg["Date"] = formatdate(localtime=True)
         msg["Message-ID"] = make_msgid(domain="askian.net")
 
         # Threading headers — links reply to original
-        original_message_id = original_msg.get("Message-ID", "")
         if original_message_id:
             msg["In-Reply-To"] = original_message_id
             msg["References"] = original_message_id
@@ -680,119 +1089,443 @@ def send_reply(to_address, subject, body, original_msg, persona):
         msg["X-Auto-Response-Suppress"] = "All"
         msg["Precedence"] = "bulk"
 
-        # Authenticate with the main account but send via the alias
-        with smtplib.SMTP_SSL(SMTP_SERVER, 465) as server:
-            server.login(EMAIL_ACCOUNT, EMAIL_PASSWORD)
-            server.sendmail(persona["email"], [to_address], msg.as_string())
+        # Authenticate with the persona's account but send via the alias.
+        # Each account's SMTP sessions are shared by all reply workers and
+        # kept alive between sends; they are only opened on first use.
+        with STAGE_SECONDS.time(stage="smtp"):
+            account.smtp_pool.sendmail(from_address, [to_address], msg.as_string())
 
-        logging.info(f"Reply sent to {to_address} as {persona['name']} <{persona['email']}> — Subject: \"{subject}\"")
-        return True
+        logging.info(f"Reply sent to {to_address} as {persona['name']} <{from_address}> — Subject: \"{subject}\"")
+        return msg["Message-ID"]
 
     except Exception as e:
         logging.error(f"Failed to send reply to {to_address}: {e}")
-        return False
+        return None
 
 # ============================================================
-# MAIN FETCH & REPLY LOOP
+# REPLY PIPELINE
 # ============================================================
+# Accepted emails are queued as jobs in the state store and move through
+# generate → outbox → sent on two independent worker pools. A failed send
+# is retried with backoff using the stored reply, without another
+# DeepSeek call, and queued jobs survive a restart. Letters the rate
+# limits have no room for wait in "deferred" until they do.
+
+SEND_MAX_ATTEMPTS = 6                 # ~1 hour of retries with the backoff below
+SEND_RETRY_BASE = 60                  # seconds before the first retry, doubling each time
+SEND_RETRY_CAP = 30 * 60
+FINISHED_JOB_RETENTION = 7 * 24 * 3600  # sent/failed jobs are kept this long for inspection
+
+# Load shedding (see askian_admission). Past SHED_SHORT_AFTER seconds of
+# generate backlog replies get shorter; past SHED_ACK_AFTER new letters
+# get ACK_REPLY instead. Letters over the rate limits are deferred for up
+# to SHED_MAX_DEFER, and at most MAX_DEFERRED at a time; the rest are dropped.
+SHED_SHORT_AFTER = 120
+SHED_ACK_AFTER = 15 * 60
+SHED_MAX_DEFER = 24 * 3600
+MAX_DEFERRED = 1000
+DEFER_MAX_ATTEMPTS = 10  # times a deferred letter may find the budget still full
+
+ACK_REPLY = (
+    "Thank you for your letter. I have had rather more post than usual today, "
+    "so I'm afraid this short note will have to stand in for a proper reply.\n\n{sign_off}"
+)
 
-def fetch_and_reply():
-    """Check for unseen emails and reply to them."""
-    state = load_state()
+admission = AdmissionControl(
+    MAX_WORKERS, short_after=SHED_SHORT_AFTER, ack_after=SHED_ACK_AFTER, max_defer=SHED_MAX_DEFER,
+)
 
+def defer_until(booked, sender, persona_key):
+    """
+    Due time for a letter the rate limits turned away, given the deferred
+    letters already `booked` ((sender, persona) pairs), or None to drop it.
+    """
+    if len(booked) >= MAX_DEFERRED:
+        return None
+    account = accounts.for_persona(persona_key)
+    ahead = [key for key in booked if accounts.for_persona(key[1]) is account]
+    return admission.defer_until(account.rate_limiter.free_at(sender, persona_key, ahead), time.time())
+
+defer_worker = None
+generate_worker = None
+send_worker = None
+
+def job_persona(job):
+    return PERSONAS.get(job["persona"], PERSONAS["askian"])
+
+def admit_job(job):
+    """Deferred stage: reserve a reply for the letter now, or push it back again."""
+    state = load_state()
+    with state_lock:
+        if check_rate_limit(state, job["sender"], job["persona"]):
+            reservation = log_reply(state, job["sender"], job["message_id"], job["persona"])
+            state.set_job_reply(job["id"], reservation["id"])
+            return None
+        free_at = limiter_for(job["persona"]).free_at(job["sender"], job["persona"])
+    raise RetryLater("reply budget still full", delay=max(60, round(free_at - time.time())))
+
+def generate_job(job):
+    """Generate stage: returns the reply text to store with the job."""
+    started = time.monotonic()
+    backlog = max(0, load_state().count_status("generate") - 1)
     try:
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-        mail.login(EMAIL_ACCOUNT, EMAIL_PASSWORD)
-        mail.select("inbox")
-
-        result, data = mail.uid("search", None, "UNSEEN")
-        if result != "OK":
-            logging.error("IMAP search failed")
-            return
-
-        uids = data[0].split()
-        if not uids:
-            logging.info("No unseen emails.")
-            mail.logout()
-            return
+        return generate_reply(job["body"], job["persona"], job_persona(job), backlog=backlog,
+                              thread_id=job["thread_id"])
+    finally:
+        admission.observe(time.monotonic() - started)
+
+def send_job(job):
+    """Outbox stage: send the stored reply, or raise to retry later."""
+    sent_id = send_reply(job["sender"], job["subject"], job["reply"], job["message_id"], job_persona(job),
+                         accounts.for_persona(job["persona"]))
+    if not sent_id:
+        SEND_FAILURES.inc(persona=job["persona"])
+        raise RetryLater("SMTP send failed")
+    REPLIES_SENT.inc(persona=job["persona"])
+    # An answer to our reply names it in In-Reply-To; that finds the thread
+    load_state().threads.link(job["sender"], sent_id, job["thread_id"])
+
+def give_up_job(job):
+    """
+    A job failed for good. Release its reservation so it doesn't use up
+    rate-limit budget or block a later redelivery of the same message.
+    """
+    state = load_state()
+    event = state.get_reply(job["reply_id"]) if job["reply_id"] else None
+    if event:
+        with state_lock:
+            release_reply(state, {"id": job["reply_id"], "limit": event})
+
+def start_pipeline():
+    """Start the stage workers (once) and have them check for due jobs."""
+    global defer_worker, generate_worker, send_worker
+    if generate_worker is None:
+        state = load_state()
+        send_worker = StageWorker(
+            state, "outbox", "sent", send_job,
+            workers=sum(account.smtp_pool.size for account in accounts),
+            max_attempts=SEND_MAX_ATTEMPTS, retry_base=SEND_RETRY_BASE, retry_cap=SEND_RETRY_CAP,
+            on_give_up=give_up_job, order=order_jobs, poll_interval=JOB_POLL_INTERVAL,
+            owner=WORKER_ID, lease=JOB_LEASE,
+        ).start()
+        generate_worker = StageWorker(
+            state, "generate", "outbox", generate_job, workers=MAX_WORKERS,
+            on_give_up=give_up_job, then=send_worker, order=order_jobs,
+            poll_interval=JOB_POLL_INTERVAL, owner=WORKER_ID, lease=JOB_LEASE,
+        ).start()
+        defer_worker = StageWorker(
+            state, "deferred", "generate", admit_job, max_attempts=DEFER_MAX_ATTEMPTS,
+            on_give_up=give_up_job, then=generate_worker, order=order_jobs,
+            poll_interval=JOB_POLL_INTERVAL, owner=WORKER_ID, lease=JOB_LEASE,
+        ).start()
+        # Jobs left over from before a restart are due straight away
+        send_worker.wake()
+    generate_worker.wake()
 
-        logging.info(f"Found {len(uids)} unseen email(s)")
+# ============================================================
+# MAIN FETCH & REPLY LOOP
+# ============================================================
 
-        for uid in uids:
-            result, msg_data = mail.uid("fetch", uid, "(RFC822)")
-            if result != "OK":
-                logging.error(f"Failed to fetch UID {uid}")
-                continue
+def fetch_and_reply(mail=None, account=None):
+    """
+    Check one account (the main one by default) for newly arrived emails
+    and queue replies to them. Pass an already-selected IMAP connection to
+    reuse it (IDLE mode); otherwise a fresh connection is opened and
+    logged out afterwards.
+    """
+    account = account or accounts.default
+    state = load_state()
+    sync = MailboxSync(state, account.mailbox, key=account.sync_key)
+    own_connection = mail is None
+    cycle_started = time.perf_counter()
 
-            raw_email = msg_data[0][1]
-            msg = email.message_from_bytes(raw_email)
+    try:
+        if own_connection:
+            mail = account.open_imap()
+            # STATUS is enough to tell nothing has arrived — skip SELECT entirely
+            if sync.unchanged(mail) and not state.open_inbound(account.sync_key):
+                logging.info(f"No new emails ({account.name}).")
+                mail.logout()
+                return
+            mail.select(account.mailbox)
+
+        # Only UIDs above the persisted cursor — constant cost however big
+        # the mailbox gets, and independent of \Seen flags
+        with STAGE_SECONDS.time(stage="imap_search"):
+            uids = sync.new_uids(mail)
+
+        # --- RECORD NEW MAIL ---
+        # One FETCH pulls just the headers and MIME structure of every
+        # new message; bodies are only downloaded for accepted ones.
+        # Other workers may record the same UIDs — each is claimed once.
+        headers = {}
+        if uids:
+            logging.info(f"Found {len(uids)} new email(s) for {account.name}")
+            EMAILS_SEEN.inc(len(uids))
+            with STAGE_SECONDS.time(stage="imap_headers"):
+                headers = fetch_headers(mail, uids)
+            for uid in uids:
+                if uid not in headers:
+                    logging.error(f"Failed to fetch UID {uid}")
+            state.add_inbound(account.sync_key, sync.uidvalidity, [
+                (uid, get_persona_from_recipient(msg, account)[0]) for uid, (msg, _) in headers.items()
+            ])
+            sync.advance(uids)
+
+        # --- CLAIM ---
+        # Lease this worker's share of untriaged mail, including any whose
+        # previous worker died mid-triage
+        claims = state.claim_inbound(
+            account.sync_key, sync.uidvalidity, WORKER_ID, CLAIM_LEASE,
+            personas=SHARD_PERSONAS, grace=SHARD_GRACE,
+        )
+        if not claims:
+            if not uids:
+                logging.info(f"No new emails ({account.name}).")
+            if own_connection:
+                mail.logout()
+            return
+        claimed = [str(uid).encode() for uid, _ in claims]
+        taken_over = {str(uid).encode() for uid, previous in claims if previous}
+        missing = [uid for uid in claimed if uid not in headers]
+        if missing:
+            with STAGE_SECONDS.time(stage="imap_headers"):
+                headers.update(fetch_headers(mail, missing))
+        if taken_over:
+            logging.info(f"Taking over {len(taken_over)} email(s) from a worker that stopped")
+
+        candidates = []
+        for uid in claimed:
+            if uid not in headers:
+                continue  # expunged since it was recorded
+            msg, structure = headers[uid]
 
             from_name, from_addr = parseaddr(msg.get("From", ""))
             reply_to_name, reply_to_addr = parseaddr(msg.get("Reply-To", ""))
-            subject = msg.get("Subject", "(no subject)")
-            message_id = msg.get("Message-ID", "")
-            
+
             # Use Reply-To as actual sender if present (compose form emails)
             actual_sender = reply_to_addr if reply_to_addr else from_addr
-            actual_name = reply_to_name if reply_to_name else from_name
 
-            logging.info(f"Processing UID {uid.decode()} — From: {from_addr}, Subject: {subject}")
+            # --- DETERMINE PERSONA ---
+            persona_key, persona = get_persona_from_recipient(msg, account)
+            candidates.append((uid, msg, structure, actual_sender, persona_key, persona))
+
+        with state_lock:
+            # A dead worker may have reserved a reply it never queued
+            for uid in taken_over & set(headers):
+                message_id = headers[uid][0].get("Message-ID", "")
+                if message_id and state.drop_unqueued_reply(message_id):
+                    logging.info(f"  Released an unqueued reply reservation for {message_id}")
+            # Other workers reserve replies too; count theirs against the limits
+            events = state.recent_replies(time.time() - 3600)
+            for each in accounts:
+                each.rate_limiter.reload(account_events(each, events))
+
+        # --- FAIR ORDER ---
+        # Reserve replies in fair order rather than arrival order, so when
+        # a rate limit bites it is the flood that misses out
+        senders = {c[3] for c in candidates}
+        new_senders = senders - state.known_senders(senders)
+        candidates = fair_order(candidates, lambda c: c[3], lambda c: c[4], new_senders)
+
+        accepted = []
+        booked = None  # deferred letters, loaded the first time one is needed
+        for uid, msg, structure, actual_sender, persona_key, persona in candidates:
+            subject = msg.get("Subject", "(no subject)")
+            message_id = msg.get("Message-ID", "")
+            logging.info(f"Processing UID {uid.decode()} — From: {actual_sender}, Subject: {subject}")
 
             # --- SAFETY CHECKS ---
-            skip, reason = should_skip(msg, state)
-            if skip:
-                logging.info(f"  Skipping: {reason}")
+            # Checked and reserved under the lock so in-flight replies count
+            # towards rate limits and dedup before they are actually sent.
+            with state_lock:
+                skip, reason = should_skip(msg, state)
+                if skip:
+                    logging.info(f"  Skipping: {reason}")
+                    EMAILS_SKIPPED.inc(reason=skip_reason_label(reason))
+                    continue
+
+                due = reservation = None
+                if check_rate_limit(state, actual_sender, persona_key):
+                    reservation = log_reply(state, actual_sender, message_id, persona_key)
+                else:
+                    # --- DEFER ---
+                    # Queue it for when the budget has room rather than drop it
+                    if booked is None:
+                        booked = state.job_keys("deferred", MAX_DEFERRED)
+                    due = defer_until(booked, actual_sender, persona_key)
+                    if due is None:
+                        logging.info(f"  Skipping: rate limit reached and the deferred backlog is full")
+                        EMAILS_SKIPPED.inc(reason="backlog")
+                        continue
+                    booked.append((actual_sender, persona_key))
+
+            accepted.append((
+                uid, msg, structure, actual_sender, subject, persona_key, persona, reservation,
+                actual_sender in new_senders, due,
+            ))
+
+        # Mark triaged messages read so the webmail view matches
+        mark_seen(mail, claimed)
+        # Triage can outlast the lease; keep it for the body downloads
+        state.renew_inbound(account.sync_key, sync.uidvalidity, WORKER_ID, claimed, CLAIM_LEASE)
+
+        # --- FETCH BODIES (text/plain section only where possible) ---
+        parts = {}
+        for uid, msg, structure, *_ in accepted:
+            part = find_text_part(structure)
+            if part:
+                parts[uid] = part
+        with STAGE_SECONDS.time(stage="imap_bodies"):
+            sections = fetch_text_parts(mail, parts)
+
+        # Queue each reply for the pipeline; generation and sending happen
+        # on the stage workers, so the next IMAP cycle doesn't wait for them
+        queued = templated = 0
+        backlog = state.count_status("generate")
+        for (uid, msg, structure, actual_sender, subject, persona_key, persona, reservation,
+             first_time, due) in accepted:
+            # Renewed per letter, and only queued while this worker still holds it
+            if not state.renew_inbound(account.sync_key, sync.uidvalidity, WORKER_ID, [uid], CLAIM_LEASE):
+                logging.warning(f"  UID {uid.decode()} was taken over by another worker — leaving it to them")
+                if reservation:
+                    with state_lock:
+                        release_reply(state, reservation)
                 continue
+            if uid in parts:
+                _, encoding, charset = parts[uid]
+                body = decode_text(decode_part(sections.get(uid, b""), encoding), charset)
+            else:
+                # No plain-text part in the structure (HTML-only mail, or an
+                # odd BODYSTRUCTURE) — parse the start of the raw message
+                with STAGE_SECONDS.time(stage="imap_bodies"):
+                    raw_email = fetch_full(mail, uid, limit=MAX_MESSAGE_BYTES)
+                body = get_email_body(raw_email) if raw_email else ""
 
-            if not check_rate_limit(state, actual_sender):
-                logging.info(f"  Skipping: rate limit reached")
-                continue
-
-            # --- DETERMINE PERSONA ---
-            persona_key, persona = get_persona_from_recipient(msg)
-            logging.info(f"  Persona: {persona['name']} ({persona['email']})")
-
-            # --- GENERATE & SEND ---
-            body = get_email_body(msg)
             if not body.strip():
-                logging.info(f"  Skipping: empty email body")
+                logging.info(f"  UID {uid.decode()} skipped: empty email body")
+                EMAILS_SKIPPED.inc(reason="empty_body")
+                if reservation:
+                    with state_lock:
+                        release_reply(state, reservation)
                 continue
 
-            reply_text = generate_reply(body, persona_key, persona)
-            success = send_reply(actual_sender, subject, reply_text, msg, persona)
-
-            if success:
-                log_reply(state, actual_sender, message_id)
+            # --- LOCAL JUNK CHECK ---
+            # (no budget is spent on junk while letters are being deferred)
+            junk = junk_probability(subject, body, actual_sender)
+            if junk >= SPAM_THRESHOLD and (SPAM_ACTION != "template" or due):
+                logging.info(f"  UID {uid.decode()} skipped: looks like junk (p={junk:.3f})")
+                EMAILS_SKIPPED.inc(reason="spam")
+                if reservation:
+                    with state_lock:
+                        release_reply(state, reservation)
+                continue
 
-            # Small delay between replies
-            time.sleep(2)
+            thread_id = state.threads.thread_for(
+                actual_sender, msg.get("Message-ID", ""), msg.get("In-Reply-To", ""), msg.get("References", ""),
+            )
+            if due:
+                state.add_job(actual_sender, msg.get("Message-ID", ""), subject, persona_key, body,
+                              first_time=first_time, status="deferred", due=due, thread_id=thread_id)
+                logging.info(f"  UID {uid.decode()} deferred until "
+                             f"{time.strftime('%H:%M', time.localtime(due))} — rate limit reached")
+                LETTERS_DEFERRED.inc(persona=persona_key)
+                queued += 1
+                continue
 
-        mail.logout()
+            logging.info(f"  UID {uid.decode()} → {persona['name']} ({persona['email']})")
+
+            # --- QUEUE FOR GENERATE & SEND ---
+            job_id = state.add_job(actual_sender, msg.get("Message-ID", ""), subject, persona_key, body,
+                                   reply_id=reservation["id"], first_time=first_time, thread_id=thread_id)
+            if junk >= SPAM_THRESHOLD:
+                # Straight to the outbox with the fixed reply — no DeepSeek call
+                logging.info(f"  Looks like junk (p={junk:.3f}) — sending the templated reply")
+                REPLIES_GENERATED.inc(persona=persona_key, source="template")
+                state.advance_job(job_id, "outbox", reply=JUNK_REPLY.format(sign_off=persona["sign_off"]),
+                                  source="template")
+                templated += 1
+            elif admission.should_ack(backlog):
+                # The LLM queue is too long to wait in — acknowledge without a DeepSeek call
+                logging.info(f"  {backlog} replies queued — sending the templated acknowledgment")
+                REPLIES_GENERATED.inc(persona=persona_key, source="ack")
+                state.advance_job(job_id, "outbox", reply=ACK_REPLY.format(sign_off=persona["sign_off"]),
+                                  source="ack")
+                templated += 1
+            else:
+                backlog += 1
+            queued += 1
+
+        state.finish_inbound(account.sync_key, sync.uidvalidity, claimed, WORKER_ID)
+
+        if queued:
+            start_pipeline()
+            if templated:
+                send_worker.wake()
+
+        if own_connection:
+            mail.logout()
 
     except Exception as e:
-        logging.error(f"General error: {e}")
+        logging.error(f"General error ({account.name}): {e}")
 
     finally:
         save_state(state)
+        STAGE_SECONDS.observe(time.perf_counter() - cycle_started, stage="cycle")
 
 # ============================================================
 # ENTRY POINT
 # ============================================================
 
-POLL_INTERVAL = 30  # seconds between checks
+POLL_INTERVAL = 30  # seconds between checks (poll mode, or IDLE fallback)
+RECONNECT_DELAY = 10  # seconds to wait before rebuilding a dropped IMAP session
+
+# "idle" keeps one IMAP session per account open and waits for push
+# notifications; "poll" reconnects every POLL_INTERVAL seconds like
+# earlier versions. Accounts whose server lacks IDLE are always polled.
+IMAP_MODE = os.environ.get("ASKIAN_IMAP_MODE", "idle")
+
+def run_event_loop():
+    """Watch every account from this thread and process mail as it arrives."""
+    serve(
+        accounts, lambda account, mail: fetch_and_reply(mail, account),
+        idle_timeout=min(IDLE_TIMEOUT, ORPHAN_SWEEP_INTERVAL),
+        poll_interval=POLL_INTERVAL, reconnect_delay=RECONNECT_DELAY,
+        use_idle=IMAP_MODE == "idle",
+    )
 
 if __name__ == "__main__":
     logging.info("=" * 50)
     logging.info("AskIan v4 started (continuous mode)")
-    logging.info(f"Polling every {POLL_INTERVAL} seconds")
+    if IMAP_MODE == "idle":
+        logging.info(f"IMAP IDLE push mode (re-idle every {IDLE_TIMEOUT}s)")
+    else:
+        logging.info(f"Polling every {POLL_INTERVAL} seconds")
+    logging.info(f"Accounts:")
+    for account in accounts:
+        logging.info(f"  {account.name:25s} → {account.address} ({account.mailbox})")
     logging.info(f"Personas available:")
     for key, p in PERSONAS.items():
-        logging.info(f"  {p['name']:25s} → {p['email']}")
+        logging.info(f"  {p['name']:25s} → {p['email']} via {accounts.for_persona(key).name}")
     logging.info("=" * 50)
 
+    if METRICS_PORT:
+        try:
+            start_http_server(METRICS_PORT)
+        except OSError as e:
+            logging.error(f"Metrics port {METRICS_PORT} unavailable ({e}) — running without metrics; "
+                          f"set ASKIAN_METRICS_PORT per worker")
+
+    # Resume any replies still queued from the last run
+    pending = load_state().count_jobs()
+    if pending.get("generate") or pending.get("outbox") or pending.get("deferred"):
+        logging.info(
+            f"Resuming {pending.get('generate', 0)} replies to generate, "
+            f"{pending.get('outbox', 0)} to send, {pending.get('deferred', 0)} deferred"
+        )
+    start_pipeline()
+
     try:
-        while True:
-            fetch_and_reply()
-            time.sleep(POLL_INTERVAL)
+        run_event_loop()
     except KeyboardInterrupt:
         logging.info("AskIan v4 stopped by user (Ctrl+C)")
\ No newline at end of file
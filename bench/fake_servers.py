@@ -0,0 +1,451 @@
+"""
+In-process stand-ins for Zoho IMAP/SMTP and the DeepSeek API
+============================================================
+Just enough of each protocol for askian_v4 to run against them unchanged:
+
+  start_imap()  IMAP4rev1 with IDLE, UID SEARCH/FETCH/STORE, STATUS and
+                BODYSTRUCTURE / HEADER.FIELDS / partial section fetches
+  start_smtp()  plain SMTP with AUTH, recording when each reply arrives
+  start_llm()   OpenAI-compatible /chat/completions (plain and SSE
+                streaming) with configurable latency and error rate
+
+Every server binds 127.0.0.1 on a free port, serves from daemon threads
+and is returned with .port set.
+"""
+
+import email
+import json
+import random
+import re
+import select
+import socketserver
+import threading
+import time
+from email.parser import BytesHeaderParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def _serve(server):
+    server.port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ============================================================
+# IMAP
+# ============================================================
+
+def _quote(value):
+    if value is None:
+        return "NIL"
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _bodystructure(part):
+    """BODYSTRUCTURE for a parsed message (RFC 3501 7.4.2, extension data trimmed)."""
+    if part.is_multipart():
+        children = "".join(_bodystructure(p) for p in part.get_payload())
+        return f"({children} {_quote(part.get_content_subtype())})"
+    params = (part.get_params() or [])[1:]
+    param_list = "(" + " ".join(f"{_quote(k)} {_quote(v)}" for k, v in params) + ")" if params else "NIL"
+    payload = part.get_payload()
+    raw = payload.encode("utf-8", "surrogateescape") if isinstance(payload, str) else b""
+    encoding = part.get("Content-Transfer-Encoding", "7bit")
+    disposition = part.get_content_disposition()
+    disp = f"({_quote(disposition)} NIL)" if disposition else "NIL"
+    fields = (f"{_quote(part.get_content_maintype())} {_quote(part.get_content_subtype())} "
+              f"{param_list} NIL NIL {_quote(encoding)} {len(raw)}")
+    if part.get_content_maintype() == "text":
+        lines = raw.count(b"\n")
+        return f"({fields} {lines} NIL {disp} NIL NIL)"
+    return f"({fields} NIL {disp} NIL NIL)"
+
+
+def _section(msg, section):
+    """Raw (still transfer-encoded) content of a numbered body part."""
+    part = msg
+    for n in section.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(n) - 1]
+        elif n != "1":
+            return b""
+    payload = part.get_payload()
+    return payload.encode("utf-8", "surrogateescape") if isinstance(payload, str) else b""
+
+
+class Mailbox:
+    """Messages as {"uid", "raw", "flags", "added"} dicts, safe to append to concurrently."""
+
+    def __init__(self, uidvalidity=1):
+        self.messages = []
+        self.uidvalidity = uidvalidity
+        self.next_uid = 1
+        self.lock = threading.Lock()
+        self._parsed = {}
+
+    def add(self, raw):
+        with self.lock:
+            self.messages.append(
+                {"uid": self.next_uid, "raw": raw, "flags": set(), "added": time.monotonic()}
+            )
+            self.next_uid += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.messages)
+
+    def parsed(self, m):
+        msg = self._parsed.get(m["uid"])
+        if msg is None:
+            msg = self._parsed[m["uid"]] = email.message_from_bytes(m["raw"])
+        return msg
+
+    def unseen(self):
+        return sum(1 for m in self.snapshot() if "\\Seen" not in m["flags"])
+
+
+_FETCH_ITEM_RE = re.compile(r"BODY(?:\.PEEK)?\[[^\]]*\](?:<\d+\.\d+>)?|[A-Z0-9.]+", re.I)
+_BODY_ITEM_RE = re.compile(r"BODY(\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?", re.I)
+
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def handle(self):
+        self.known = 0  # EXISTS count this client has been told about
+        self.selected = False
+        self.send("* OK fake IMAP ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.decode().strip().partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            if command == "UID":
+                command, _, args = args.partition(" ")
+                command = "UID " + command.upper()
+            handler = getattr(self, "do_" + command.replace(" ", "_"), None)
+            if self.selected:
+                # Like a real server, report new mail in reply to any command
+                self._announce()
+            if handler is None:
+                self.send(f"{tag} BAD unknown command\r\n")
+            elif handler(tag, args) is False:
+                return
+
+    def do_CAPABILITY(self, tag, args):
+        self.send(f"* CAPABILITY IMAP4rev1 IDLE\r\n{tag} OK done\r\n")
+
+    def do_LOGIN(self, tag, args):
+        self.server.logins += 1
+        self.send(f"{tag} OK logged in\r\n")
+
+    def do_SELECT(self, tag, args):
+        mailbox = self.server.mailbox
+        self.known = len(mailbox.snapshot())
+        self.selected = True
+        self.send(
+            f"* {self.known} EXISTS\r\n* OK [UIDVALIDITY {mailbox.uidvalidity}]\r\n"
+            f"* OK [UIDNEXT {mailbox.next_uid}]\r\n{tag} OK [READ-WRITE] done\r\n"
+        )
+
+    do_EXAMINE = do_SELECT
+
+    def do_STATUS(self, tag, args):
+        mailbox = self.server.mailbox
+        self.send(
+            f"* STATUS INBOX (MESSAGES {len(mailbox.snapshot())} UIDNEXT {mailbox.next_uid} "
+            f"UIDVALIDITY {mailbox.uidvalidity} UNSEEN {mailbox.unseen()})\r\n{tag} OK done\r\n"
+        )
+
+    def do_NOOP(self, tag, args):
+        self._announce()
+        self.send(f"{tag} OK done\r\n")
+
+    def do_LOGOUT(self, tag, args):
+        self.send(f"* BYE\r\n{tag} OK done\r\n")
+        return False
+
+    def do_IDLE(self, tag, args):
+        self.send("+ idling\r\n")
+        while True:
+            self._announce()
+            readable, _, _ = select.select([self.connection], [], [], 0.01)
+            if readable:
+                self.rfile.readline()  # DONE
+                break
+        self.send(f"{tag} OK IDLE terminated\r\n")
+
+    def _announce(self):
+        count = len(self.server.mailbox.snapshot())
+        if count != self.known:
+            self.known = count
+            self.send(f"* {count} EXISTS\r\n")
+
+    def _match(self, spec):
+        messages = self.server.mailbox.snapshot()
+        highest = messages[-1]["uid"] if messages else 0
+        wanted = []
+        for piece in spec.split(","):
+            low, _, high = piece.partition(":")
+            low = highest if low == "*" else int(low)
+            high = low if not high else highest if high == "*" else int(high)
+            low, high = min(low, high), max(low, high)
+            wanted.append((low, high))
+        return [m for m in messages if any(lo <= m["uid"] <= hi for lo, hi in wanted)]
+
+    def do_UID_SEARCH(self, tag, args):
+        criteria = args.upper()
+        messages = self.server.mailbox.snapshot()
+        if "UNSEEN" in criteria:
+            messages = [m for m in messages if "\\Seen" not in m["flags"]]
+        uid_range = re.search(r"UID (\S+)", criteria)
+        if uid_range:
+            allowed = {m["uid"] for m in self._match(uid_range.group(1))}
+            messages = [m for m in messages if m["uid"] in allowed]
+        found = "".join(f" {m['uid']}" for m in messages)
+        self.send(f"* SEARCH{found}\r\n{tag} OK done\r\n")
+
+    def do_UID_FETCH(self, tag, args):
+        spec, _, items = args.partition(" ")
+        items = _FETCH_ITEM_RE.findall(items.strip().strip("()"))
+        if "UID" not in (i.upper() for i in items):
+            items.insert(0, "UID")
+        positions = {m["uid"]: i + 1 for i, m in enumerate(self.server.mailbox.snapshot())}
+        for m in self._match(spec):
+            data = b" ".join(self._fetch_item(m, item) for item in items)
+            self.send(f"* {positions[m['uid']]} FETCH (".encode() + data + b")\r\n")
+        self.send(f"{tag} OK done\r\n")
+
+    def _fetch_item(self, m, item):
+        upper = item.upper()
+        if upper == "UID":
+            return f"UID {m['uid']}".encode()
+        if upper == "FLAGS":
+            return f"FLAGS ({' '.join(sorted(m['flags']))})".encode()
+        if upper == "RFC822.SIZE":
+            return f"RFC822.SIZE {len(m['raw'])}".encode()
+        msg = self.server.mailbox.parsed(m)
+        if upper == "BODYSTRUCTURE":
+            return b"BODYSTRUCTURE " + _bodystructure(msg).encode()
+        if upper == "RFC822":
+            m["flags"].add("\\Seen")
+            return f"RFC822 {{{len(m['raw'])}}}\r\n".encode() + m["raw"]
+
+        peek, section, offset, length = _BODY_ITEM_RE.match(item).groups()
+        if not peek:
+            m["flags"].add("\\Seen")
+        if section == "":
+            data = m["raw"]
+        elif section.upper() == "TEXT":
+            data = m["raw"].partition(b"\r\n\r\n")[2]
+        elif section.upper().startswith("HEADER.FIELDS"):
+            wanted = {f.lower() for f in re.findall(r"[\w-]+", section[len("HEADER.FIELDS"):])}
+            data = b"".join(
+                f"{k}: {v}\r\n".encode() for k, v in msg.items() if k.lower() in wanted
+            ) + b"\r\n"
+        else:
+            data = _section(msg, section)
+        name = f"BODY[{section}]"
+        if offset is not None:
+            data = data[int(offset):int(offset) + int(length)]
+            name += f"<{offset}>"
+        return f"{name} {{{len(data)}}}\r\n".encode() + data
+
+    def do_UID_STORE(self, tag, args):
+        spec, _, rest = args.partition(" ")
+        action, _, flags = rest.partition(" ")
+        flags = set(re.findall(r"\\\w+", flags))
+        for m in self._match(spec):
+            if action.startswith("+"):
+                m["flags"] |= flags
+            elif action.startswith("-"):
+                m["flags"] -= flags
+            else:
+                m["flags"] = set(flags)
+        self.send(f"{tag} OK done\r\n")
+
+
+def start_imap(mailbox=None):
+    server = _TCPServer(("127.0.0.1", 0), _IMAPHandler)
+    server.mailbox = mailbox or Mailbox()
+    server.logins = 0
+    return _serve(server)
+
+
+# ============================================================
+# SMTP
+# ============================================================
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def send(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        self.send("220 fake SMTP ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.send("250-fake\r\n250 AUTH PLAIN LOGIN")
+            elif command.startswith("AUTH"):
+                server.logins += 1
+                self.send("235 authenticated")
+            elif command.startswith(("MAIL", "RCPT", "RSET", "NOOP")):
+                self.send("250 ok")
+            elif command == "DATA":
+                self.send("354 go ahead")
+                lines = []
+                while True:
+                    line = self.rfile.readline()
+                    if line in (b".\r\n", b""):
+                        break
+                    lines.append(line)
+                if server.latency:
+                    time.sleep(server.latency)
+                headers = BytesHeaderParser().parsebytes(b"".join(lines))
+                with server.lock:
+                    server.received.append((time.monotonic(), headers))
+                self.send("250 queued")
+            elif command == "QUIT":
+                self.send("221 bye")
+                return
+            else:
+                self.send("500 unrecognised")
+
+
+def start_smtp(latency=0.0):
+    """latency = seconds the server takes to accept each message."""
+    server = _TCPServer(("127.0.0.1", 0), _SMTPHandler)
+    server.latency = latency
+    server.logins = 0
+    server.received = []    # (arrival time, reply headers)
+    server.lock = threading.Lock()
+    return _serve(server)
+
+
+# ============================================================
+# LLM (chat completions)
+# ============================================================
+
+class _LLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.calls += 1
+        latency = max(0.0, random.gauss(server.latency, server.jitter))
+        if random.random() < server.stall_rate:
+            latency *= 10
+
+        if random.random() < server.error_rate:
+            time.sleep(latency / 4)
+            body = b'{"error": {"message": "overloaded"}}'
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        words = [f"word{i}" for i in range(server.reply_words)]
+        text = "Dear friend, " + " ".join(words) + "."
+        usage = {
+            "prompt_tokens": sum(len(m["content"]) for m in request["messages"]) // 4,
+            "completion_tokens": len(words),
+            "prompt_cache_hit_tokens": self._cached_prefix(request["messages"]),
+        }
+        if request.get("stream"):
+            try:
+                self._stream(text, usage, latency)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # the client gave up (a hedged call that lost)
+            return
+        time.sleep(latency)
+        body = json.dumps({"choices": [{"message": {"content": text}}], "usage": usage}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _cached_prefix(self, messages):
+        """
+        Like DeepSeek's context cache: leading messages already seen in an
+        earlier request count as cached, in 64-token units (~4 chars/token).
+        """
+        server = self.server
+        cached = 0
+        key = ""
+        for message in messages[:-1]:
+            key += message["role"] + "\0" + message["content"] + "\0"
+            with server.lock:
+                seen = key in server.prefixes
+                server.prefixes.add(key)
+            if not seen:
+                break
+            cached = len(key) // 4
+        return cached // 64 * 64
+
+    def _stream(self, text, usage, latency):
+        """Time-to-first-token is a third of the latency, the rest is spread over tokens."""
+        tokens = text.split(" ")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(latency / 3)
+        events = [{"choices": [{"delta": {"content": t + " "}}]} for t in tokens]
+        events.append({"choices": [], "usage": usage})
+        for event in events:
+            time.sleep(latency * 2 / 3 / len(events))
+            self._chunk(f"data: {json.dumps(event)}\n\n".encode())
+        self._chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+def start_llm(latency=0.5, jitter=0.1, error_rate=0.0, reply_words=120, stall_rate=0.0):
+    """
+    latency/jitter: mean and standard deviation of seconds per completion.
+    error_rate: fraction of calls answered with 503 (retryable).
+    stall_rate: fraction of calls that take ten times as long (a slow tail).
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _LLMHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    server.error_rate = error_rate
+    server.stall_rate = stall_rate
+    server.reply_words = reply_words
+    server.calls = 0
+    server.prefixes = set()
+    server.lock = threading.Lock()
+    _serve(server)
+    server.base_url = f"http://127.0.0.1:{server.port}/v1"
+    return server
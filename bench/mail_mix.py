@@ -0,0 +1,150 @@
+"""
+Synthetic inbox traffic for the benchmark
+=========================================
+Each kind of mail the bot meets in the wild, as raw RFC 822 bytes:
+
+  normal      a letter from a new sender to one of the persona aliases
+  bounce      a mailer-daemon delivery status notification
+  auto_reply  an out-of-office with Auto-Submitted: auto-replied
+  flood       the same sender writing again and again
+  attachment  a short letter with a large PDF attached
+  html        an HTML-only letter (no text/plain alternative)
+  spam        marketing or phishing mail with no bulk-mail headers
+
+build_mix() shuffles them in the requested proportions, reproducibly for
+a given seed.
+"""
+
+import random
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formatdate
+
+DEFAULT_MIX = {"normal": 70, "bounce": 8, "auto_reply": 8, "flood": 10, "attachment": 4}
+
+FLOOD_SENDER = "persistent.pen.pal@example.org"
+
+_LETTER = (
+    "Dear {name},\n\n"
+    "I have been reading about your life and wondered what you would make of "
+    "the modern world. In particular, letter number {n}: what do you think of "
+    "{topic}? I would be grateful for your thoughts.\n\n"
+    "Yours sincerely,\nCorrespondent {n}\n"
+)
+_TOPICS = ["electric cars", "the printing press", "space travel", "tea", "gliding",
+           "parliament", "the theatre", "the internet", "pocket calculators"]
+
+
+def _headers(msg, n, sender, to):
+    msg["From"] = sender
+    msg["To"] = to
+    msg["Subject"] = f"A question, letter {n}"
+    msg["Date"] = formatdate()
+    msg["Message-ID"] = f"<bench-{n}@example.org>"
+    return msg
+
+
+def normal(n, rng, aliases):
+    to = rng.choice(aliases)
+    text = _LETTER.format(name=to.split("@")[0].title(), n=n, topic=rng.choice(_TOPICS))
+    return _headers(MIMEText(text), n, f"writer{n}@example.org", to)
+
+
+def flood(n, rng, aliases):
+    msg = normal(n, rng, aliases)
+    msg.replace_header("From", FLOOD_SENDER)
+    return msg
+
+
+def bounce(n, rng, aliases):
+    msg = MIMEMultipart("report", report_type="delivery-status")
+    msg.attach(MIMEText("This message was created automatically by mail delivery software.\n\n"
+                        "A message that you sent could not be delivered to one or more recipients."))
+    msg.attach(MIMEText("Reporting-MTA: dns; mx.example.org\nStatus: 5.1.1\n", "plain"))
+    return _headers(msg, n, "Mail Delivery Subsystem <mailer-daemon@example.org>", rng.choice(aliases))
+
+
+def auto_reply(n, rng, aliases):
+    msg = _headers(MIMEText("I am out of the office until Monday with limited access to email."),
+                   n, f"away{n}@example.org", rng.choice(aliases))
+    msg["Auto-Submitted"] = "auto-replied"
+    return msg
+
+
+def attachment(n, rng, aliases, size=2 * 1024 * 1024):
+    msg = MIMEMultipart("mixed")
+    msg.attach(MIMEText(_LETTER.format(name="Sir", n=n, topic="the attached drawings")))
+    pdf = MIMEApplication(rng.randbytes(size), "pdf")
+    pdf.add_header("Content-Disposition", "attachment", filename=f"drawings{n}.pdf")
+    msg.attach(pdf)
+    return _headers(msg, n, f"engineer{n}@example.org", rng.choice(aliases))
+
+
+_SPAM = [
+    "Congratulations! You have been selected to receive a FREE {prize}. "
+    "Click here to claim your reward before it expires: http://{domain}/claim?id={n}",
+    "Dear customer, your account has been suspended. Verify your password "
+    "within 24 hours at http://{domain}/verify or lose access permanently.",
+    "Limited time offer!!! {prize} at 90% off. Unsubscribe at any time. "
+    "Buy now at http://{domain}/deal/{n} - best price guaranteed $$$",
+]
+_PRIZES = ["iPhone", "gift card", "cruise", "crypto bonus", "designer watch"]
+
+
+def spam(n, rng, aliases):
+    text = rng.choice(_SPAM).format(
+        prize=rng.choice(_PRIZES), domain=f"promo{rng.randint(1, 50)}.example.biz", n=n
+    )
+    return _headers(MIMEText(text), n, f"offers{n}@example.biz", rng.choice(aliases))
+
+
+def html(n, rng, aliases):
+    to = rng.choice(aliases)
+    text = _LETTER.format(name=to.split("@")[0].title(), n=n, topic=rng.choice(_TOPICS))
+    paragraphs = text.replace("\n\n", "</p><p>").replace("\n", "<br>")
+    msg = MIMEText(f"<html><body><p>{paragraphs}</p></body></html>", "html", "iso-8859-1")
+    return _headers(msg, n, f"webmail{n}@example.org", to)
+
+
+KINDS = {
+    "normal": normal,
+    "bounce": bounce,
+    "auto_reply": auto_reply,
+    "flood": flood,
+    "attachment": attachment,
+    "html": html,
+    "spam": spam,
+}
+
+
+def parse_mix(spec):
+    """'normal=70,bounce=10' -> {"normal": 70, "bounce": 10}"""
+    mix = {}
+    for item in spec.split(","):
+        kind, _, weight = item.partition("=")
+        if kind.strip() not in KINDS:
+            raise ValueError(f"unknown mail kind {kind!r} (choose from {', '.join(KINDS)})")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def build_mix(total, mix=None, aliases=("askian@askian.net",), seed=0):
+    """
+    `total` messages drawn in proportion to `mix`. Returns a list of
+    (kind, message_id, raw bytes) in arrival order.
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    weight_sum = sum(mix.values())
+    kinds = []
+    for kind, weight in mix.items():
+        kinds += [kind] * round(total * weight / weight_sum)
+    kinds = (kinds + ["normal"] * total)[:total]
+    rng.shuffle(kinds)
+
+    messages = []
+    for n, kind in enumerate(kinds, 1):
+        msg = KINDS[kind](n, rng, list(aliases))
+        messages.append((kind, msg["Message-ID"], msg.as_bytes().replace(b"\n", b"\r\n")))
+    return messages
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+AskIan Benchmark - Offline throughput and latency
+=================================================
+Runs the real askian_v4 pipeline (IDLE loop, triage, worker pool, LLM
+client, SMTP pool, state store) against in-process fake IMAP, SMTP and
+DeepSeek servers, feeds it a synthetic mix of mail and reports:
+
+  - throughput (emails triaged and replies sent per minute)
+  - end-to-end latency per reply, p50/p99: mail landing in the inbox to
+    the reply being accepted by the SMTP server
+  - peak RSS of the whole process (the fake servers included)
+
+Nothing touches Zoho or DeepSeek, and all state goes to a temp directory.
+
+Usage:
+    python bench/run_bench.py                              # 200 emails, default mix, all at once
+    python bench/run_bench.py --emails 500 --rate 5        # 5 emails/s arriving
+    python bench/run_bench.py --llm-latency 2 --llm-errors 0.05
+    python bench/run_bench.py --llm-providers fast=0.5,slow=2 --llm-stalls 0.05
+    python bench/run_bench.py --mix normal=90,attachment=10 --json before.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_servers import start_imap, start_smtp, start_llm
+from mail_mix import DEFAULT_MIX, build_mix, parse_mix
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, max(0, round(p / 100 * len(samples)) - 1))]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark askian_v4 against local fake servers.")
+    p.add_argument("--emails", type=int, default=200, help="messages to deliver (default 200)")
+    p.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                   help="kind=weight list, e.g. normal=70,bounce=10,flood=20")
+    p.add_argument("--rate", type=float, default=0,
+                   help="arrivals per second (default 0 = whole mix in the inbox at start)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--workers", type=int, default=4, help="reply worker threads")
+    p.add_argument("--smtp-pool", type=int, default=2, help="pooled SMTP sessions")
+    p.add_argument("--llm-latency", type=float, default=0.5, help="mean seconds per completion")
+    p.add_argument("--llm-jitter", type=float, default=0.1, help="std-dev of completion time")
+    p.add_argument("--llm-errors", type=float, default=0.0, help="fraction of calls that get a 503")
+    p.add_argument("--llm-stalls", type=float, default=0.0,
+                   help="fraction of calls that take ten times the latency")
+    p.add_argument("--llm-providers", metavar="NAME=LATENCY,...",
+                   help="route over several fake LLM servers with these mean latencies")
+    p.add_argument("--no-hedge", action="store_true", help="don't hedge slow LLM calls")
+    p.add_argument("--smtp-latency", type=float, default=0.02, help="seconds to accept a message")
+    p.add_argument("--no-stream", action="store_true", help="use plain (non-streamed) completions")
+    p.add_argument("--sender-limit", type=int, default=None,
+                   help="per-sender hourly limit (default: askian_v4's)")
+    p.add_argument("--train-spam", type=int, default=0, metavar="N",
+                   help="train the junk pre-classifier on N extra normal/spam letters first")
+    p.add_argument("--timeout", type=float, default=600, help="give up after this many seconds")
+    p.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    p.add_argument("--verbose", action="store_true", help="show askian_v4's console log")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # askian_v4 configures its log and state paths on import
+    data_dir = tempfile.mkdtemp(prefix="askian-bench-")
+    os.environ["ASKIAN_DATA_DIR"] = data_dir
+    import askian_v4 as bot
+    from askian_llm import LLMClient
+    from askian_router import LLMRouter, Provider
+    from askian_accounts import Account, AccountRegistry
+    if not args.verbose:
+        bot.console.setLevel(logging.WARNING)
+
+    imap = start_imap()
+    smtp = start_smtp(latency=args.smtp_latency)
+    provider_latency = {"deepseek": args.llm_latency}
+    if args.llm_providers:
+        provider_latency = {name: float(latency) for name, latency in
+                     (item.split("=") for item in args.llm_providers.split(","))}
+    llms = {
+        name: start_llm(latency=latency, jitter=args.llm_jitter, error_rate=args.llm_errors,
+                        stall_rate=args.llm_stalls)
+        for name, latency in provider_latency.items()
+    }
+
+    bot.MAX_WORKERS = args.workers
+    bot.admission.workers = args.workers
+    bot.STREAM_REPLIES = not args.no_stream
+    bot.reply_cache = None      # synthetic letters are all different anyway
+    bot.accounts = AccountRegistry([Account(
+        "bench", "bench@askian.net", "bench", "127.0.0.1", "127.0.0.1",
+        imap_port=imap.port, smtp_port=smtp.port, use_ssl=False, smtp_pool_size=args.smtp_pool,
+        sync_key=bot.MAILBOX, max_per_hour=10 ** 9, aliases=[p["email"] for p in bot.PERSONAS.values()],
+        max_per_sender_per_hour=args.sender_limit or bot.MAX_REPLIES_PER_SENDER_PER_HOUR,
+        max_per_persona_per_hour=bot.MAX_REPLIES_PER_PERSONA_PER_HOUR,
+    )])
+    bot.llm_client = LLMRouter([
+        Provider(name, LLMClient("bench", base_url=llm.base_url, pool_size=2 * args.workers))
+        for name, llm in llms.items()
+    ], hedge=not args.no_hedge)
+
+    # Note when each fetch_and_reply cycle finishes, to know when we're done
+    cycle_ends = []
+    fetch_and_reply = bot.fetch_and_reply
+
+    def timed_fetch_and_reply(mail=None, account=None):
+        fetch_and_reply(mail, account)
+        cycle_ends.append(time.monotonic())
+
+    bot.fetch_and_reply = timed_fetch_and_reply
+
+    aliases = [p["email"] for p in bot.PERSONAS.values()]
+    if args.train_spam:
+        # Trained on a different seed from the letters it will score
+        from email import message_from_bytes
+        from askian_spam import SpamClassifier, letter_from_message
+        bot.spam_model = SpamClassifier()
+        for kind, _, raw in build_mix(args.train_spam, {"normal": 1, "spam": 1}, aliases,
+                                      seed=args.seed + 1):
+            text, sender = letter_from_message(message_from_bytes(raw))
+            bot.spam_model.train([text], "spam" if kind == "spam" else "ham", [sender])
+    messages = build_mix(args.emails, args.mix, aliases, seed=args.seed)
+    kinds = {message_id: kind for kind, message_id, _ in messages}
+    arrivals = {}
+    rss_before = peak_rss_mb()
+
+    def deliver():
+        started = time.monotonic()
+        for i, (kind, message_id, raw) in enumerate(messages):
+            if args.rate:
+                time.sleep(max(0.0, started + i / args.rate - time.monotonic()))
+            arrivals[message_id] = time.monotonic()
+            imap.mailbox.add(raw)
+
+    started = time.monotonic()
+    if not args.rate:
+        deliver()
+    else:
+        threading.Thread(target=deliver, daemon=True).start()
+
+    threading.Thread(target=bot.run_event_loop, daemon=True).start()
+
+    # Done once every message has been triaged, the cycle that did it has
+    # returned, and the reply queue has drained
+    all_seen_at = None
+    while time.monotonic() - started < args.timeout:
+        time.sleep(0.05)
+        if len(arrivals) < len(messages) or imap.mailbox.unseen():
+            all_seen_at = None
+            continue
+        all_seen_at = all_seen_at or time.monotonic()
+        if cycle_ends and cycle_ends[-1] > all_seen_at:
+            jobs = bot.load_state().count_jobs()
+            if not jobs.get("generate") and not jobs.get("outbox"):
+                break
+    else:
+        print(f"Timed out after {args.timeout}s", file=sys.stderr)
+    finished = time.monotonic()
+
+    latencies = []
+    by_kind = {}
+    with smtp.lock:
+        received = list(smtp.received)
+    for when, headers in received:
+        message_id = headers.get("In-Reply-To")
+        if message_id in arrivals:
+            latencies.append(when - arrivals[message_id])
+            by_kind.setdefault(kinds[message_id], []).append(when - arrivals[message_id])
+    latencies.sort()
+    for samples in by_kind.values():
+        samples.sort()
+
+    elapsed = finished - started
+    delivered = {}
+    for kind in kinds.values():
+        delivered[kind] = delivered.get(kind, 0) + 1
+    results = {
+        "emails": len(messages),
+        "replies": len(received),
+        "seconds": round(elapsed, 2),
+        "emails_per_min": round(len(messages) / elapsed * 60, 1),
+        "replies_per_min": round(len(received) / elapsed * 60, 1),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": latencies[-1] if latencies else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "rss_before_mb": round(rss_before, 1),
+        "by_kind": {
+            kind: {
+                "delivered": n,
+                "replied": len(by_kind.get(kind, [])),
+                "latency_p50": percentile(by_kind.get(kind, []), 50),
+                "latency_p99": percentile(by_kind.get(kind, []), 99),
+            }
+            for kind, n in delivered.items()
+        },
+        "llm_calls": sum(llm.calls for llm in llms.values()),
+        "llm_calls_by_provider": {name: llm.calls for name, llm in llms.items()},
+        "llm_hedged": bot.llm_client.hedged,
+        "llm_hedge_wins": bot.llm_client.hedge_wins,
+        "llm_usage": bot.token_usage.report(),
+        "deferred": bot.load_state().count_jobs().get("deferred", 0),
+        "imap_logins": imap.logins,
+        "smtp_logins": smtp.logins,
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "verbose")},
+    }
+
+    def fmt(seconds):
+        return "-" if seconds is None else f"{seconds:.3f}s"
+
+    print(f"\nAskIan benchmark — {results['emails']} emails in {elapsed:.1f}s")
+    print(f"  throughput    {results['emails_per_min']} emails/min, {results['replies_per_min']} replies/min")
+    print(f"  end-to-end    p50 {fmt(results['latency_p50'])}  p99 {fmt(results['latency_p99'])}  "
+          f"max {fmt(results['latency_max'])}")
+    print(f"  peak RSS      {results['peak_rss_mb']} MB ({results['rss_before_mb']} MB before the run)")
+    print(f"  connections   {results['imap_logins']} IMAP / {results['smtp_logins']} SMTP logins, "
+          f"{results['llm_calls']} LLM calls")
+    if len(llms) > 1 or results["llm_hedged"]:
+        by_provider = ", ".join(f"{n} {c}" for n, c in results["llm_calls_by_provider"].items())
+        print(f"  LLM routing   {by_provider}; {results['llm_hedged']} hedged, "
+              f"{results['llm_hedge_wins']} won by the hedge")
+    if results["deferred"]:
+        print(f"  deferred      {results['deferred']} letters waiting for the rate limits")
+    usage = results["llm_usage"].values()
+    prompt = sum(u["prompt"] for u in usage)
+    if prompt:
+        print(f"  tokens        {sum(u['cached'] for u in usage) / prompt:.0%} of {prompt} prompt tokens "
+              f"cached, {sum(u['completion'] for u in usage)} completion, "
+              f"${sum(u['cost'] for u in usage):.4f}")
+    for kind, counts in sorted(results["by_kind"].items()):
+        print(f"  {kind:12s}  {counts['replied']:4d} replied of {counts['delivered']:<5d} "
+              f"p50 {fmt(counts['latency_p50'])}  p99 {fmt(counts['latency_p99'])}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+// Streaming variant of chat.js: relays DeepSeek's server-sent events
+// straight through to the browser, so the first tokens show up while
+// the rest of the reply is still being generated.
+
+const DEEPSEEK_API_KEY = process.env.DEEPSEEK_API_KEY;
+
+const CORS_HEADERS = {
+  'Access-Control-Allow-Origin': '*',
+  'Access-Control-Allow-Headers': 'Content-Type',
+  'Access-Control-Allow-Methods': 'POST, OPTIONS'
+};
+
+function jsonResponse(status, data) {
+  return new Response(JSON.stringify(data), {
+    status,
+    headers: { ...CORS_HEADERS, 'Content-Type': 'application/json' }
+  });
+}
+
+export default async (req) => {
+  if (req.method === 'OPTIONS') {
+    return new Response('', { status: 200, headers: CORS_HEADERS });
+  }
+
+  if (req.method !== 'POST') {
+    return new Response('Method Not Allowed', { status: 405, headers: CORS_HEADERS });
+  }
+
+  try {
+    const { messages, system_prompt } = await req.json();
+
+    const upstream = await fetch('https://api.deepseek.com/chat/completions', {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${DEEPSEEK_API_KEY}`
+      },
+      body: JSON.stringify({
+        model: 'deepseek-chat',
+        messages: [
+          { role: 'system', content: system_prompt },
+          ...messages
+        ],
+        max_tokens: 600,
+        temperature: 0.85,
+        stream: true
+      })
+    });
+
+    if (!upstream.ok || !upstream.body) {
+      const detail = await upstream.text();
+      return jsonResponse(502, { error: `API error ${upstream.status}: ${detail.slice(0, 200)}` });
+    }
+
+    // OpenAI-style SSE: "data: {choices:[{delta:{content}}]}" ... "data: [DONE]"
+    return new Response(upstream.body, {
+      status: 200,
+      headers: {
+        ...CORS_HEADERS,
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache'
+      }
+    });
+
+  } catch (err) {
+    return jsonResponse(500, { error: err.message });
+  }
+};
@@ -0,0 +1,35 @@
+"""Letter clean-up must keep ordinary letters whole and only drop real boilerplate."""
+
+from askian_text import prepare_letter, strip_signature
+
+
+def test_everyday_if_you_are_not_is_kept():
+    letter = ("Dear Tesla,\n\nIf you are not too busy, could you explain how "
+              "alternating current works?\n\nThanks, Sam")
+    assert prepare_letter(letter, 600) == letter
+
+
+def test_everyday_this_message_is_intended_is_kept():
+    letter = ("Dear Ada,\n\nThis message is intended as a thank-you for your notes. "
+              "Which machine would you build today?\n\nBest, Jo")
+    assert prepare_letter(letter, 600) == letter
+
+
+def test_disclaimer_wording_mid_letter_is_kept():
+    letter = ("Dear Winston,\n\nDisclaimer: I am no historian.\n\n"
+              "What was the hardest speech to write?\n\nKit")
+    assert prepare_letter(letter, 600) == letter
+
+
+def test_trailing_disclaimers_are_stripped():
+    letter = ("Dear Ada,\n\nWhat is a loop?\n\nJo\n\n"
+              "This email and any attachments are confidential and intended solely "
+              "for the addressee.\n\n"
+              "If you have received this email in error, please notify the sender.\n\n"
+              "Please consider the environment before printing this email.")
+    assert prepare_letter(letter, 600) == "Dear Ada,\n\nWhat is a loop?\n\nJo"
+
+
+def test_signature_and_footer_are_stripped():
+    text = "Dear Henry,\n\nWhich wife was your favourite?\n\nSent from my iPhone\n-- \nPat Smith\n0123 456"
+    assert strip_signature(text).strip() == "Dear Henry,\n\nWhich wife was your favourite?"